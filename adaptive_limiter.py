@@ -0,0 +1,125 @@
+import time
+import asyncio
+from collections import deque
+
+
+
+# === Адаптивный лимит одновременных запросов (AIMD) ===
+class AdaptiveLimiter:
+    """
+    Ограничивает число одновременных запросов к внешнему сервису, подстраивая лимит
+    под его текущее состояние:
+    - пока ответы успешные и задержка не выросла больше чем в latency_tolerance раз
+      относительно базовой, лимит растёт на 1 за каждые «limit» успешных ответов;
+    - на ответы «слишком много запросов» и 5xx лимит делится пополам,
+      на рост задержки — уменьшается на 10%. Снижение — не чаще раза за
+      базовую задержку, чтобы пачка одновременных отказов не обнулила лимит.
+    Лимит растёт, только когда все места заняты.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, latency_tolerance: float = 2.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(min(max(initial, min_limit), max_limit))
+
+        self._in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._baseline: float | None = None       # «нормальная» задержка ответа
+        self._last_decrease = 0.0
+        self._latencies: deque[float] = deque(maxlen=500)
+        self._stats = {"successes": 0, "throttled": 0, "errors": 0, "increases": 0, "decreases": 0}
+
+    # Сколько запросов можно выполнять одновременно прямо сейчас
+    def _capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    # === Получение и возврат места ===
+    async def acquire(self):
+        if not self._waiters and self._in_flight < self._capacity():
+            self._in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже выдано, но ожидающего отменили — возвращаем его
+                self.release()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def release(self):
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._in_flight < self._capacity():
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+
+    # === Результаты запросов ===
+    def on_success(self, latency: float):
+        self._stats["successes"] += 1
+        self._latencies.append(latency)
+
+        # Базовая задержка: минимум наблюдаемой, медленно подтягивается к текущей
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            self._baseline += (latency - self._baseline) * 0.01
+
+        if latency <= self._baseline * self.latency_tolerance:
+            # Аддитивный рост: +1 к лимиту примерно за одно «окно» успешных запросов.
+            # Растём, только если лимит действительно выбран — иначе он ничего не проверяет
+            if self.limit < self.max_limit and self._in_flight >= self._capacity():
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._stats["increases"] += 1
+                self._wake()
+        else:
+            self._decrease(0.9)
+
+    # Сервис просит сбавить темп (429, 503) или отвечает ошибкой 5xx
+    def on_throttle(self):
+        self._stats["throttled"] += 1
+        self._decrease(0.5)
+
+    # Сетевая ошибка или таймаут
+    def on_error(self):
+        self._stats["errors"] += 1
+        self._decrease(0.5)
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._baseline or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self._stats["decreases"] += 1
+
+    # === Метрики: текущий лимит и задержки ===
+    def get_stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        stats = dict(self._stats)
+        stats.update(
+            limit=round(self.limit, 2),
+            in_flight=self._in_flight,
+            waiting=len(self._waiters),
+            baseline_latency_sec=round(self._baseline or 0.0, 3),
+            latency_p50_sec=round(percentile(0.50), 3),
+            latency_p95_sec=round(percentile(0.95), 3),
+            latency_p99_sec=round(percentile(0.99), 3),
+        )
+        return stats
@@ -1,8 +1,12 @@
 import os
+import csv
+import json
+import math
 import tempfile
 import subprocess
+import numpy as np
 from pathlib import Path
-from pydub import AudioSegment
+from dotenv import load_dotenv
 
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -13,12 +17,65 @@ from pathlib import Path
 import tempfile
 
 
-SUPPORTED_FORMATS = ['.mp3', '.flac', '.ogg', '.wav']
+SUPPORTED_FORMATS = ['.mp3', '.flac', '.ogg', '.oga', '.wav']   # .oga — голосовые сообщения Telegram
 NEED_CONVERT_FORMATS = ['.mp4', '.m4a']   # Конвертировать в mp3 (ffmpeg)
 
+# === Параметры аудио, которые ожидает SaluteSpeech ===
+SALUTE_SAMPLE_RATE = 16000
+SALUTE_CHANNELS = 1
+# Кодеки, которые можно резать без перекодирования, и расширение частей
+COPY_CODECS = {"mp3": ".mp3", "pcm_s16le": ".wav"}
+COPY_CUT_MARGIN_MS = 100
+# При перекодировании в mp3 часть длиннее точки разреза на задержку кодера libmp3lame
+# и на неполный последний кадр (при 16 кГц кадр MPEG-2 Layer III — 576 отсчётов)
+MP3_FRAME_SAMPLES = 576
+MP3_ENCODER_DELAY_SAMPLES = 529
+ENCODE_CUT_MARGIN_MS = math.ceil((MP3_FRAME_SAMPLES + MP3_ENCODER_DELAY_SAMPLES) * 1000 / SALUTE_SAMPLE_RATE)
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# === Параметры поиска пауз для границ частей ===
+ENERGY_WINDOW_MS = 20                                          # окно расчёта RMS-энергии
+PAUSE_SMOOTH_MS = 300                                          # сглаживание: ищем паузу, а не провал в одном окне
+PAUSE_TOLERANCE = 1.25                                         # насколько громче минимума может быть точка разреза
+MIN_CHUNK_MS = int(float(os.getenv("MIN_CHUNK_SEC", "30")) * 1000)  # раньше этого момента часть не режем
+SILENCE_DBFS = float(os.getenv("SILENCE_DBFS", "-50"))         # часть тише этого уровня считается тишиной
+PCM_BLOCK_WINDOWS = 3000                                       # окон PCM за одно чтение из ffmpeg (~60 сек.)
+
+
+
+# === Параметры аудиопотока через ffprobe ===
+def probe_audio(file_path: Path | str) -> dict:
+    """
+    Возвращает кодек, частоту дискретизации, число каналов
+    и длительность (сек.) первой аудиодорожки файла.
+    """
+    result = subprocess.run([
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels:format=duration',
+        '-of', 'json', str(file_path)
+    ], check=True, capture_output=True, text=True)
+
+    data = json.loads(result.stdout)
+    streams = data.get("streams") or []
+    if not streams:
+        raise ValueError(f"В файле {Path(file_path).name} нет аудиодорожки.")
+    stream = streams[0]
+
+    return {
+        "codec": stream.get("codec_name"),
+        "sample_rate": int(stream.get("sample_rate") or 0),
+        "channels": int(stream.get("channels") or 0),
+        "duration": float(data.get("format", {}).get("duration") or 0),
+    }
+
+
+
 # === Проверка на соответствие 16 кГц и 1 каналу ===
-def is_valid_for_salute(audio: AudioSegment) -> bool:
-    return audio.frame_rate == 16000 and audio.channels == 1
+def is_valid_for_salute(info: dict) -> bool:
+    return info["sample_rate"] == SALUTE_SAMPLE_RATE and info["channels"] == SALUTE_CHANNELS
 
 
 
@@ -51,28 +108,177 @@ def handle_audio_file(file_path: str) -> Path:
 
 
 
-# === Разделение аудиофайла на части по 60 секунд ===
+# === RMS-энергия аудио по коротким окнам ===
+def compute_rms_energy(file_path: Path | str) -> np.ndarray:
+    """
+    Декодирует файл в PCM 16 кГц моно через ffmpeg и считает RMS-энергию
+    в окнах по ENERGY_WINDOW_MS. PCM читается блоками, каждый блок
+    обрабатывается векторно в NumPy, в памяти хранится только массив уровней.
+    Уровни нормированы: 1.0 — полная шкала.
+    """
+    window = SALUTE_SAMPLE_RATE * ENERGY_WINDOW_MS // 1000
+    window_bytes = window * 2                      # s16le — 2 байта на отсчёт
+    block_bytes = window_bytes * PCM_BLOCK_WINDOWS
+
+    process = subprocess.Popen([
+        'ffmpeg', '-v', 'error',
+        '-i', str(file_path),
+        '-vn', '-ac', str(SALUTE_CHANNELS), '-ar', str(SALUTE_SAMPLE_RATE),
+        '-f', 's16le', '-'
+    ], stdout=subprocess.PIPE)
+
+    levels = []
+    tail = b""
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            data = tail + data
+            usable = len(data) - len(data) % window_bytes
+            tail = data[usable:]
+            if usable:
+                frames = np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32).reshape(-1, window)
+                frames /= 32768.0
+                levels.append(np.sqrt(np.mean(frames * frames, axis=1)))
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.args)
+
+    # Неполное последнее окно
+    if len(tail) >= 2:
+        samples = np.frombuffer(tail[:len(tail) - len(tail) % 2], dtype=np.int16).astype(np.float32) / 32768.0
+        levels.append(np.sqrt(np.mean(samples * samples, keepdims=True)))
+
+    return np.concatenate(levels) if levels else np.zeros(0, dtype=np.float32)
+
+
+
+# === Планирование границ частей по паузам ===
+def plan_chunks(energy: np.ndarray, chunk_ms: int = 58000, min_chunk_ms: int = MIN_CHUNK_MS) -> list[tuple[float, float, bool]]:
+    """
+    Выбирает границы частей: каждая часть заканчивается в самой тихой точке
+    между min_chunk_ms и chunk_ms от её начала, чтобы не резать слова.
+    Из почти равных по тишине точек берётся самая поздняя. Разрез не оставляет
+    в конце записи часть короче min_chunk_ms (или трети остатка, если остаток
+    меньше двух минимальных частей).
+    Возвращает список (начало, конец, тишина) — время в секундах
+    и признак того, что в части нет речи.
+    """
+    total = len(energy)
+    if total == 0:
+        return []
+
+    max_windows = max(1, chunk_ms // ENERGY_WINDOW_MS)
+    min_windows = min(max(1, min_chunk_ms // ENERGY_WINDOW_MS), max_windows)
+
+    # Сглаженная энергия — короткий провал между слогами не считается паузой
+    smooth = max(1, PAUSE_SMOOTH_MS // ENERGY_WINDOW_MS)
+    smoothed = np.convolve(energy, np.ones(smooth, dtype=np.float32) / smooth, mode="same")
+    silence_level = 10 ** (SILENCE_DBFS / 20)
+
+    chunks = []
+    start = 0
+    while start < total:
+        rest = total - start
+        if rest <= max_windows:
+            end = total
+        else:
+            # Остаток после разреза тоже не короче минимума, иначе запись чуть длиннее
+            # N×58 сек. закончится крошечной частью; если на две такие части остатка
+            # не хватает — режем ближе к середине
+            min_part = min_windows if rest >= 2 * min_windows else rest // 3
+            low, high = start + min_part, min(start + max_windows, total - min_part)
+            candidates = smoothed[low:high + 1]
+            # Самая поздняя из почти самых тихих точек — части выходят длиннее, запросов меньше
+            threshold = max(candidates.min() * PAUSE_TOLERANCE, silence_level)
+            end = low + int(np.flatnonzero(candidates <= threshold)[-1])
+        silent = bool(smoothed[start:end].max() < silence_level)
+        chunks.append((start * ENERGY_WINDOW_MS / 1000, end * ENERGY_WINDOW_MS / 1000, silent))
+        start = end
+
+    return chunks
+
+
+
+# === Разделение аудиофайла на части по 58 секунд ===
 def split_audio(file_path: Path, chunk_ms: int = 58000) -> list[Path]:
     """
-    Делит аудиофайл на фрагменты не длиннее 58 секунд (58000 мс).
-    Все части экспортируются в mp3.
-    Возвращает список путей к фрагментам.
+    Делит аудиофайл на фрагменты не длиннее 58 секунд (58000 мс)
+    сегментным мультиплексором ffmpeg: файл читается потоком,
+    части пишутся сразу на диск, в памяти бота аудио целиком не декодируется.
+
+    Границы частей ставятся в паузах речи (см. plan_chunks),
+    части без речи удаляются и в SaluteSpeech не отправляются.
+    Если файл уже 16 кГц моно в mp3 или wav, части нарезаются без перекодирования,
+    иначе — перекодируются в mp3 (16 кГц, моно).
+    Возвращает список путей к фрагментам в порядке следования.
     """
-    audio = AudioSegment.from_file(file_path)
+    file_path = Path(file_path)
+    info = probe_audio(file_path)
+    copy = is_valid_for_salute(info) and info["codec"] in COPY_CODECS
+    ext = COPY_CODECS[info["codec"]] if copy else ".mp3"
+
+    # Без перекодирования ffmpeg режет по границам пакетов (до ~40 мс позже), при перекодировании
+    # часть удлиняют задержка кодера и последний кадр — в обоих случаях оставляем запас,
+    # чтобы часть не превысила chunk_ms
+    plan = plan_chunks(compute_rms_energy(file_path), chunk_ms - (COPY_CUT_MARGIN_MS if copy else ENCODE_CUT_MARGIN_MS))
+    if not plan:
+        return []
+    cut_times = ",".join(f"{end:.3f}" for _, end, _ in plan[:-1])
+
+    # ffmpeg перечисляет созданные части в этом файле: имя, начало, конец
+    list_path = file_path.with_name(f"{file_path.stem}_parts.csv")
+    pattern = file_path.with_name(f"{file_path.stem}_part%04d{ext}")
+
+    command = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-i', str(file_path),
+        '-vn', '-map', '0:a:0',
+    ]
+    if copy:
+        command += ['-c:a', 'copy']
+    else:
+        command += ['-ac', str(SALUTE_CHANNELS), '-ar', str(SALUTE_SAMPLE_RATE), '-c:a', 'libmp3lame']
+    command += ['-f', 'segment']
+    if cut_times:
+        command += ['-segment_times', cut_times]
+    else:
+        # Одна часть — точки разреза за пределами записи
+        command += ['-segment_time', f"{plan[0][1] + 1:.3f}"]
+    command += [
+        '-reset_timestamps', '1',
+        '-segment_list', str(list_path),
+        '-segment_list_type', 'csv',
+        str(pattern)
+    ]
+
+    try:
+        subprocess.run(command, check=True)
+        with open(list_path, newline="", encoding="utf-8") as f:
+            segments = [(row[0], float(row[1])) for row in csv.reader(f) if row]
+    finally:
+        try:
+            os.remove(list_path)
+        except Exception:
+            pass
+
+    # Сопоставляем созданные части с планом по времени начала и отбрасываем тишину
+    starts = np.array([start for start, _, _ in plan])
     output_paths = []
-
-    total_length = len(audio)
-
-    for i in range(0, total_length, chunk_ms):
-        chunk = audio[i:i + chunk_ms]
-
-        # Страхуемся: даже если по какой-то причине кусок оказался длиннее — обрезаем
-        if len(chunk) > chunk_ms:
-            chunk = chunk[:chunk_ms]
-
-        chunk_path = file_path.with_name(f"{file_path.stem}_part{i // chunk_ms}.mp3")
-        chunk.export(chunk_path, format="mp3")
-        output_paths.append(chunk_path)
+    for name, segment_start in segments:
+        part_path = file_path.with_name(name)
+        idx = int(np.argmin(np.abs(starts - segment_start)))
+        if plan[idx][2]:
+            try:
+                os.remove(part_path)
+            except Exception:
+                pass
+            continue
+        output_paths.append(part_path)
 
     return output_paths
 
@@ -82,18 +288,73 @@ def split_audio(file_path: Path, chunk_ms: int = 58000) -> list[Path]:
 font_path = os.path.join("fonts", "DejaVuSans.ttf")
 pdfmetrics.registerFont(TTFont("DejaVuSans", font_path))
 
+# === Разбивка текста на строки заданной ширины ===
+def layout_lines(text: str, font_name: str, font_size: float, max_width: float):
+    """
+    Генератор строк для PDF: абзацы по "\n", слова по пробелу, в строку добавляются
+    слова, пока её ширина (с завершающим пробелом) меньше max_width.
+
+    Ширина строки не пересчитывается целиком для каждого слова, а накапливается:
+    ширина слова считается один раз по ширинам глифов шрифта и кэшируется, поэтому
+    время разбивки линейно по длине текста. Результат совпадает с прежним расчётом
+    через pdfmetrics.stringWidth: ширины глифов в единицах шрифта суммируются без
+    погрешности, а в пункты переводятся той же формулой 0.001 * size * сумма.
+    """
+    font = pdfmetrics.getFont(font_name)
+    glyph_width = font.face.charWidths.get
+    default_width = font.face.defaultWidth
+    scale = 0.001 * font_size
+    space_width = glyph_width(ord(" "), default_width)
+    word_widths: dict[str, float] = {}
+
+    for paragraph in text.split("\n"):              # разбиваем на абзацы
+        line_words = []                              # слова текущей строки
+        line_width = 0.0                             # её ширина в единицах шрифта
+        for word in paragraph.split(" "):            # разбиваем абзац на слова
+            word_width = word_widths.get(word)
+            if word_width is None:
+                word_width = sum(glyph_width(ord(ch), default_width) for ch in word)
+                word_widths[word] = word_width
+
+            test_width = line_width + word_width + space_width
+            # Проверяем, помещается ли строка в доступную ширину
+            if scale * test_width < max_width:
+                line_words.append(word)
+                line_width = test_width
+            else:
+                # Не помещается — отдаём текущую строку (пустую, если не влезло первое же слово)
+                yield "".join(w + " " for w in line_words)
+                line_words = [word]
+                line_width = word_width + space_width
+
+        # Последняя строка абзаца
+        yield "".join(w + " " for w in line_words)
+
+
+
+# === Временный каталог для файлов расшифровки ===
+def make_transcript_dir() -> Path:
+    """
+    Отдельный каталог на каждую задачу: имя файла, которое видит пользователь,
+    у всех расшифровок за день одинаковое, и в общем каталоге одновременные
+    задачи перезаписывали бы файлы друг друга. Каталог удаляет вызывающий.
+    """
+    return Path(tempfile.mkdtemp(prefix="transcript_"))
+
+
+
 # === Генерация PDF-файла из текста транскрипции ===
-def create_transcript_pdf(text: str, date_str: str) -> Path:
+def create_transcript_pdf(text: str, date_str: str, out_dir: Path | None = None) -> Path:
     """
     Создаёт PDF-файл с текстом транскрипта.
 
     :param text: Расшифрованный текст совещания.
     :param date_str: Дата в формате 'ДДММГГГГ' для включения в имя файла.
+    :param out_dir: Каталог для файла; по умолчанию — новый временный (см. make_transcript_dir).
     :return: Путь к созданному PDF-файлу.
     """
     filename = f"Совещание_расшифровка_{date_str}.pdf"
-    # Используем временную директорию
-    path = Path(tempfile.gettempdir()) / filename
+    path = (out_dir or make_transcript_dir()) / filename
 
     # Настройки страницы и форматирования
     page_width, page_height = A4                   # размеры страницы A4
@@ -112,32 +373,13 @@ def create_transcript_pdf(text: str, date_str: str) -> Path:
     y = page_height - margin_y  # старт сверху
 
     # Разбивка текста по строкам и страницам
-    for paragraph in text.split("\n"):               # разбиваем на абзацы
-        words = paragraph.split(" ")                 # разбиваем абзац на слова
-        line = ""                                    # буфер текущей строки
-        for word in words:
-            test_line = line + word + " "
-            # Проверяем, помещается ли строка в доступную ширину
-            if pdfmetrics.stringWidth(test_line, "DejaVuSans", 12) < usable_width:
-                line = test_line
-            else:
-                # Если строка не помещается, печатаем текущую строку
-                if y - line_height < margin_y:
-                    c.showPage()                     # создаём новую страницу
-                    c.setFont("DejaVuSans", 12)
-                    y = page_height - margin_y
-                c.drawString(x, y, line)
-                y -= line_height
-                line = word + " "
-
-        # Печатаем последнюю строку в абзаце
-        if line:
-            if y - line_height < margin_y:
-                c.showPage()
-                c.setFont("DejaVuSans", 12)
-                y = page_height - margin_y
-            c.drawString(x, y, line)
-            y -= line_height
+    for line in layout_lines(text, "DejaVuSans", 12, usable_width):
+        if y - line_height < margin_y:
+            c.showPage()                             # создаём новую страницу
+            c.setFont("DejaVuSans", 12)
+            y = page_height - margin_y
+        c.drawString(x, y, line)
+        y -= line_height
 
     c.save()
     return path
@@ -145,9 +387,9 @@ def create_transcript_pdf(text: str, date_str: str) -> Path:
 
 
 # === Генерация TXT-файла из текста транскрипции ===
-def create_transcript_txt(text: str, date_str: str) -> Path:
+def create_transcript_txt(text: str, date_str: str, out_dir: Path | None = None) -> Path:
     filename = f"Совещание_расшифровка_{date_str}.txt"
-    path = Path(tempfile.gettempdir()) / filename
+    path = (out_dir or make_transcript_dir()) / filename
 
     with open(path, "w", encoding="utf-8") as f:
         f.write(text)
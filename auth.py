@@ -1,7 +1,14 @@
-import aiohttp    # для работы с асинхронным запросом к Airtable API
 import os
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from collections import deque
 from dotenv import load_dotenv     # для загрузки переменных окружения из файла .env
 
+from http_client import get_session    # общая HTTP-сессия для запросов к Airtable API
+
 load_dotenv()
 
 # Получение значений переменных окружения
@@ -9,6 +16,20 @@ BASE_ID = os.getenv("AIRTABLE_BASE_ID")
 TABLE_MAIN = os.getenv("AIRTABLE_TABLE_MAIN")
 TABLE_LOG = os.getenv("AIRTABLE_TABLE_LOG")
 AIRTABLE_TOKEN = os.getenv("AIRTABLE_API_TOKEN")
+# Адрес API (для тестов и бенчмарков можно указать локальную заглушку)
+AIRTABLE_API_BASE = os.getenv("AIRTABLE_API_BASE", "https://api.airtable.com/v0").rstrip("/")
+
+# Период полной синхронизации кэша пользователей, сек.
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))
+# Максимальный размер страницы Airtable
+AIRTABLE_PAGE_SIZE = 100
+
+# Журнал действий: пачки до 10 записей (ограничение Airtable), не больше 5 запросов в секунду
+AUDIT_BATCH_SIZE = 10
+AUDIT_RATE_PER_SEC = float(os.getenv("AUDIT_RATE_PER_SEC", "5"))
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "1000"))              # событий в буфере
+AUDIT_OVERFLOW_POLICY = os.getenv("AUDIT_OVERFLOW_POLICY", "drop_oldest")    # drop_oldest или drop_new
+AUDIT_MAX_RETRIES = int(os.getenv("AUDIT_MAX_RETRIES", "3"))
 
 HEADERS = {
     "Authorization": f"Bearer {AIRTABLE_TOKEN}",
@@ -17,25 +38,128 @@ HEADERS = {
 
 
 
-# === Проверка, есть ли пользователь в таблице ===
-async def check_user_registered(user_id: int) -> dict | None:
-    url = f"https://api.airtable.com/v0/{BASE_ID}/{TABLE_MAIN}" # Эндпоинт API Airtable
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=HEADERS) as resp:
+# === Кэш пользователей ===
+# Вся таблица пользователей в памяти: UserID → поля записи.
+# Заполняется постраничной синхронизацией и обновляется в фоне раз в AUTH_CACHE_TTL секунд
+_users: dict[str, dict] = {}
+_users_synced_at = 0.0
+_sync_task: asyncio.Task | None = None
+
+
+
+# === Полная синхронизация таблицы пользователей ===
+async def sync_users() -> int:
+    """
+    Загружает все записи AIRTABLE_TABLE_MAIN постранично (Airtable отдаёт
+    не больше 100 записей за запрос и возвращает offset следующей страницы)
+    и заменяет ими кэш. Возвращает число пользователей.
+    """
+    global _users, _users_synced_at
+    url = f"{AIRTABLE_API_BASE}/{BASE_ID}/{TABLE_MAIN}" # Эндпоинт API Airtable
+    session = get_session()
+    users: dict[str, dict] = {}
+    params = {"pageSize": AIRTABLE_PAGE_SIZE}
+
+    while True:
+        async with session.get(url, headers=HEADERS, params=params) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                raise Exception(f"Ошибка загрузки пользователей Airtable: {resp.status} — {text}")
             data = await resp.json()
 
-    for record in data.get("records", []):
-        fields = record.get("fields", {})
-        if fields.get("UserID") == str(user_id):
-            return fields
+        for record in data.get("records", []):
+            fields = record.get("fields", {})
+            if fields.get("UserID"):
+                users[str(fields["UserID"])] = fields
+
+        offset = data.get("offset")
+        if not offset:
+            break
+        params["offset"] = offset
+
+    # Заменяем кэш целиком — удалённые из таблицы пользователи пропадут и из кэша
+    _users = users
+    _users_synced_at = time.time()
+    return len(users)
+
+
+
+# === Фоновое обновление кэша пользователей ===
+async def _sync_loop():
+    while True:
+        try:
+            count = await sync_users()
+            logging.info(f"[👥] Кэш пользователей обновлён: {count} записей")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"[👥] Не удалось обновить кэш пользователей: {e}")
+        await asyncio.sleep(AUTH_CACHE_TTL)
+
+
+def start_user_sync():
+    global _sync_task
+    if _sync_task is None or _sync_task.done():
+        _sync_task = asyncio.create_task(_sync_loop())
 
-    return None
+
+async def stop_user_sync():
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        try:
+            await _sync_task
+        except asyncio.CancelledError:
+            pass
+        _sync_task = None
+
+
+
+# === Пользователь из кэша, без обращения к сети ===
+def get_cached_user(user_id: int) -> dict | None:
+    return _users.get(str(user_id))
+
+
+
+# === Поиск одной записи по UserID через filterByFormula ===
+async def fetch_user(user_id: int) -> dict | None:
+    url = f"{AIRTABLE_API_BASE}/{BASE_ID}/{TABLE_MAIN}" # Эндпоинт API Airtable
+    params = {
+        "filterByFormula": f"{{UserID}}='{int(user_id)}'",
+        "maxRecords": 1
+    }
+    session = get_session()
+    async with session.get(url, headers=HEADERS, params=params) as resp:
+        # При 429/5xx нельзя считать, что пользователя нет: иначе /start зарегистрирует его повторно
+        if resp.status != 200:
+            text = await resp.text()
+            raise Exception(f"Ошибка поиска пользователя Airtable: {resp.status} — {text}")
+        data = await resp.json()
+
+    records = data.get("records", [])
+    if not records:
+        return None
+    fields = records[0].get("fields", {})
+    _users[str(user_id)] = fields
+    return fields
+
+
+
+# === Проверка, есть ли пользователь в таблице ===
+async def check_user_registered(user_id: int) -> dict | None:
+    # Сначала кэш — без сетевого запроса
+    user = get_cached_user(user_id)
+    if user is not None:
+        return user
+
+    # Пользователя могли добавить после последней синхронизации — ищем точечно
+    return await fetch_user(user_id)
 
 
 
 # === Регистрация нового пользователя ===
 async def register_user(user_id: int, username: str):
-    url = f"https://api.airtable.com/v0/{BASE_ID}/{TABLE_MAIN}" # Эндпоинт API Airtable
+    url = f"{AIRTABLE_API_BASE}/{BASE_ID}/{TABLE_MAIN}" # Эндпоинт API Airtable
     payload = {
         "records": [{
             "fields": {
@@ -45,23 +169,151 @@ async def register_user(user_id: int, username: str):
         }]
     }
 
-    async with aiohttp.ClientSession() as session:
-        await session.post(url, json=payload, headers=HEADERS)
+    session = get_session()
+    async with session.post(url, json=payload, headers=HEADERS) as resp:
+        if resp.status == 200:
+            data = await resp.json()
+            # Сразу добавляем запись в кэш, не дожидаясь синхронизации
+            for record in data.get("records", []):
+                _users[str(user_id)] = record.get("fields", {})
+
+
+
+# === Журнал действий: буфер и фоновая запись в Airtable ===
+# События копятся в буфере, фоновая задача отправляет их пачками по 10 записей
+# (ограничение Airtable) не чаще AUDIT_RATE_PER_SEC запросов в секунду
+_log_buffer: deque[dict] = deque()
+_log_event: asyncio.Event | None = None
+_log_writer_task: asyncio.Task | None = None
+_log_stopping = False
+_log_stats = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0, "requests": 0}
 
 
 
 # === Логирование действий пользователя ===
-async def log_action(user_id: int, username: str, action: str):
-    url = f"https://api.airtable.com/v0/{BASE_ID}/{TABLE_LOG}" # Эндпоинт API Airtable
-    payload = {
-        "records": [{
-            "fields": {
-                "TelegramID": str(user_id),
-                "ФИО": username or "no_username",
-                "Действие": action
-            }
-        }]
+def log_action(user_id: int, username: str, action: str):
+    """
+    Ставит событие в очередь журнала и сразу возвращается — обработчики
+    не ждут Airtable. При переполнении буфера действует AUDIT_OVERFLOW_POLICY:
+    drop_oldest — вытесняется самое старое событие, drop_new — отбрасывается новое.
+    """
+    record = {
+        "fields": {
+            "TelegramID": str(user_id),
+            "ФИО": username or "no_username",
+            "Действие": action
+        }
     }
 
-    async with aiohttp.ClientSession() as session:
-        await session.post(url, json=payload, headers=HEADERS)
+    if len(_log_buffer) >= AUDIT_BUFFER_SIZE:
+        _log_stats["dropped"] += 1
+        if AUDIT_OVERFLOW_POLICY == "drop_new":
+            return
+        _log_buffer.popleft()
+
+    _log_buffer.append(record)
+    _log_stats["queued"] += 1
+
+    # Запускаем запись при первом событии, если бот не сделал этого при старте
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    start_log_writer()
+    _log_event.set()
+
+
+
+# === Запуск фоновой записи журнала ===
+def start_log_writer():
+    global _log_writer_task, _log_event, _log_stopping
+    if _log_writer_task is None or _log_writer_task.done():
+        _log_event = asyncio.Event()
+        _log_stopping = False
+        _log_writer_task = asyncio.create_task(_log_writer_loop())
+        if _log_buffer:
+            _log_event.set()
+
+
+
+# === Остановка с гарантированной отправкой буфера ===
+async def stop_log_writer(timeout: float = 30):
+    global _log_writer_task, _log_stopping
+    if _log_writer_task is None:
+        return
+    _log_stopping = True
+    _log_event.set()
+    try:
+        # Писатель сам завершится, когда буфер опустеет
+        await asyncio.wait_for(_log_writer_task, timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"[📝] Не успели отправить {len(_log_buffer)} событий журнала при остановке")
+    _log_writer_task = None
+
+
+
+async def _log_writer_loop():
+    min_interval = 1 / AUDIT_RATE_PER_SEC
+    last_request = 0.0
+
+    while True:
+        if not _log_buffer:
+            if _log_stopping:
+                return
+            _log_event.clear()
+            await _log_event.wait()
+            continue
+
+        # Ограничение частоты запросов; за время ожидания в буфере набирается пачка
+        delay = last_request + min_interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        batch = [_log_buffer.popleft() for _ in range(min(AUDIT_BATCH_SIZE, len(_log_buffer)))]
+        last_request = time.monotonic()
+        try:
+            await _send_log_batch(batch)
+            _log_stats["sent"] += len(batch)
+        except Exception as e:
+            _log_stats["failed"] += len(batch)
+            logging.warning(f"[📝] Не удалось записать {len(batch)} событий журнала в Airtable: {e}")
+
+
+
+# === Отправка пачки записей с повторами ===
+async def _send_log_batch(batch: list[dict]):
+    url = f"{AIRTABLE_API_BASE}/{BASE_ID}/{TABLE_LOG}" # Эндпоинт API Airtable
+    payload = {"records": batch}
+    session = get_session()
+
+    for attempt in range(AUDIT_MAX_RETRIES + 1):
+        try:
+            _log_stats["requests"] += 1
+            async with session.post(url, json=payload, headers=HEADERS) as resp:
+                if resp.status == 200:
+                    return
+                text = await resp.text()
+                # 4xx, кроме 429, повтором не исправить
+                if resp.status != 429 and resp.status < 500:
+                    raise ValueError(f"{resp.status} — {text}")
+                error = Exception(f"{resp.status} — {text}")
+                # После 429 Airtable требует паузу 30 секунд
+                retry_delay = 30 if resp.status == 429 else 2 ** attempt
+        except ValueError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+            retry_delay = 2 ** attempt
+
+        if attempt < AUDIT_MAX_RETRIES:
+            await asyncio.sleep(retry_delay * random.uniform(0.8, 1.2))
+
+    raise error
+
+
+
+# === Счётчики журнала ===
+def get_log_stats() -> dict[str, int]:
+    stats = dict(_log_stats)
+    stats["buffered"] = len(_log_buffer)
+    return stats
@@ -0,0 +1,144 @@
+"""
+Сравнение вёрстки PDF с расшифровкой: прежний цикл с pdfmetrics.stringWidth
+на каждое слово против layout_lines с накоплением ширины строки.
+
+Для каждого размера текста замеряется отдельно разбивка на строки и полное
+создание PDF, и проверяется, что оба варианта дают побайтно одинаковый файл.
+
+    python benchmarks/bench_pdf_layout.py
+    python benchmarks/bench_pdf_layout.py --sizes 10000 100000 --repeat 5
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# Шрифт для PDF регистрируется по относительному пути
+os.chdir(ROOT)
+
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
+
+import audio_utils
+
+# Детерминированный PDF (без даты создания и случайного id) — чтобы сравнивать файлы побайтно
+rl_config.invariant = 1
+
+WORDS = (
+    "итак коллеги давайте обсудим сроки запуска проекта по внедрению новой системы учёта "
+    "ответственный Иванов подготовит отчёт до пятницы, бюджет согласован — но нужно уточнить "
+    "смету. предлагаю перенести демонстрацию на следующую неделю и собрать требования заказчика"
+).split()
+
+
+
+# === Прежняя разбивка на строки ===
+def legacy_layout_lines(text: str, font_name: str, font_size: float, max_width: float):
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            test_line = line + word + " "
+            if pdfmetrics.stringWidth(test_line, font_name, font_size) < max_width:
+                line = test_line
+            else:
+                yield line
+                line = word + " "
+        if line:
+            yield line
+
+
+
+# === Вёрстка PDF по готовым строкам (как в create_transcript_pdf) ===
+def render_pdf(path: Path, lines):
+    page_width, page_height = A4
+    margin_x = margin_y = 15 * mm
+    line_height = 12
+
+    c = canvas.Canvas(str(path), pagesize=A4)
+    c.setFont("DejaVuSans", 12)
+    y = page_height - margin_y
+    for line in lines:
+        if y - line_height < margin_y:
+            c.showPage()
+            c.setFont("DejaVuSans", 12)
+            y = page_height - margin_y
+        c.drawString(margin_x, y, line)
+        y -= line_height
+    c.save()
+
+
+
+# === Синтетическая расшифровка: длинные абзацы, как в выдаче SaluteSpeech ===
+def generate_text(size: int, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        # Изредка — очень длинное «слово» без пробелов (ссылки, склеенные фразы)
+        word = "".join(rng.choices(WORDS, k=8)) if rng.random() < 0.002 else rng.choice(WORDS)
+        # Абзацы в среднем на несколько тысяч символов
+        sep = "\n" if rng.random() < 0.003 else " "
+        parts.append(word + sep)
+        length += len(word) + 1
+    return "".join(parts)[:size]
+
+
+
+def best_of(repeat: int, func) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбивки текста для PDF")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    usable_width = A4[0] - 2 * 15 * mm
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            text = generate_text(size)
+            legacy_lines = list(legacy_layout_lines(text, "DejaVuSans", 12, usable_width))
+            new_lines = list(audio_utils.layout_lines(text, "DejaVuSans", 12, usable_width))
+            assert legacy_lines == new_lines, "разбивка на строки отличается"
+
+            legacy_layout = best_of(args.repeat, lambda: list(legacy_layout_lines(text, "DejaVuSans", 12, usable_width)))
+            new_layout = best_of(args.repeat, lambda: list(audio_utils.layout_lines(text, "DejaVuSans", 12, usable_width)))
+
+            legacy_pdf = Path(tmp) / "legacy.pdf"
+            legacy_total = best_of(args.repeat, lambda: render_pdf(
+                legacy_pdf, legacy_layout_lines(text, "DejaVuSans", 12, usable_width)))
+            new_pdf = None
+            def create():
+                nonlocal new_pdf
+                new_pdf = audio_utils.create_transcript_pdf(text, f"bench_{size}", Path(tmp))
+            new_total = best_of(args.repeat, create)
+            same = legacy_pdf.read_bytes() == new_pdf.read_bytes()
+            new_pdf.unlink()
+
+            print(
+                f"{size:>9} символов, {len(new_lines)} строк: "
+                f"разбивка {legacy_layout * 1000:8.1f} → {new_layout * 1000:7.1f} мс "
+                f"(x{legacy_layout / new_layout:.1f}), "
+                f"PDF целиком {legacy_total * 1000:8.1f} → {new_total * 1000:7.1f} мс, "
+                f"файлы {'совпадают' if same else 'ОТЛИЧАЮТСЯ'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,567 @@
+"""
+Нагрузочный прогон всего конвейера без настоящих сервисов.
+
+Запускает в отдельном процессе локальные заглушки Telegram Bot API, OAuth Сбера,
+SaluteSpeech, GigaChat и Airtable (aiohttp) с настраиваемой задержкой, долей ошибок
+и порогом «429 Too Many Requests». Бот направляется на них через TG_API_BASE,
+SBER_OAUTH_URL, SALUTE_API_BASE, GIGACHAT_API_BASE и AIRTABLE_API_BASE.
+Затем синтетические записи разной длины «присылаются» боту через handle_audio,
+а готовые расшифровки анализируются через run_analysis.
+
+Отчёт: пропускная способность, p50/p95/p99 по этапам, пиковый RSS процесса бота
+и дочерних процессов (ffmpeg, пул). С --json отчёт сохраняется вместе с хэшем коммита — для сравнения между коммитами.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --users 8 --durations 60 300 900 --profile throttled --json out.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from collections import defaultdict
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Готовые профили поведения заглушек; отдельные параметры можно переопределить флагами
+PROFILES = {
+    # Быстрые сервисы без ошибок — измеряем накладные расходы самого бота
+    "fast":      dict(salute_latency=0.05, salute_errors=0.0, salute_capacity=0,
+                      gigachat_latency=0.1, gigachat_errors=0.0, telegram_latency=0.005, airtable_latency=0.01),
+    # Задержки, близкие к реальным
+    "realistic": dict(salute_latency=2.0, salute_errors=0.0, salute_capacity=0,
+                      gigachat_latency=5.0, gigachat_errors=0.0, telegram_latency=0.05, airtable_latency=0.2),
+    # SaluteSpeech отвечает 429 при превышении числа одновременных запросов
+    "throttled": dict(salute_latency=1.0, salute_errors=0.0, salute_capacity=4,
+                      gigachat_latency=2.0, gigachat_errors=0.0, telegram_latency=0.02, airtable_latency=0.1),
+    # Случайные 5xx
+    "flaky":     dict(salute_latency=1.0, salute_errors=0.1, salute_capacity=0,
+                      gigachat_latency=2.0, gigachat_errors=0.05, telegram_latency=0.02, airtable_latency=0.1),
+}
+
+
+
+# ======================================================================
+# Заглушки сервисов (выполняются в отдельном процессе)
+# ======================================================================
+
+async def _delay(latency: float):
+    if latency > 0:
+        await asyncio.sleep(latency * random.uniform(0.8, 1.2))
+
+
+def build_stub_app(profile: dict, files_dir: Path) -> web.Application:
+    stats = defaultdict(int)
+    salute_active = 0
+    message_ids = iter(range(1, 10 ** 9))
+
+    # --- OAuth Сбера ---
+    async def oauth(request: web.Request):
+        stats["oauth"] += 1
+        await _delay(profile["airtable_latency"])
+        return web.json_response({
+            "access_token": uuid.uuid4().hex,
+            "expires_at": int((time.time() + 1800) * 1000),
+        })
+
+    # --- SaluteSpeech: синхронное распознавание ---
+    async def recognize(request: web.Request):
+        nonlocal salute_active
+        body = await request.read()
+        stats["salute_requests"] += 1
+        if profile["salute_capacity"] and salute_active >= profile["salute_capacity"]:
+            stats["salute_429"] += 1
+            return web.json_response({"message": "Too Many Requests"}, status=429)
+        salute_active += 1
+        try:
+            await _delay(profile["salute_latency"])
+            if random.random() < profile["salute_errors"]:
+                stats["salute_5xx"] += 1
+                return web.json_response({"message": "Internal error"}, status=500)
+            # Объём текста пропорционален объёму аудио
+            words = max(1, len(body) // 1500)
+            return web.json_response({"result": [" ".join(["слово"] * words) + "."]})
+        finally:
+            salute_active -= 1
+
+    # --- GigaChat ---
+    async def upload_file(request: web.Request):
+        await request.post()
+        stats["gigachat_uploads"] += 1
+        await _delay(profile["telegram_latency"])
+        return web.json_response({"id": uuid.uuid4().hex, "object": "file"})
+
+    async def delete_file(request: web.Request):
+        stats["gigachat_deletes"] += 1
+        return web.json_response({"id": request.match_info["file_id"], "deleted": True})
+
+    async def completions(request: web.Request):
+        data = await request.json()
+        stats["gigachat_completions"] += 1
+        await _delay(profile["gigachat_latency"])
+        if random.random() < profile["gigachat_errors"]:
+            stats["gigachat_5xx"] += 1
+            return web.json_response({"message": "Internal error"}, status=500)
+
+        content = "**Тема совещания**: синтетическая запись.\n\n" + "Итоги обсуждения. " * 200
+        # Конспект части (map) в несколько раз короче самой части, как у настоящей модели
+        prompt = " ".join(str(m.get("content", "")) for m in data.get("messages", []))
+        if "Текст части:" in prompt:
+            stats["gigachat_map"] += 1
+            content = "Конспект части. " * max(1, len(prompt.split("Текст части:", 1)[1]) // 80)
+        usage = {"prompt_tokens": 1000, "completion_tokens": 800, "total_tokens": 1800}
+        if not data.get("stream"):
+            return web.json_response({"choices": [{"message": {"content": content}}], "usage": usage})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(0, len(content), 200):
+            chunk = {"choices": [{"delta": {"content": content[i:i + 200]}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(0.01)
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    # --- Airtable ---
+    async def airtable_list(request: web.Request):
+        stats["airtable_reads"] += 1
+        await _delay(profile["airtable_latency"])
+        formula = request.query.get("filterByFormula", "")
+        if "UserID" in formula:
+            user_id = formula.split("'")[1]
+            return web.json_response({"records": [{"id": f"rec{user_id}", "fields": {"UserID": user_id}}]})
+        return web.json_response({"records": []})
+
+    async def airtable_create(request: web.Request):
+        data = await request.json()
+        stats["airtable_writes"] += 1
+        await _delay(profile["airtable_latency"])
+        records = [{"id": f"rec{uuid.uuid4().hex[:8]}", "fields": r.get("fields", {})} for r in data.get("records", [])]
+        return web.json_response({"records": records})
+
+    # --- Telegram Bot API ---
+    async def telegram_method(request: web.Request):
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        stats[f"telegram_{method}"] += 1
+        await _delay(profile["telegram_latency"])
+
+        if method == "getfile":
+            file_id = form["file_id"]
+            size = (files_dir / file_id).stat().st_size
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": size, "file_path": file_id}
+        elif method in ("sendmessage", "senddocument", "edittextmessage", "editmessagetext"):
+            chat_id = int(form.get("chat_id", 0))
+            result = {
+                "message_id": next(message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": form.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def telegram_file(request: web.Request):
+        stats["telegram_downloads"] += 1
+        return web.FileResponse(files_dir / request.match_info["path"])
+
+    async def get_stats(request: web.Request):
+        return web.json_response(dict(stats))
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/oauth", oauth)
+    app.router.add_post("/salute/speech:recognize", recognize)
+    app.router.add_post("/gigachat/files", upload_file)
+    app.router.add_post("/gigachat/files/{file_id}/delete", delete_file)
+    app.router.add_post("/gigachat/chat/completions", completions)
+    app.router.add_get("/airtable/{base}/{table}", airtable_list)
+    app.router.add_post("/airtable/{base}/{table}", airtable_create)
+    app.router.add_post("/tg/bot{token}/{method}", telegram_method)
+    app.router.add_get("/tg/file/bot{token}/{path}", telegram_file)
+    app.router.add_get("/_stats", get_stats)
+    return app
+
+
+async def serve(profile: dict, files_dir: Path):
+    runner = web.AppRunner(build_stub_app(profile, files_dir), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    # Первая строка вывода — порт, по ней основной процесс понимает, что заглушки готовы
+    print(json.dumps({"port": port}), flush=True)
+    await asyncio.Event().wait()
+
+
+
+# ======================================================================
+# Прогон бота
+# ======================================================================
+
+# === Синтетическая «речь»: тон с паузами, чтобы нарезка находила границы ===
+def generate_recording(directory: Path, index: int, seconds: int) -> Path:
+    path = directory / f"voice_{index}_{seconds}s.ogg"
+    # Разная частота у каждой записи — иначе кэш расшифровок узнает одинаковые файлы
+    freq = 200 + index * 7
+    subprocess.run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f"sine=frequency={freq}:duration={seconds}:sample_rate=48000",
+        '-af', "volume='if(lt(mod(t,7),6),0.5,0)':eval=frame",
+        '-ac', '1', '-c:a', 'libopus', '-b:a', '24k', str(path)
+    ], check=True)
+    return path
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+
+# === Пиковый RSS дочерних процессов бота (ffmpeg, пул процессов) ===
+# RUSAGE_CHILDREN не подходит: в Linux его ru_maxrss учитывает RSS, унаследованный
+# при fork от бота, и просто повторяет пик самого бота. Поэтому процессы-потомки
+# опрашиваются через /proc; ffmpeg, проживший меньше интервала опроса, может быть не учтён
+class ChildRssSampler:
+    def __init__(self, exclude: set[int], interval: float = 0.05):
+        self.exclude = exclude                  # потомки, которые не относятся к боту (заглушки)
+        self.interval = interval
+        self.peak_kb = 0                        # наибольший суммарный RSS потомков в одном замере
+        self.available = os.path.isdir("/proc")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if self.available:
+            self._thread.start()
+
+    def stop(self) -> float | None:
+        if not self.available:
+            return None
+        self._stop.set()
+        self._thread.join()
+        return round(self.peak_kb / 1024, 1)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            total = sum(self._rss_kb(pid) for pid in self._descendants(os.getpid()))
+            self.peak_kb = max(self.peak_kb, total)
+
+    def _descendants(self, root: int) -> list[int]:
+        children = defaultdict(list)
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/stat") as f:
+                    # После имени процесса в скобках идут состояние и ppid
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children[ppid].append(int(entry.name))
+        found, stack = [], [root]
+        while stack:
+            for pid in children.get(stack.pop(), []):
+                if pid not in self.exclude:
+                    found.append(pid)
+                    stack.append(pid)
+        return found
+
+    @staticmethod
+    def _rss_kb(pid: int) -> int:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+        return 0
+
+
+
+async def run_benchmark(args, profile: dict) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        files_dir = tmp / "files"
+        files_dir.mkdir()
+
+        print(f"Генерирую {args.users} записей ({', '.join(map(str, args.durations))} сек.)...")
+        recordings = []
+        for i in range(args.users):
+            seconds = args.durations[i % len(args.durations)]
+            recordings.append((generate_recording(files_dir, i, seconds), seconds))
+
+        # Заглушки — в отдельном процессе, чтобы не влиять на RSS и цикл событий бота
+        server = await asyncio.create_subprocess_exec(
+            sys.executable, __file__, "--serve", "--files", str(files_dir),
+            "--profile-json", json.dumps(profile),
+            stdout=asyncio.subprocess.PIPE
+        )
+        try:
+            port = json.loads(await server.stdout.readline())["port"]
+            return await drive_bot(args, profile, tmp, recordings, f"http://127.0.0.1:{port}", {server.pid})
+        finally:
+            server.terminate()
+            await server.wait()
+
+
+async def drive_bot(args, profile: dict, tmp: Path, recordings: list, base: str, stub_pids: set[int]) -> dict:
+    # Адреса заглушек и изолированные каталоги — до импорта модулей бота
+    os.environ.update({
+        "TG_BOT_TOKEN": "123456:BENCHMARK", "TG_API_BASE": f"{base}/tg",
+        "SBER_OAUTH_URL": f"{base}/oauth",
+        "SALUTE_API_BASE": f"{base}/salute", "SALUTE_CLIENT_ID": "bench", "SALUTE_SECRET": "bench",
+        "GIGACHAT_API_BASE": f"{base}/gigachat", "CLIENT_ID": "bench", "SECRET": "bench",
+        "AIRTABLE_API_BASE": f"{base}/airtable", "AIRTABLE_API_TOKEN": "bench",
+        "AIRTABLE_BASE_ID": "appBench", "AIRTABLE_TABLE_MAIN": "Users", "AIRTABLE_TABLE_LOG": "Log",
+        "BOT_DATA_DIR": str(tmp / "data"), "TRANSCRIPT_CACHE_DIR": str(tmp / "transcript_cache"),
+        "JOBS_DIR": str(tmp / "jobs"), "SESSION_DB": str(tmp / "sessions.sqlite3"),
+    })
+    os.environ.setdefault("JOB_QUEUE_LIMIT", str(max(20, len(recordings))))
+    # Синтетические расшифровки короче настоящих: снижаем порог, чтобы длинные записи
+    # анализировались по частям (map-reduce), как настоящие многочасовые совещания
+    os.environ.setdefault("MAP_REDUCE_THRESHOLD_TOKENS", str(args.map_reduce_tokens))
+    os.environ.setdefault("MAP_WINDOW_TOKENS", str(max(1, args.map_reduce_tokens // 4)))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Шрифт для PDF регистрируется по относительному пути
+    os.chdir(ROOT)
+
+    import bot as app
+    import gigachat_files
+    from token_manager import TokenManager
+    from aiogram.types import Message, Chat, User, Voice
+
+    timings: dict[str, list[float]] = defaultdict(list)
+
+    def timed(stage: str, func):
+        async def wrapper(*a, **kw):
+            started = time.perf_counter()
+            try:
+                return await func(*a, **kw)
+            finally:
+                timings[stage].append(time.perf_counter() - started)
+        return wrapper
+
+    # Замеры по этапам — обёртки вокруг функций бота
+    app.download_telegram_file = timed("download", app.download_telegram_file)
+    app.transcribe_chunk = timed("salute_chunk", app.transcribe_chunk)
+    app.send_prompt = timed("gigachat_completion", app.send_prompt)
+    app.summarize_windows = timed("map_reduce", app.summarize_windows)
+    gigachat_files.upload_file_to_gigachat = timed("gigachat_upload", gigachat_files.upload_file_to_gigachat)
+    TokenManager._fetch_token = timed("oauth", TokenManager._fetch_token)
+
+    run_blocking = app.run_blocking
+
+    async def timed_run_blocking(stage, func, *a):
+        started = time.perf_counter()
+        try:
+            return await run_blocking(stage, func, *a)
+        finally:
+            timings[stage].append(time.perf_counter() - started)
+    app.run_blocking = timed_run_blocking
+
+    async def telegram_timing(make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            timings["telegram_send"].append(time.perf_counter() - started)
+    app.bot.session.middleware(telegram_timing)
+
+    # Окончание задачи: process_upload вызывается воркером очереди
+    done_events = {}
+    job_times = {}
+    process_upload = app.process_upload
+
+    async def tracked_process_upload(message, file, *args):
+        try:
+            await process_upload(message, file, *args)
+        finally:
+            job_times[message.chat.id] = time.perf_counter()
+            done_events[message.chat.id].set()
+    app.process_upload = tracked_process_upload
+
+    # Запуск служб, как в main(), но без опроса Telegram
+    app.init_http_client()
+    app.init_executor_pool()
+    app.start_log_writer()
+    app.tracing.start_tracing()
+    app.job_scheduler.start()
+
+    messages = {}
+    for i, (path, seconds) in enumerate(recordings):
+        user_id = 10_000 + i
+        done_events[user_id] = asyncio.Event()
+        messages[user_id] = Message(
+            message_id=1, date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Bench", username=f"bench{i}"),
+            voice=Voice(file_id=path.name, file_unique_id=path.name, duration=seconds),
+        ).as_(app.bot)
+
+    children_rss = ChildRssSampler(exclude=stub_pids)
+    children_rss.start()
+    print(f"Отправляю {len(recordings)} записей боту...")
+    started = time.perf_counter()
+    for message in messages.values():
+        await app.handle_audio(message)
+    await asyncio.wait_for(asyncio.gather(*(e.wait() for e in done_events.values())), args.timeout)
+    transcribe_wall = time.perf_counter() - started
+    for user_id, finished in job_times.items():
+        timings["job_total"].append(finished - started)
+
+    # Анализ готовых расшифровок (параллельно для всех пользователей)
+    print("Анализирую расшифровки...")
+    analyzed = 0
+    analysis_errors = []
+
+    async def analyze(user_id: int):
+        nonlocal analyzed
+        session = app.sessions.get(user_id)
+        if not session:
+            return
+        try:
+            await timed("analyze", app.run_analysis)(messages[user_id], session["transcript"], app.SYSTEM_PROMPT,
+                                                     session["date_str"], session["trace_id"])
+            analyzed += 1
+        except Exception as e:
+            analysis_errors.append(f"{user_id}: {type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(analyze(user_id) for user_id in messages))
+    analyze_wall = time.perf_counter() - started
+
+    transcribed = sum(1 for user_id in messages if app.sessions.get(user_id))
+    async with app.get_session().get(f"{base}/_stats") as resp:
+        stub_stats = await resp.json()
+    salute_stats = app.salute_limiter.get_stats()
+
+    peak_rss_children = children_rss.stop()
+    await app.job_scheduler.stop()
+    await app.close_file_cache()
+    await app.close_token_managers()
+    await app.stop_log_writer(timeout=5)
+    await app.close_http_client()
+    await app.close_executor_pool()
+    app.tracing.stop_tracing()
+    await app.bot.session.close()
+
+    audio_minutes = sum(seconds for _, seconds in recordings) / 60
+    # ru_maxrss в Linux — в килобайтах; RSS потомков — сумма в момент пика (None без /proc)
+    return {
+        "revision": git_revision(),
+        "profile": profile,
+        "users": len(recordings),
+        "durations_sec": args.durations,
+        "transcribed": transcribed,
+        "analyzed": analyzed,
+        "analysis_failed": len(analysis_errors),
+        "analysis_errors": analysis_errors,
+        "map_reduce_rounds": len(timings.get("map_reduce", [])),
+        "transcribe_wall_sec": round(transcribe_wall, 2),
+        "analyze_wall_sec": round(analyze_wall, 2),
+        "recordings_per_min": round(transcribed / transcribe_wall * 60, 2),
+        "audio_min_per_wall_min": round(audio_minutes / (transcribe_wall / 60), 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_rss_children_mb": peak_rss_children,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.50), 4),
+                "p95": round(percentile(values, 0.95), 4),
+                "p99": round(percentile(values, 0.99), 4),
+                "max": round(max(values), 4),
+            }
+            for stage, values in sorted(timings.items())
+        },
+        "salute_limiter": salute_stats,
+        "stubs": stub_stats,
+    }
+
+
+
+def print_report(report: dict):
+    print()
+    print(f"Коммит {report['revision']}: {report['users']} записей, "
+          f"распознано {report['transcribed']}, проанализировано {report['analyzed']} "
+          f"(конспектирований по частям {report['map_reduce_rounds']}), ошибок анализа {report['analysis_failed']}")
+    for error in report["analysis_errors"]:
+        print(f"  ❌ {error}")
+    print(f"Распознавание: {report['transcribe_wall_sec']} сек., {report['recordings_per_min']} записей/мин, "
+          f"{report['audio_min_per_wall_min']} мин. аудио за минуту")
+    print(f"Анализ: {report['analyze_wall_sec']} сек.")
+    print(f"Пиковый RSS: бот {report['peak_rss_mb']} МБ, дочерние процессы {report['peak_rss_children_mb']} МБ")
+    print()
+    print(f"{'этап':<22}{'кол-во':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<22}{s['count']:>8}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}{s['max']:>10.3f}")
+    print()
+    print(f"Лимит SaluteSpeech: {report['salute_limiter']}")
+    print(f"Заглушки: {report['stubs']}")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на локальных заглушках")
+    parser.add_argument("--users", type=int, default=4, help="сколько записей отправить одновременно")
+    parser.add_argument("--durations", type=int, nargs="+", default=[60, 300], help="длительности записей, сек.")
+    parser.add_argument("--profile", choices=PROFILES, default="fast")
+    parser.add_argument("--salute-latency", type=float)
+    parser.add_argument("--salute-errors", type=float, help="доля ответов 500")
+    parser.add_argument("--salute-capacity", type=int, help="одновременных запросов до ответа 429 (0 — без ограничения)")
+    parser.add_argument("--gigachat-latency", type=float)
+    parser.add_argument("--gigachat-errors", type=float)
+    parser.add_argument("--telegram-latency", type=float)
+    parser.add_argument("--airtable-latency", type=float)
+    parser.add_argument("--map-reduce-tokens", type=int, default=1000,
+                        help="порог анализа по частям (MAP_REDUCE_THRESHOLD_TOKENS), токенов")
+    parser.add_argument("--timeout", type=float, default=1800, help="предельное время прогона, сек.")
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--files", help=argparse.SUPPRESS)
+    parser.add_argument("--profile-json", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(json.loads(args.profile_json), Path(args.files)))
+        return
+
+    profile = dict(PROFILES[args.profile])
+    for key in profile:
+        value = getattr(args, key)
+        if value is not None:
+            profile[key] = value
+
+    report = asyncio.run(run_benchmark(args, profile))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
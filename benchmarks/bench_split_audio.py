@@ -0,0 +1,113 @@
+"""
+Сравнение нарезки аудио: прежняя реализация на pydub против сегментатора ffmpeg.
+
+Каждая реализация запускается в отдельном процессе, чтобы пиковое потребление
+памяти (RSS) процесса бота не смешивалось между запусками.
+
+    python benchmarks/bench_split_audio.py long_meeting.wav
+    python benchmarks/bench_split_audio.py --generate 7200      # синтетический WAV на 2 часа
+"""
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+
+# === Прежняя реализация: полное декодирование через pydub ===
+def split_audio_pydub(file_path: Path, chunk_ms: int = 58000) -> list[Path]:
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_file(file_path)
+    output_paths = []
+
+    for i in range(0, len(audio), chunk_ms):
+        chunk = audio[i:i + chunk_ms]
+        chunk_path = file_path.with_name(f"{file_path.stem}_part{i // chunk_ms}.mp3")
+        chunk.export(chunk_path, format="mp3")
+        output_paths.append(chunk_path)
+
+    return output_paths
+
+
+
+# === Запуск одной реализации (выполняется в дочернем процессе) ===
+def run_worker(impl: str, source: Path):
+    from audio_utils import split_audio
+
+    split = split_audio_pydub if impl == "pydub" else split_audio
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = Path(tmp) / f"input{source.suffix}"
+        shutil.copy(source, file_path)
+
+        started = time.perf_counter()
+        parts = split(file_path)
+        wall = time.perf_counter() - started
+
+    # ru_maxrss в Linux — в килобайтах
+    print(json.dumps({
+        "impl": impl,
+        "parts": len(parts),
+        "wall_sec": round(wall, 2),
+        "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+
+# === Синтетическая запись заданной длительности (стерео, 44.1 кГц) ===
+def generate_wav(seconds: int, directory: Path) -> Path:
+    path = directory / f"synthetic_{seconds}s.wav"
+    subprocess.run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f"anoisesrc=d={seconds}:c=pink:a=0.1:r=44100",
+        '-ac', '2', str(path)
+    ], check=True)
+    return path
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк нарезки аудио")
+    parser.add_argument("file", nargs="?", help="аудиофайл для нарезки")
+    parser.add_argument("--generate", type=int, metavar="SEC", help="сгенерировать WAV указанной длительности")
+    parser.add_argument("--impl", nargs="+", default=["pydub", "ffmpeg"], choices=["pydub", "ffmpeg"])
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.impl[0], Path(args.file))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.generate:
+            source = generate_wav(args.generate, Path(tmp))
+        elif args.file:
+            source = Path(args.file).resolve()
+        else:
+            parser.error("укажите файл или --generate")
+
+        print(f"Файл: {source.name}, {source.stat().st_size / 1024 / 1024:.1f} МБ")
+        for impl in args.impl:
+            # Шрифт для PDF регистрируется по относительному пути — запускаем из корня проекта
+            result = subprocess.run(
+                [sys.executable, __file__, str(source), "--worker", "--impl", impl],
+                cwd=ROOT, check=True, capture_output=True, text=True
+            )
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(
+                f"{stats['impl']:>7}: {stats['parts']} частей, {stats['wall_sec']:.2f} сек., "
+                f"пиковый RSS {stats['rss_mb']:.1f} МБ"
+            )
+
+
+if __name__ == "__main__":
+    main()
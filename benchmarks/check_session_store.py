@@ -0,0 +1,183 @@
+"""
+Проверка гарантий общего состояния (session_store) для всех трёх хранилищ.
+
+Каждое хранилище открывается «двумя копиями бота»: для SQLite — два подключения
+к одному временному файлу, для Redis — два клиента REDIS_URL с отдельным
+префиксом ключей (после проверки ключи удаляются). Память процесса общая только
+внутри процесса, поэтому обе «копии» — один объект. Проверяется:
+
+  - расшифровка более ранней записи не затирает более новую;
+  - выбор промпта срабатывает ровно один раз, в том числе при одновременных нажатиях;
+  - лимит задач на пользователя держится при одновременной постановке;
+  - отменённую задачу нельзя запустить (cancel → start возвращает False).
+
+Redis проверяется, только если задан REDIS_URL (используйте отдельную базу):
+
+    python benchmarks/check_session_store.py
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/check_session_store.py
+"""
+import os
+import sys
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from session_store import MemorySessionStore, SqliteSessionStore, RedisSessionStore, JOB_CANCELLED
+
+# Сколько одновременных попыток в проверках гонок
+CONCURRENCY = 16
+
+
+
+# === Одновременный вызов из нескольких потоков ===
+def race(stores, call, attempts: int = CONCURRENCY) -> list:
+    """
+    Вызывает call(store, i) одновременно из attempts потоков, чередуя копии хранилища.
+    Для хранилища в памяти вызовы идут по очереди: оно работает в одном цикле событий.
+    """
+    if stores[0] is stores[1]:
+        return [call(stores[0], i) for i in range(attempts)]
+    barrier = threading.Barrier(attempts)
+
+    def worker(i):
+        barrier.wait()
+        return call(stores[i % 2], i)
+
+    with ThreadPoolExecutor(attempts) as pool:
+        return list(pool.map(worker, range(attempts)))
+
+
+
+# === Проверки ===
+def check_newer_recording_wins(a, b):
+    user_id = random.randrange(10 ** 9)
+    assert a.set(user_id, "новая запись", "01012026", recorded_at=2000.0), "первая запись не сохранилась"
+    assert not b.set(user_id, "старая запись", "01012026", recorded_at=1000.0), "старая запись вернула True"
+    assert a.get(user_id)["transcript"] == "новая запись", "старая запись затёрла новую"
+    assert b.get(user_id)["transcript"] == "новая запись", "вторая копия видит не ту запись"
+    # Запись, полученная позже, наоборот, заменяет сохранённую
+    assert b.set(user_id, "ещё новее", "01012026", recorded_at=3000.0), "более новая запись не сохранилась"
+    assert a.get(user_id)["transcript"] == "ещё новее", "первая копия не видит обновление"
+
+
+def check_prompt_choice_once(a, b):
+    user_id = random.randrange(10 ** 9)
+    a.set(user_id, "расшифровка", "01012026", recorded_at=1000.0)
+    taken = race((a, b), lambda store, i: store.take_prompt_choice(user_id))
+    assert sum(taken) == 1, f"выбор промпта сработал {sum(taken)} раз вместо одного"
+    assert not a.take_prompt_choice(user_id), "повторный выбор после гонки вернул True"
+    # Новая расшифровка снова ждёт выбора
+    b.set(user_id, "новая расшифровка", "01012026", recorded_at=2000.0)
+    assert b.take_prompt_choice(user_id) and not a.take_prompt_choice(user_id), "отметка не восстановилась"
+
+
+def check_job_limit(a, b, limit: int = 2):
+    user_id = random.randrange(10 ** 9)
+    job_ids = [uuid.uuid4().hex[:12] for _ in range(CONCURRENCY)]
+    admitted = race((a, b), lambda store, i: store.add_job(job_ids[i], user_id, limit))
+    assert sum(admitted) == limit, f"принято {sum(admitted)} задач при лимите {limit}"
+    accepted = [job_id for job_id, ok in zip(job_ids, admitted) if ok]
+    # Завершённая задача освобождает место — и только одно
+    a.finish_job(accepted[0], user_id)
+    assert b.add_job(uuid.uuid4().hex[:12], user_id, limit), "место после завершения не освободилось"
+    assert not a.add_job(uuid.uuid4().hex[:12], user_id, limit), "лимит превышен после освобождения"
+
+
+def check_cancel_then_start(a, b):
+    user_id = random.randrange(10 ** 9)
+    job_id = uuid.uuid4().hex[:12]
+    assert a.add_job(job_id, user_id, 1), "задача не принята"
+    assert not b.cancel_job(job_id, user_id + 1), "чужой пользователь отменил задачу"
+    assert b.cancel_job(job_id, user_id), "отмена не удалась"
+    assert not a.start_job(job_id, user_id), "отменённая задача запустилась"
+    assert a.get_job_status(job_id) == JOB_CANCELLED, "статус задачи не «отменена»"
+    # Запущенную задачу отменить уже нельзя
+    running_id = uuid.uuid4().hex[:12]
+    assert a.add_job(running_id, user_id, 1), "место отменённой задачи не освободилось"
+    assert b.start_job(running_id, user_id), "задача не запустилась"
+    assert not a.cancel_job(running_id, user_id), "отменена уже выполняющаяся задача"
+
+
+CHECKS = [
+    ("старая запись не затирает новую", check_newer_recording_wins),
+    ("выбор промпта срабатывает один раз", check_prompt_choice_once),
+    ("лимит задач на пользователя", check_job_limit),
+    ("cancel → start возвращает False", check_cancel_then_start),
+]
+
+
+
+# === Хранилища: пара «копий бота» и уборка после проверки ===
+def open_memory(tmp_dir: Path):
+    store = MemorySessionStore()
+    return (store, store), lambda: None
+
+
+def open_sqlite(tmp_dir: Path):
+    db_path = tmp_dir / "sessions.sqlite3"
+    a, b = SqliteSessionStore(db_path), SqliteSessionStore(db_path)
+
+    def close():
+        a._conn.close()
+        b._conn.close()
+    return (a, b), close
+
+
+def open_redis(tmp_dir: Path):
+    url = os.environ["REDIS_URL"]
+    prefix = f"check:{uuid.uuid4().hex[:8]}:"
+    a, b = RedisSessionStore(url, prefix), RedisSessionStore(url, prefix)
+
+    def close():
+        keys = list(a._redis.scan_iter(match=f"{prefix}*"))
+        if keys:
+            a._redis.delete(*keys)
+    return (a, b), close
+
+
+BACKENDS = {"memory": open_memory, "sqlite": open_sqlite, "redis": open_redis}
+
+
+def run_backend(name: str) -> int:
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        stores, close = BACKENDS[name](Path(tmp))
+        try:
+            for title, check in CHECKS:
+                try:
+                    check(*stores)
+                    print(f"  ✅ {title}")
+                except AssertionError as e:
+                    failures += 1
+                    print(f"  ❌ {title}: {e}")
+        finally:
+            close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка атомарных операций общего состояния")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    args = parser.parse_args()
+
+    failures = 0
+    for name in args.backends:
+        if name == "redis" and not os.getenv("REDIS_URL"):
+            print("redis: пропущено — задайте REDIS_URL")
+            continue
+        print(f"{name}:")
+        failures += run_backend(name)
+
+    print("Все проверки пройдены" if not failures else f"Не пройдено проверок: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import os
+import shutil
 import tempfile
 import asyncio
-import aiohttp
+import hashlib
 import time
 import logging
 import re
@@ -10,37 +11,115 @@ from pathlib import Path
 from datetime import datetime
 from aiogram import Bot, Dispatcher, Router, F, types
 from aiogram.enums import ParseMode, ContentType
-from aiogram.filters import Command
+from aiogram.filters import Command, ExceptionTypeFilter
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ErrorEvent
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from html import escape
 from dotenv import load_dotenv
 
-from auth import check_user_registered, register_user, log_action
-from audio_utils import handle_audio_file, split_audio, create_transcript_pdf, create_transcript_txt 
-from salute_speech_api import transcribe_audio
-from gigachat_api import get_access_token, send_prompt, upload_file_to_gigachat 
+from auth import check_user_registered, register_user, log_action, start_user_sync, stop_user_sync
+from auth import start_log_writer, stop_log_writer
+from audio_utils import handle_audio_file, probe_audio, split_audio, create_transcript_pdf, create_transcript_txt
+from audio_utils import make_transcript_dir
+from salute_speech_api import transcribe_chunk, salute_limiter
+from gigachat_api import get_access_token, send_prompt, send_prompt_stream, GigaChatFileNotFound
+from gigachat_files import get_transcript_file_id, invalidate_file, close_file_cache
+from token_manager import close_token_managers
+from http_client import init_http_client, close_http_client, get_session, get_pool_stats
+from executor_pool import init_executor_pool, close_executor_pool, run_blocking, get_executor_stats
+import transcript_cache
+import job_store
+from scheduler import JobScheduler, AdmissionError, JOB_DRAIN_TIMEOUT
+from progress import ProgressReporter
+from telegram_limiter import OutboundRateLimiter
+from session_store import create_session_store, SessionStoreUnavailable, JOB_RUNNING
+from metrics import timed, audio_seconds, bytes_processed, gigachat_tokens, Histogram, Gauge
+from metrics import start_metrics_server, stop_metrics_server
+import tracing
+from serving import BOT_MODE, UpdateTracker, run_polling, run_webhook
 
 
 
 # === Настройка окружения и бота ===
 load_dotenv()
+# Адрес Bot API: по умолчанию облачный, можно указать локальный сервер Bot API или заглушку
+TG_API_BASE = os.getenv("TG_API_BASE", "https://api.telegram.org").rstrip("/")
 bot = Bot(
     token=os.getenv("TG_BOT_TOKEN"),
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TG_API_BASE)),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
+# Все отправки и правки сообщений идут через общий и початовый лимит Telegram
+outbound_limiter = OutboundRateLimiter()
+bot.session.middleware(outbound_limiter)
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
+# Обработчики, которые ещё работают: их ждём при остановке бота
+update_tracker = UpdateTracker()
+dp.update.outer_middleware(update_tracker)
 
 # === Настройка логирования ===
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(level=getattr(logging, log_level, logging.INFO))
 
 
-# === Хранилище последних расшифровок пользователей ===
-last_transcriptions = {}
+# === Общее состояние: последние расшифровки, выбор промпта, статусы задач ===
+# memory — LRU с TTL и лимитом памяти; sqlite — переживает перезапуск и доступно процессам
+# на одной машине; redis — общее для копий бота на разных машинах
+sessions = create_session_store()
+
+# === Параллельное распознавание частей аудио ===
+# Сколько частей одной записи распознаются одновременно (1 — последовательный режим).
+# Общий лимит запросов к SaluteSpeech подстраивается сам (salute_speech_api.salute_limiter)
+TRANSCRIBE_CONCURRENCY = max(1, int(os.getenv("TRANSCRIBE_CONCURRENCY", "4")))
+
+# === Очередь тяжёлых задач: скачивание, конвертация, распознавание, PDF ===
+# Лимит задач на пользователя и отмена — через общее состояние, чтобы действовать для всех копий бота
+job_scheduler = JobScheduler(state=sessions)
+
+# === Метрики состояния: считываются при каждом запросе /metrics ===
+Gauge("bot_jobs_queued", "Задачи, ожидающие воркера").set_function(lambda: job_scheduler.get_stats()["queued"])
+Gauge("bot_jobs_running", "Задачи в работе").set_function(lambda: job_scheduler.get_stats()["running"])
+Gauge("bot_blocking_pool_pending", "Задачи в пуле блокирующих этапов").set_function(lambda: get_executor_stats()["pending"])
+Gauge("bot_salute_concurrency_limit", "Текущий лимит запросов к SaluteSpeech").set_function(lambda: salute_limiter.limit)
+Gauge("bot_salute_in_flight", "Запросы к SaluteSpeech в работе").set_function(lambda: salute_limiter.get_stats()["in_flight"])
+Gauge("bot_telegram_chats_waiting", "Чаты с очередью отправки в Telegram").set_function(lambda: outbound_limiter.get_stats()["waiting"])
+Gauge("bot_http_connections", "Соединения в пуле HTTP-клиента по хостам", ("host", "state")).set_function(
+    lambda: {(host, state): entry[state] for host, entry in get_pool_stats().items() for state in ("open", "idle", "in_use")}
+)
+Gauge("bot_http_requests_waiting", "Запросы, ждущие свободного соединения", ("host",)).set_function(
+    lambda: {(host,): entry["waiting"] for host, entry in get_pool_stats().items()}
+)
+Gauge("bot_sessions_in_memory", "Расшифровки пользователей в памяти").set_function(lambda: sessions.get_stats()["users"])
+# Время до первого фрагмента потокового ответа GigaChat
+gigachat_first_token = Histogram("bot_gigachat_first_token_seconds", "Время до первого фрагмента ответа GigaChat")
+
+# === Скачивание файлов из Telegram ===
+# Облачный Bot API отдаёт файлы не больше 20 МБ; для локального сервера лимит можно поднять
+MAX_DOWNLOAD_MB = int(os.getenv("TG_MAX_DOWNLOAD_MB", "20"))
+MAX_DOWNLOAD_BYTES = MAX_DOWNLOAD_MB * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024      # размер блока при потоковой записи на диск
+
+# === Потоковый вывод ответа GigaChat ===
+# Ответ показывается по мере генерации: одно сообщение редактируется, пока не заполнится
+GIGACHAT_STREAM = os.getenv("GIGACHAT_STREAM", "true").lower() in ("1", "true", "yes")
+# Не чаще одного редактирования сообщения за столько секунд (лимиты Telegram на правки)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+# Длина текста в одном сообщении: с запасом до лимита Telegram в 4096 символов
+STREAM_MESSAGE_LIMIT = 3800
+
+# === Анализ длинных расшифровок по частям (map-reduce) ===
+# Расшифровка длиннее порога сначала конспектируется окнами, затем анализируется сводка конспектов
+MAP_REDUCE_THRESHOLD_TOKENS = int(os.getenv("MAP_REDUCE_THRESHOLD_TOKENS", "24000"))
+MAP_WINDOW_TOKENS = int(os.getenv("MAP_WINDOW_TOKENS", "6000"))       # размер одного окна
+MAP_CONCURRENCY = max(1, int(os.getenv("MAP_CONCURRENCY", "4")))      # окон конспектируется одновременно
+MAP_REDUCE_MAX_LEVELS = 3            # сколько раз можно конспектировать уже готовые конспекты
+CHARS_PER_TOKEN = 3                  # грубая оценка для русского текста (с запасом)
 
 # === Стандартный системный промпт ===
 SYSTEM_PROMPT = (
@@ -54,6 +133,20 @@ SYSTEM_PROMPT = (
     "Допускается использование прямых цитат участников для подтверждения ключевых выводов. Отчёт должен быть средней длины — достаточно подробным, но без избыточной информации. Оформление — в виде структурированного текста или списка."
 )
 
+# === Промпты для анализа по частям ===
+MAP_PROMPT = (
+    "Ниже приведена часть {index} из {total} транскрипции совещания.\n\n"
+    "Составь подробный конспект этой части: темы обсуждения, ключевые аргументы и выводы, "
+    "договорённости и поручения с ответственными и сроками, важные прямые цитаты с указанием говорящего. "
+    "Ничего не додумывай и не оценивай — только факты из текста. "
+    "Учти, что по всем конспектам затем будет выполнен запрос пользователя:\n«{user_prompt}»\n\n"
+    "Текст части:\n{window}"
+)
+REDUCE_PREFIX = (
+    "Запись совещания слишком длинная, поэтому во вложенном .txt-файле вместо полной транскрипции "
+    "находятся последовательные конспекты её частей. Считай их транскрипцией совещания.\n\n"
+)
+
 
 
 # === Преобразование Markdown → HTML (только жирный и курсив) ===
@@ -77,74 +170,82 @@ start_keyboard = ReplyKeyboardMarkup(
 
 
 
-# === Декоратор для логирования времени выполнения ===
-# фабрика декораторов
-def log_timing(name: str):
-    # декоратор
-    def decorator(func):
-        # сама функция - выполняется для каждой асинхронной функции, обернутой в декоратор
-        async def wrapper(*args, **kwargs):
-            # Засекаем время начала выполнения
-            start = time.time()
-            # Выполняем асинхронную функцию и получаем результат
-            result = await func(*args, **kwargs)
-            # Вычисляем, сколько времени заняло выполнение
-            elapsed = time.time() - start
-            # Логируем в консоль
-            logging.info(f"[⏱] {name} заняло {elapsed:.2f} сек.")
-
-            # Если передан message и username, логируем в Airtable
-            for arg in args:
-                if isinstance(arg, Message):
-                    user_id = arg.from_user.id
-                    username = arg.from_user.username
-
-                    asyncio.create_task(log_action(user_id, username, f"{name} заняло {elapsed:.2f} сек."))
-                    break
-
-            return result
-        return wrapper
-    return decorator
-
-
-
 # === Скачивание файла из Telegram ===
-@log_timing("Скачивание файла с Telegram") # -- Консольный вывод времени выполнения
-async def download_telegram_file(file_id: str, temp_paths: list[str]) -> str:
+@timed("download")
+async def download_telegram_file(file_id: str, temp_paths: list[str], file_name: str | None = None,
+                                 progress: ProgressReporter | None = None) -> tuple[str, str]:
+    """
+    Скачивает файл из Telegram потоком, частями по DOWNLOAD_CHUNK_SIZE байт,
+    поэтому расход памяти не зависит от размера файла.
+    Сохраняет настоящее расширение файла и по пути считает SHA-256 содержимого.
+    Ход скачивания показывается через progress (если передан).
+    Возвращает путь к временному файлу и хэш.
+    """
     # Получаем информацию о файле по его ID через Telegram API
     try:
         # Получаем информацию о файле
         file_info = await bot.get_file(file_id)
-        print(f"[DEBUG] file_id: {file_id}")
-        print(f"[DEBUG] file_path: {file_info.file_path}")
-        print(f"[DEBUG] file_size: {file_info.file_size}")
-        print(f"[DEBUG] file_info: {file_info}")
+        logging.debug(f"[📥] Файл {file_id}: {file_info.file_path}, {file_info.file_size} байт")
+        tracing.set_attributes(file_size=file_info.file_size)
 
     except Exception as e:
         # Telegram не дал скачать файл — возможно, он слишком большой
         raise Exception(f"❌ Ошибка при получении файла из Telegram: {e}")
 
-
+    # Проверяем размер заранее, если Telegram его сообщил
+    if file_info.file_size and file_info.file_size > MAX_DOWNLOAD_BYTES:
+        raise Exception(f"Файл слишком большой: {file_info.file_size / 1024 / 1024:.1f} МБ (максимум {MAX_DOWNLOAD_MB} МБ)")
 
     # Формируем прямую ссылку для скачивания файла
-    file_url = f"https://api.telegram.org/file/bot{bot.token}/{file_info.file_path}"
+    file_url = bot.session.api.file_url(bot.token, file_info.file_path)
+
+    # Настоящее расширение: из пути на серверах Telegram, иначе — из имени файла
+    suffix = Path(file_info.file_path or "").suffix.lower() or Path(file_name or "").suffix.lower()
 
     # Создаем временный файл заранее, чтобы сохранить в него содержимое
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
     temp_paths.append(temp_file.name)
 
+    sha256 = hashlib.sha256()
+    downloaded = 0
+
     # Асинхронно загружаем файл
-    async with aiohttp.ClientSession() as session:
+    try:
+        session = get_session()
         async with session.get(file_url) as response:
-            if response.status == 200:
-                # Считываем контент и записываем во временный файл
-                content = await response.read()
-                temp_file.write(content)
-            else:
+            if response.status != 200:
                 raise Exception(f"Ошибка загрузки файла: {response.status}")
 
-    temp_file.close()
-    return temp_file.name  # Возвращаем путь к временному файлу
+            # Пишем во временный файл по частям, не держа весь файл в памяти
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                downloaded += len(chunk)
+                if downloaded > MAX_DOWNLOAD_BYTES:
+                    raise Exception(f"Файл слишком большой (максимум {MAX_DOWNLOAD_MB} МБ)")
+                sha256.update(chunk)
+                temp_file.write(chunk)
+                if progress and file_info.file_size:
+                    progress.update(
+                        f"📥 Загружаю аудиофайл: {downloaded / 1024 / 1024:.1f} из "
+                        f"{file_info.file_size / 1024 / 1024:.1f} МБ..."
+                    )
+    finally:
+        temp_file.close()
+        bytes_processed.inc(downloaded, stage="download")
+        tracing.set_attributes(bytes=downloaded, suffix=suffix)
+
+    return temp_file.name, sha256.hexdigest()  # Возвращаем путь к временному файлу и хэш содержимого
+
+
+
+# === Наилучшая точка разрыва текста не дальше max_length ===
+def find_split_point(text: str, max_length: int) -> int:
+    # Пытаемся найти наилучшую точку разрыва
+    for sep in ["\n", ". ", ", ", " — ", " – ", " - "]:
+        split_at = text.rfind(sep, 0, max_length)
+        if split_at != -1:
+            return split_at + len(sep)  # включаем разделитель в кусок
+    # Если ни один разделитель не найден — жёсткое разбиение
+    return max_length
 
 
 
@@ -159,16 +260,7 @@ def split_text(text: str, max_length: int = 4096) -> list[str]:
     """
     chunks = []
     while len(text) > max_length:
-        # Пытаемся найти наилучшую точку разрыва
-        for sep in ["\n", ". ", ", ", " — ", " – ", " - "]:
-            split_at = text.rfind(sep, 0, max_length)
-            if split_at != -1:
-                split_at += len(sep)  # включаем разделитель в кусок
-                break
-        else:
-            # Если ни один разделитель не найден — жёсткое разбиение
-            split_at = max_length
-
+        split_at = find_split_point(text, max_length)
         chunks.append(text[:split_at].strip())
         text = text[split_at:].strip()
 
@@ -180,60 +272,243 @@ def split_text(text: str, max_length: int = 4096) -> list[str]:
 
 
 # === Обработка и транскрипция аудиофайла ===
-@log_timing("Распознавание аудио") # -- Консольный и Airtable вывод времени выполнения
-async def process_audio_file(file_path: str, message: Message) -> str:
-    # Обрабатываем аудиофайл
-    processed_path = handle_audio_file(file_path)
+@timed("transcribe")
+async def process_audio_file(job: dict, message: Message, progress: ProgressReporter) -> tuple[str, bool]:
+    """
+    Распознаёт аудио задачи по частям, одновременно обрабатывая до
+    TRANSCRIBE_CONCURRENCY частей. Тексты собираются в исходном порядке
+    независимо от того, какая часть завершилась первой.
+
+    Текст каждой распознанной части сразу сохраняется в job_store,
+    поэтому повторный запуск (после ошибки или перезапуска бота)
+    распознаёт только недостающие части. Ход работы показывается через progress.
+    Возвращает текст и признак того, что распознаны все части.
+    """
+    job_id = job["job_id"]
+    file_path = job["audio_path"]
+
+    # Обрабатываем аудиофайл (ffmpeg и нарезка — в пуле, чтобы не блокировать бота)
+    progress.update("🛠 Обрабатываю аудио...")
+    processed_path = await run_blocking("convert", handle_audio_file, file_path)
+    duration = (await run_blocking("probe", probe_audio, processed_path))["duration"]
+    tracing.set_attributes(audio_sec=round(duration, 1))
     # Разбиваем обработанный файл на части
-    parts = split_audio(processed_path)
-    
-    # Инициализируем строку для финального текста
-    transcript = ""
-    # Уведомляем пользователя о начале распознавания
-    await message.answer(f"🎧 Распознаю речь ({len(parts)} фрагментов)...")
-
-    # Отправляем одно сообщение, которое будем обновлять в процессе
-    status_msg = await message.answer("▶️ Обработка части 1...")
+    progress.update("✂️ Делю запись на фрагменты...")
+    try:
+        parts = await run_blocking("split", split_audio, processed_path)
+    finally:
+        # Сконвертированная копия больше не нужна — части уже на диске
+        if Path(processed_path) != Path(file_path):
+            try:
+                os.remove(processed_path)
+            except Exception:
+                pass
+    job_store.set_total_parts(job_id, len(parts))
+
+    # Части, распознанные при прошлых запусках
+    texts: list[str | None] = [None] * len(parts)          # тексты по индексу части
+    for idx, part_text in job_store.get_chunks(job_id).items():
+        if idx < len(parts):
+            texts[idx] = part_text
+    pending = [idx for idx, part_text in enumerate(texts) if part_text is None]
+    done = len(parts) - len(pending)
+    tracing.set_attributes(parts=len(parts), pending=len(pending))
+
+    # Уведомляем пользователя о начале распознавания (в том же статусном сообщении)
+    if done:
+        progress.update(f"🎧 Продолжаю распознавание: готово {done} из {len(parts)} фрагментов...")
+    else:
+        progress.update(f"🎧 Распознаю речь: готово 0 из {len(parts)} фрагментов...")
 
-    for idx, part_path in enumerate(parts):
-        # Обновляем текст в одном сообщении, вместо спама
-        await status_msg.edit_text(f"▶️ Обработка части {idx + 1} из {len(parts)}...")
+    errors: dict[int, Exception] = {}                       # ошибки по индексу части
+    durations = [0.0] * len(parts)                          # время успешного запроса по каждой части
+    job_semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
 
-        try:
-            part_text = await transcribe_audio(part_path)
-            transcript += part_text + "\n"
-        except Exception as e:
-            await message.answer(f"⚠️ Ошибка в части {idx + 1}. Распознавание остановлено.\n\n{e}")
-            break
-        finally:
+    async def transcribe_part(idx: int, part_path: Path):
+        nonlocal done
+        # Сначала место в задаче пользователя, затем — в общем адаптивном лимите (внутри transcribe_chunk).
+        # Ошибка одной части (после всех повторов) не останавливает остальные
+        async with job_semaphore:
+            try:
+                # Только сам запрос: ожидание в общем лимите и паузы между повторами
+                # завысили бы «последовательное» время при нагрузке
+                texts[idx], durations[idx] = await transcribe_chunk(part_path, part=idx + 1)
+            except Exception as e:
+                errors[idx] = e
+                return
+
+        # Контрольная точка: эту часть больше не придётся распознавать
+        job_store.save_chunk(job_id, idx, texts[idx])
+        done += 1
+        # Правки прореживает ProgressReporter — сколько бы частей ни завершалось одновременно
+        progress.update(f"🎧 Распознаю речь: готово {done} из {len(parts)} фрагментов...")
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(transcribe_part(idx, parts[idx]) for idx in pending))
+    finally:
+        for part_path in parts:
             try:
                 os.remove(part_path)
             except Exception:
                 pass
+    elapsed = time.perf_counter() - started
 
-        await asyncio.sleep(0.1)
+    if errors:
+        idx = min(errors)
+        tracing.set_attributes(failed_parts=len(errors))
+        await progress.finish(f"⏸ Распознано {done} из {len(parts)} фрагментов.")
+        await message.answer(
+            f"⚠️ Не удалось распознать частей: {len(errors)} (первая — часть {idx + 1}). "
+            f"Готово {done} из {len(parts)} частей.\n\n{errors[idx]}"
+        )
+    else:
+        await progress.finish(f"✅ Распознано фрагментов: {done} из {len(parts)}.")
+    logging.info(f"[🎙] Лимит запросов SaluteSpeech: {salute_limiter.get_stats()}")
+
+    # Сравниваем с последовательным режимом: сумма времени запросов всех частей против фактического
+    sequential = sum(durations)
+    if elapsed > 0 and len(pending) > 1:
+        speedup = sequential / elapsed
+        logging.info(
+            f"[⚡] Распознавание {len(pending)} частей (параллельно {TRANSCRIBE_CONCURRENCY}): "
+            f"{elapsed:.2f} сек. вместо ~{sequential:.2f} сек. последовательно, ускорение x{speedup:.1f}"
+        )
+        log_action(
+            job["user_id"],
+            job["username"],
+            f"[⚡] Ускорение распознавания x{speedup:.1f} ({len(pending)} частей, {elapsed:.2f} сек.)"
+        )
+
+    # Собираем текст в исходном порядке
+    complete = all(part_text is not None for part_text in texts)
+    if complete:
+        audio_seconds.inc(duration)
+    transcript = "\n".join(part_text for part_text in texts if part_text is not None)
+    return transcript.strip(), complete
+
+
+
+# === Запуск задачи распознавания и обработка незавершённого результата ===
+async def run_transcription_job(job: dict, message: Message, progress: ProgressReporter | None = None) -> str | None:
+    """
+    Распознаёт аудио задачи. Полная расшифровка попадает в кэш,
+    а задача удаляется. Если часть фрагментов не распознана, задача
+    остаётся в job_store и пользователю предлагается её продолжить.
+    """
+    job_store.set_status(job["job_id"], job_store.STATUS_RUNNING)
+    try:
+        transcript, complete = await process_audio_file(job, message, progress or ProgressReporter(message))
+    except Exception:
+        job_store.set_status(job["job_id"], job_store.STATUS_PARTIAL)
+        raise
+
+    if not complete:
+        job_store.set_status(job["job_id"], job_store.STATUS_PARTIAL)
+        await message.answer(
+            "⏸ Расшифровка сохранена частично. Уже распознанные фрагменты не потеряются.",
+            reply_markup=resume_keyboard(job["job_id"])
+        )
+        return None
+
+    if transcript:
+        transcript_cache.put(job["audio_hash"], transcript, job["file_unique_id"])
+    job_store.finish_job(job["job_id"])
+    return transcript
+
+
+
+# === Кнопка продолжения распознавания ===
+def resume_keyboard(job_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔁 Продолжить распознавание", callback_data=f"resume_job:{job_id}")]
+    ])
 
-    return transcript.strip()
 
 
 # === Анализ текста с использованием GigaChat ===
-@log_timing("Анализ текста через GigaChat") # -- Консольный и Airtable вывод времени выполнения
-async def analyze_text(transcript: str, system_prompt: str, message: Message, date_str: Path) -> str:
+@timed("analyze")
+async def analyze_text(transcript: str, system_prompt: str, message: Message, date_str: Path,
+                       extra_usage: dict | None = None) -> str:
     # Используем системный промпт, переданный пользователем
     prompt = f"{system_prompt.strip()}"
     token = await get_access_token()
-    # Создаём TXT-файл
-    txt_path = create_transcript_txt(transcript, date_str)
-    
-    # Загружаем файл в GigaChat
-    file_id = await upload_file_to_gigachat(txt_path, token)
+    # TXT-файл расшифровки загружается в GigaChat один раз на несколько промптов
+    file_id = await get_transcript_file_id(transcript, date_str, token)
 
     # Отправляем промпт и получаем ответ вместе с информацией об использовании токенов
-    response = await send_prompt(prompt, token, attachment_ids=[file_id])
+    try:
+        response = await send_prompt(prompt, token, attachment_ids=[file_id])
+    except GigaChatFileNotFound:
+        # Файл на сервере уже удалён — загружаем заново и повторяем один раз
+        invalidate_file(file_id)
+        file_id = await get_transcript_file_id(transcript, date_str, token)
+        response = await send_prompt(prompt, token, attachment_ids=[file_id])
 
     result_text = response["content"]
-    usage = response.get("usage", {})
+    log_token_usage(message, add_usage(extra_usage or {}, response.get("usage", {})))
+
+    # Возвращаем только содержимое ответа от GigaChat
+    return result_text
+
+
 
+# === Суммирование расхода токенов нескольких запросов ===
+def add_usage(total: dict, usage: dict) -> dict:
+    result = dict(total)
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        if key in usage:
+            result[key] = result.get(key, 0) + usage[key]
+    return result
+
+
+
+# === Конспектирование длинной расшифровки по частям (этап map) ===
+async def summarize_windows(transcript: str, user_prompt: str,
+                            progress: ProgressReporter | None = None) -> tuple[str, dict]:
+    """
+    Делит расшифровку по границам абзацев и предложений на окна примерно по
+    MAP_WINDOW_TOKENS токенов и конспектирует их параллельно (не больше MAP_CONCURRENCY
+    запросов одновременно). Возвращает конспекты в исходном порядке и суммарный расход токенов.
+    """
+    windows = split_text(transcript, MAP_WINDOW_TOKENS * CHARS_PER_TOKEN)
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+    done = 0
+
+    async def summarize(index: int, window: str) -> dict:
+        nonlocal done
+        async with semaphore:
+            with tracing.span("map_window", index=index, chars=len(window)):
+                token = await get_access_token()
+                prompt = MAP_PROMPT.format(index=index, total=len(windows), user_prompt=user_prompt.strip(), window=window)
+                response = await send_prompt(prompt, token)
+        done += 1
+        if progress:
+            progress.update(f"🧩 Запись длинная — конспектирую части: {done} из {len(windows)}...")
+        return response
+
+    tasks = [asyncio.create_task(summarize(i, window)) for i, window in enumerate(windows, start=1)]
+    try:
+        responses = await asyncio.gather(*tasks)
+    except Exception:
+        # Одна часть не удалась — остальные запросы уже не нужны
+        for task in tasks:
+            task.cancel()
+        raise
+
+    usage = {}
+    for response in responses:
+        usage = add_usage(usage, response.get("usage", {}))
+    summaries = "\n\n".join(
+        f"Часть {i} из {len(windows)}:\n{response['content'].strip()}"
+        for i, response in enumerate(responses, start=1)
+    )
+    return summaries, usage
+
+
+
+# === Логирование расхода токенов GigaChat ===
+def log_token_usage(message: Message, usage: dict):
     # Извлекаем количество использованных токенов
     used_prompt = usage.get("prompt_tokens", "?")
     used_completion = usage.get("completion_tokens", "?")
@@ -241,21 +516,155 @@ async def analyze_text(transcript: str, system_prompt: str, message: Message, da
 
     # Лог в консоль
     logging.info(f"Токены: prompt = {used_prompt}, completion = {used_completion}, total = {total}")
+    for kind in ("prompt", "completion"):
+        if isinstance(usage.get(f"{kind}_tokens"), int):
+            gigachat_tokens.inc(usage[f"{kind}_tokens"], kind=kind)
 
     # Лог в Airtable
     user_id = message.from_user.id
     username = message.from_user.username
-    await log_action(
+    log_action(
         user_id, 
         username, 
         f"[📊] Токены: prompt = {used_prompt}, completion = {used_completion}, total = {total}"
         )
 
-    # Возвращаем только содержимое ответа от GigaChat
+
+
+# === Потоковый анализ: ответ GigaChat выводится в Telegram по мере генерации ===
+@timed("analyze")
+async def analyze_text_stream(transcript: str, system_prompt: str, message: Message, date_str: Path,
+                              extra_usage: dict | None = None) -> str:
+    """
+    Читает ответ GigaChat потоком и показывает его в одном сообщении, редактируя его
+    не чаще STREAM_EDIT_INTERVAL секунд. Когда сообщение заполняется, оно фиксируется
+    в окончательном виде (с разметкой), и текст продолжается в новом сообщении.
+    Возвращает полный текст ответа.
+    """
+    prompt = f"{system_prompt.strip()}"
+    token = await get_access_token()
+    file_id = await get_transcript_file_id(transcript, date_str, token)
+
+    started = time.perf_counter()
+    first_token_at = None
+    usage = {}
+    parts = []            # весь ответ по фрагментам
+    segment = ""          # текст текущего сообщения
+    # Текущее сообщение ответа: создаётся с первым фрагментом и правится не чаще STREAM_EDIT_INTERVAL
+    reporter = ProgressReporter(message, interval=STREAM_EDIT_INTERVAL)
+
+    try:
+        stream = send_prompt_stream(prompt, token, attachment_ids=[file_id])
+        first_event = await anext(stream, None)
+    except GigaChatFileNotFound:
+        # Файл на сервере уже удалён — загружаем заново и повторяем один раз
+        invalidate_file(file_id)
+        file_id = await get_transcript_file_id(transcript, date_str, token)
+        stream = send_prompt_stream(prompt, token, attachment_ids=[file_id])
+        first_event = await anext(stream, None)
+
+    async for event in chain_first(first_event, stream):
+        if "usage" in event:
+            usage = event["usage"]
+            continue
+
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+            ttft = first_token_at - started
+            gigachat_first_token.observe(ttft)
+            logging.info(f"[⏱] Первый фрагмент ответа GigaChat через {ttft:.2f} сек.")
+
+        parts.append(event["content"])
+        segment += event["content"]
+
+        # Сообщение заполнено — фиксируем его и продолжаем в новом
+        while len(segment) > STREAM_MESSAGE_LIMIT:
+            split_at = find_split_point(segment, STREAM_MESSAGE_LIMIT)
+            await finish_stream_segment(reporter, segment[:split_at].strip())
+            segment = segment[split_at:].lstrip()
+            reporter = ProgressReporter(message, interval=STREAM_EDIT_INTERVAL)
+
+        if segment.strip():
+            reporter.update(segment)
+
+    # Окончательный вид последнего сообщения
+    if segment.strip():
+        await finish_stream_segment(reporter, segment.strip())
+
+    result_text = "".join(parts)
+    if not result_text.strip():
+        await message.answer("⚠️ GigaChat вернул пустой ответ.")
+    log_token_usage(message, add_usage(extra_usage or {}, usage))
     return result_text
 
 
 
+# Возвращает уже прочитанное первое событие потока, затем остальные
+async def chain_first(first_event: dict | None, stream):
+    if first_event is None:
+        return
+    yield first_event
+    async for event in stream:
+        yield event
+
+
+
+# === Окончательный вид сообщения потокового ответа ===
+async def finish_stream_segment(reporter: ProgressReporter, text: str):
+    """
+    Промежуточный текст выводится без разметки: незакрытые ** или теги в середине
+    генерации сломали бы HTML. Окончательный — через markdown_to_html, а если Telegram
+    его не принимает — снова простым текстом.
+    """
+    try:
+        await reporter.finish(markdown_to_html(text), parse_mode=ParseMode.HTML)
+    except TelegramBadRequest as e:
+        logging.warning(f"[⚠️] Не удалось применить разметку к ответу GigaChat: {e}")
+        await reporter.finish(text)
+
+
+
+# === Анализ и отправка результата пользователю ===
+async def run_analysis(message: Message, transcript: str, system_prompt: str, date_str: Path,
+                       trace_id: str | None = None):
+    # Анализ продолжает трассировку распознавания этой записи (trace_id из сессии)
+    root = tracing.start_trace("analysis", trace_id, chat_id=message.chat.id, prompt_chars=len(system_prompt))
+    with tracing.use_span(root):
+        await analyze_transcript(message, transcript, system_prompt, date_str)
+
+
+# Конспектирование длинной записи (при необходимости), запрос к GigaChat и вывод ответа
+async def analyze_transcript(message: Message, transcript: str, system_prompt: str, date_str: Path):
+    progress = ProgressReporter(message)
+    progress.update("📨 Отправляю в GigaChat...")
+
+    # Длинная запись не помещается в контекст модели — сначала конспектируем её по частям
+    usage = {}
+    level = 0
+    while len(transcript) / CHARS_PER_TOKEN > MAP_REDUCE_THRESHOLD_TOKENS and level < MAP_REDUCE_MAX_LEVELS:
+        progress.update("🧩 Запись длинная — анализирую её по частям...")
+        started = time.perf_counter()
+        transcript, map_usage = await summarize_windows(transcript, system_prompt, progress)
+        usage = add_usage(usage, map_usage)
+        level += 1
+        logging.info(f"[🧩] Конспектирование по частям (уровень {level}) заняло {time.perf_counter() - started:.2f} сек.")
+    if level:
+        system_prompt = REDUCE_PREFIX + system_prompt
+        tracing.set_attributes(map_reduce_levels=level)
+
+    if GIGACHAT_STREAM:
+        await progress.finish("📋 Результат анализа:")
+        await analyze_text_stream(transcript, system_prompt, message, date_str, extra_usage=usage)
+        return
+
+    progress.update("🧠 GigaChat готовит ответ...")
+    result = await analyze_text(transcript, system_prompt, message, date_str, extra_usage=usage)
+    await progress.finish("📋 Результат анализа:")
+    for chunk in split_text(markdown_to_html(result)):
+        await message.answer(chunk)
+
+
+
 # === Команда /start ===
 @router.message(Command("start"))
 async def cmd_start(message: Message):
@@ -263,8 +672,14 @@ async def cmd_start(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
 
-    # Проверяем, зарегистрирован ли пользователь в системе
-    user = await check_user_registered(user_id)
+    # Проверяем, зарегистрирован ли пользователь в системе.
+    # Если Airtable не ответил, не регистрируем: пользователь может уже быть в таблице
+    try:
+        user = await check_user_registered(user_id)
+    except Exception as e:
+        logging.warning(f"[👥] Не удалось проверить пользователя {user_id}: {e}")
+        await message.answer("⚠️ Не удалось проверить регистрацию, попробуйте через минуту.")
+        return
     if user:
         await message.answer(
             f"Здравствуйте, <b>{user.get('ИО', ['Пользователь'])[0]}</b>! Вы авторизованы.",
@@ -275,7 +690,7 @@ async def cmd_start(message: Message):
         await register_user(user_id, username)
         await message.answer("Вы зарегистрированы. Обратитесь к администратору для авторизации.")
     # Логируем запуск команды
-    await log_action(user_id, username, "/start")
+    log_action(user_id, username, "/start")
 
 
 
@@ -285,55 +700,122 @@ async def handle_audio(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
 
-    await log_action(user_id, username, "Загрузка аудио")
+    log_action(user_id, username, "Загрузка аудио")
 
     file = message.voice or message.audio or message.document
-    temp_paths = []     # Храним пути к временным файлам для последующего удаления
-    
-    try:
-        await message.answer("📥 Загружаю аудиофайл...")
-        # Скачиваем файл с Telegram-серверов
-        downloaded_path = await download_telegram_file(file.file_id, temp_paths)
-        # Добавляем путь к временному файлу для последующей очистки
-        temp_paths.append(downloaded_path)
 
-        await message.answer("🛠 Обрабатываю аудио...")
-        # Транскрибируем аудиофайл и получаем расшифровку
-        transcript = await process_audio_file(downloaded_path, message)
-        if not transcript:
-            await message.answer("❌ Не удалось распознать речь.")
-            return
-        
-        # Генерация PDF-файла с расшифровкой
-        # Текущая дата в формате ДДММГГГГ
-        date_str = datetime.now().strftime("%d%m%Y")
-        # Сохраняем дату расшифровки для анализа
-        last_transcriptions[f"{user_id}_date"] = date_str
+    # Трассировка загрузки: от получения сообщения до отправки расшифровки
+    trace_id = tracing.new_trace_id()
+    received_at = time.time()
+    logging.info(f"[🧭] Загрузка от {user_id}: трассировка {trace_id}")
 
-        # Создаём PDF-файл и txt-файл с расшифровкой
-        pdf_path = create_transcript_pdf(transcript, date_str)
-        txt_path = create_transcript_txt(transcript, date_str)
+    # Эту запись уже расшифровывали — не скачиваем, не распознаём и не ставим в очередь
+    transcript = transcript_cache.get_by_file_id(file.file_unique_id)
+    if transcript is not None:
+        with tracing.use_span(tracing.start_trace("upload", trace_id, user_id=user_id, cached=True)):
+            await message.answer("♻️ Эта запись уже расшифрована, использую готовый текст.")
+            try:
+                await send_transcript(message, user_id, transcript)
+            except Exception as e:
+                await message.answer(f"⚠️ Ошибка: {e}")
+                log_action(user_id, username, f"Ошибка: {e}")
+        return
+
+    # Тяжёлая обработка — через очередь с ограниченным числом воркеров
+    await submit_job(message, user_id, lambda: process_upload(message, file, trace_id, received_at))
 
 
-        # Отправляем файлы с расшифровкой пользователю
-        await message.answer_document(types.FSInputFile(str(pdf_path)))
-        await message.answer_document(types.FSInputFile(str(txt_path)))
 
-        # Сохраняем текст расшифровки
-        last_transcriptions[user_id] = transcript
+# === Постановка тяжёлой задачи в очередь ===
+async def submit_job(message: Message, user_id: int, run):
+    try:
+        scheduled = job_scheduler.submit(user_id, run, on_drop=lambda: message.answer(
+            "⚠️ Бот перезапустился раньше, чем ваша запись дошла до обработки. Отправьте её ещё раз через минуту."
+        ))
+    except AdmissionError as e:
+        await message.answer(f"⏳ {e}")
+        return
 
-        # Отправляем промпт для анализа и кнопки выбора--------------------
+    if scheduled.position:
         await message.answer(
-            f"🧠 Вот стандартный промпт для анализа расшифровки:\n\n{escape(SYSTEM_PROMPT)}",
+            f"⏳ Вы #{scheduled.position} в очереди. Обработка начнётся автоматически.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Использовать стандартный", callback_data="use_system_prompt")],
-                [InlineKeyboardButton(text="✍️ Ввести свой", callback_data="custom_prompt")]
+                [InlineKeyboardButton(text="❎ Отменить", callback_data=f"cancel_queued:{scheduled.id}")]
             ])
         )
 
+
+
+# === Отмена задачи, ожидающей в очереди ===
+@router.callback_query(F.data.startswith("cancel_queued:"))
+async def handle_cancel_queued(callback: CallbackQuery):
+    job_id = callback.data.split(":", 1)[1]
+    if job_scheduler.cancel(job_id, callback.from_user.id):
+        await callback.message.edit_text("❎ Обработка отменена.")
+        log_action(callback.from_user.id, callback.from_user.username, "Отмена задачи в очереди")
+    elif sessions.get_job_status(job_id) == JOB_RUNNING:
+        await callback.answer("Задача уже выполняется.", show_alert=True)
+    else:
+        await callback.answer("Задача уже завершена или отменена.", show_alert=True)
+
+
+
+# === Скачивание и распознавание загруженного файла (выполняется воркером очереди) ===
+async def process_upload(message: Message, file, trace_id: str | None = None, received_at: float | None = None):
+    # Корневой спан начинается с получения сообщения, поэтому включает ожидание в очереди
+    root = tracing.start_trace(
+        "upload", trace_id, start=received_at, user_id=message.from_user.id,
+        file_unique_id=file.file_unique_id, file_size=getattr(file, "file_size", None)
+    )
+    with tracing.use_span(root):
+        if received_at is not None:
+            tracing.record_span("queue_wait", received_at)
+        await download_and_transcribe(message, file)
+
+
+# Скачивание, распознавание и отправка расшифровки
+async def download_and_transcribe(message: Message, file):
+    user_id = message.from_user.id
+    username = message.from_user.username
+    temp_paths = []     # Храним пути к временным файлам для последующего удаления
+
+    # Одно статусное сообщение на все этапы: скачивание, обработка, распознавание
+    progress = ProgressReporter(message)
+
+    try:
+        progress.update("📥 Загружаю аудиофайл...")
+        # Скачиваем файл с Telegram-серверов
+        downloaded_path, audio_hash = await download_telegram_file(
+            file.file_id, temp_paths, getattr(file, "file_name", None), progress
+        )
+        # Добавляем путь к временному файлу для последующей очистки
+        temp_paths.append(downloaded_path)
+
+        # Тот же файл мог прийти пересланным — ищем по содержимому
+        transcript = transcript_cache.get_by_hash(audio_hash, file.file_unique_id)
+        if transcript is not None:
+            await progress.finish("♻️ Эта запись уже расшифрована, использую готовый текст.")
+        else:
+            # Повторная отправка того же файла продолжает прерванную задачу
+            job = job_store.find_unfinished_job(user_id, audio_hash)
+            if job is not None and job["status"] == job_store.STATUS_RUNNING:
+                await progress.finish("⏳ Эта запись уже распознаётся, дождитесь результата.")
+                return
+            if job is None:
+                job = job_store.create_job(
+                    user_id, message.chat.id, username, audio_hash, file.file_unique_id, downloaded_path
+                )
+            # Транскрибируем аудиофайл и получаем расшифровку
+            transcript = await run_transcription_job(job, message, progress)
+            if transcript is None:
+                return
+        logging.info(f"[🗄] Кэш расшифровок: {transcript_cache.get_cache_stats()}")
+
+        await send_transcript(message, user_id, transcript)
+
     except Exception as e:
         await message.answer(f"⚠️ Ошибка: {e}")
-        await log_action(user_id, username, f"Ошибка: {e}")
+        log_action(user_id, username, f"Ошибка: {e}")
     finally:
         # Удаляем все временные файлы
         for path in temp_paths:
@@ -344,6 +826,116 @@ async def handle_audio(message: Message):
 
 
 
+# === Отправка готовой расшифровки пользователю ===
+async def send_transcript(message: Message, user_id: int, transcript: str):
+    if not transcript:
+        await message.answer("❌ Не удалось распознать речь.")
+        return
+    tracing.set_attributes(transcript_chars=len(transcript))
+
+    # Генерация PDF-файла с расшифровкой
+    # Текущая дата в формате ДДММГГГГ
+    date_str = datetime.now().strftime("%d%m%Y")
+
+    # Создаём PDF-файл и txt-файл с расшифровкой в отдельном каталоге этой задачи
+    out_dir = make_transcript_dir()
+    try:
+        pdf_path = await run_blocking("pdf", create_transcript_pdf, transcript, date_str, out_dir)
+        txt_path = create_transcript_txt(transcript, date_str, out_dir)
+
+        # Отправляем файлы с расшифровкой пользователю
+        await message.answer_document(types.FSInputFile(str(pdf_path)))
+        await message.answer_document(types.FSInputFile(str(txt_path)))
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    # Сохраняем текст расшифровки и дату для анализа (анализ продолжит эту же трассировку).
+    # Если пользователь успел прислать другую запись и её расшифровка уже сохранена
+    # (например, другой копией бота), эта её не заменяет и промпт не предлагается
+    if not sessions.set(user_id, transcript, date_str, tracing.current_trace_id(), message.date.timestamp()):
+        logging.info(f"[🗂] У пользователя {user_id} уже сохранена расшифровка более поздней записи")
+        return
+
+    # Отправляем промпт для анализа и кнопки выбора--------------------
+    await message.answer(
+        f"🧠 Вот стандартный промпт для анализа расшифровки:\n\n{escape(SYSTEM_PROMPT)}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Использовать стандартный", callback_data="use_system_prompt")],
+            [InlineKeyboardButton(text="✍️ Ввести свой", callback_data="custom_prompt")]
+        ])
+    )
+
+
+
+# === Продолжение прерванного распознавания ===
+@router.callback_query(F.data.startswith("resume_job:"))
+async def handle_resume_job(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    username = callback.from_user.username
+
+    job = job_store.get_job(callback.data.split(":", 1)[1])
+    if job is None or job["user_id"] != user_id:
+        await callback.answer("Задача не найдена или уже завершена.", show_alert=True)
+        return
+    if job["status"] == job_store.STATUS_RUNNING:
+        await callback.answer("Распознавание уже идёт.")
+        return
+
+    # Удаляем inline-клавиатуру под предыдущим сообщением
+    await callback.message.edit_reply_markup()
+    log_action(user_id, username, "Продолжение распознавания")
+    await submit_job(callback.message, user_id, lambda: resume_upload(callback.message, user_id, username, job))
+
+
+
+# === Продолжение распознавания (выполняется воркером очереди) ===
+async def resume_upload(message: Message, user_id: int, username: str, job: dict):
+    with tracing.use_span(tracing.start_trace("resume", user_id=user_id, job_id=job["job_id"])):
+        try:
+            transcript = await run_transcription_job(job, message)
+            if transcript is not None:
+                await send_transcript(message, user_id, transcript)
+        except Exception as e:
+            await message.answer(f"⚠️ Ошибка: {e}")
+            log_action(user_id, username, f"Ошибка: {e}")
+
+
+
+# === Напоминание о задачах, прерванных перезапуском или сбоем бота ===
+# Базу задач могут делить несколько процессов: напоминаем только о задачах
+# остановившихся процессов, и каждую задачу забирает один процесс
+async def notify_unfinished_jobs():
+    removed = job_store.cleanup_stale_jobs()
+    if removed:
+        logging.info(f"[💾] Удалено устаревших задач распознавания: {removed}")
+
+    for job in job_store.list_orphaned_jobs():
+        if not job_store.claim_orphaned_job(job["job_id"]):
+            continue
+        done = len(job_store.get_chunks(job["job_id"]))
+        total = job["total_parts"] or "?"
+        try:
+            await bot.send_message(
+                job["chat_id"],
+                f"⏸ Расшифровка была прервана (готово {done} из {total} фрагментов). Можно продолжить с места остановки.",
+                reply_markup=resume_keyboard(job["job_id"])
+            )
+        except Exception as e:
+            logging.warning(f"[💾] Не удалось напомнить о задаче {job['job_id']}: {e}")
+
+
+# Отметка «процесс жив» и поиск задач процессов, остановившихся аварийно
+async def watch_jobs_loop():
+    while True:
+        await asyncio.sleep(job_store.HEARTBEAT_INTERVAL)
+        try:
+            job_store.heartbeat()
+            await notify_unfinished_jobs()
+        except Exception as e:
+            logging.warning(f"[💾] Ошибка проверки прерванных задач: {e}")
+
+
+
 # === Выбрали это: Обработка системного промпта ===
 @router.callback_query(F.data == "use_system_prompt")
 async def handle_system_prompt_choice(callback: CallbackQuery):
@@ -351,21 +943,21 @@ async def handle_system_prompt_choice(callback: CallbackQuery):
     username = callback.from_user.username
     
     # Получаем последнюю расшифровку
-    transcript = last_transcriptions.get(user_id)
-    if not transcript:
+    session = sessions.get(user_id)
+    if not session:
         await callback.message.answer("❗ Нет текста для анализа. Отправьте аудио.")
         return
+    # Повторное нажатие (в том числе пришедшее в другую копию бота) анализ не повторяет
+    if not sessions.take_prompt_choice(user_id):
+        await callback.answer("Промпт уже выбран.")
+        return
     # Удаляем inline-клавиатуру под предыдущим сообщением
     await callback.message.edit_reply_markup()
-    await callback.message.answer("📨 Отправляю в GigaChat...")
     try:
-        # Отправляем транскрипт и системный промпт на анализ
-        date_str = last_transcriptions.get(f"{user_id}_date")  # получаем дату из кэша
-        result = await analyze_text(transcript, SYSTEM_PROMPT, callback.message, date_str) # передаём её в анализ
-        await callback.message.answer("📋 Результат анализа:")
-        for chunk in split_text(markdown_to_html(result)):
-            await callback.message.answer(chunk)
-        await log_action(user_id, username, "Анализ по системному промпту")
+        # Отправляем транскрипт и системный промпт на анализ (дата — для имени файла)
+        await run_analysis(callback.message, session["transcript"], SYSTEM_PROMPT, session["date_str"],
+                           session["trace_id"])
+        log_action(user_id, username, "Анализ по системному промпту")
     except Exception as e:
         await callback.message.answer(f"⚠️ Ошибка: {e}")
 
@@ -377,10 +969,12 @@ async def handle_custom_prompt_choice(callback: CallbackQuery):
     user_id = callback.from_user.id
 
     # Достаём последнюю транскрипцию для пользователя
-    transcript = last_transcriptions.get(user_id)
-    if not transcript:
+    if not sessions.get(user_id):
         await callback.message.answer("❗ Нет текста для анализа. Отправьте аудио.")
         return
+    if not sessions.take_prompt_choice(user_id):
+        await callback.answer("Промпт уже выбран.")
+        return
     # Удаляем inline-клавиатуру из сообщения
     await callback.message.edit_reply_markup()
     await callback.message.answer("✍️ Введите ваш промпт:")
@@ -394,33 +988,84 @@ async def receive_custom_prompt(msg: Message):
     username = msg.from_user.username
 
     # Проверяем, есть ли последняя транскрипция для пользователя
-    if user_id not in last_transcriptions:
+    session = sessions.get(user_id)
+    if not session:
         return
     # Получаем текст промпта от пользователя и отправляем его на анализ
     prompt = msg.text
-    await msg.answer("📨 Отправляю в GigaChat...")
     try:
-        transcript = last_transcriptions[user_id]
-        
-        date_str = last_transcriptions.get(f"{user_id}_date")  # получаем дату из кэша
-        result = await analyze_text(transcript, prompt, msg, date_str)  # передаём её в анализ
-
-        await msg.answer("📋 Результат анализа:")
-        for chunk in split_text(markdown_to_html(result)):
-            await msg.answer(chunk)
-        await log_action(user_id, username, f"Custom prompt: {prompt}")
+        await run_analysis(msg, session["transcript"], prompt, session["date_str"], session["trace_id"])  # дата — для имени файла
+        log_action(user_id, username, f"Custom prompt: {prompt}")
     except Exception as e:
         await msg.answer(f"⚠️ Ошибка: {e}")
 
 
 
 
+# === Хранилище состояния недоступно: сообщаем пользователю вместо молчания ===
+@dp.errors(ExceptionTypeFilter(SessionStoreUnavailable))
+async def handle_state_unavailable(event: ErrorEvent):
+    logging.warning(f"[🗂] {event.exception}")
+    update = event.update
+    if update.callback_query is not None:
+        await update.callback_query.answer("⚠️ Сервис временно недоступен, попробуйте через минуту.", show_alert=True)
+    elif update.message is not None:
+        await update.message.answer("⚠️ Сервис временно недоступен, попробуйте через минуту.")
+
+
+
+# === Плавная остановка: дожидаемся принятых задач и начатых обработчиков ===
+async def drain_in_flight():
+    started = time.monotonic()
+    await job_scheduler.drain(JOB_DRAIN_TIMEOUT)
+    await update_tracker.wait_idle(max(0.0, JOB_DRAIN_TIMEOUT - (time.monotonic() - started)))
+
+
+
 # === Точка входа ===
 async def main():
-    print("✅ Бот запущен")
-     # Удаляем вебхук и очищаем очередь необработанных обновлений
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    print(f"✅ Бот запущен ({BOT_MODE})")
+    # Общий пул HTTP-соединений для Airtable, SaluteSpeech, GigaChat и Telegram
+    init_http_client()
+    # Пул для блокирующих этапов: конвертация, нарезка, PDF
+    init_executor_pool()
+    # Кэш авторизованных пользователей из Airtable, обновляется в фоне
+    start_user_sync()
+    # Фоновая пакетная запись журнала действий в Airtable
+    start_log_writer()
+    # Эндпоинт /metrics для Prometheus
+    await start_metrics_server()
+    # Запись трассировок задач в JSONL-файл
+    tracing.start_tracing()
+    # Предлагаем продолжить расшифровки, прерванные прошлым запуском
+    job_store.heartbeat()
+    await notify_unfinished_jobs()
+    jobs_watch_task = asyncio.create_task(watch_jobs_loop())
+    # Воркеры очереди тяжёлых задач
+    job_scheduler.start()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot, job_scheduler.get_stats, drain_in_flight)
+        else:
+            await run_polling(dp, bot)
+            await drain_in_flight()
+    finally:
+        # Останавливаем воркеры; не успевшие завершиться задачи продолжатся после перезапуска
+        await job_scheduler.stop()
+        jobs_watch_task.cancel()
+        # Прерванные задачи этого процесса сразу доступны для продолжения
+        job_store.unregister_instance()
+        # Останавливаем фоновые обновления OAuth-токенов и кэша пользователей
+        await close_file_cache()
+        await close_token_managers()
+        await stop_user_sync()
+        # Дописываем журнал, пока HTTP-сессия ещё открыта
+        await stop_log_writer()
+        await bot.session.close()
+        await close_http_client()
+        await close_executor_pool()
+        await stop_metrics_server()
+        tracing.stop_tracing()
 
 if __name__ == "__main__":
     asyncio.run(main())
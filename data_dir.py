@@ -0,0 +1,49 @@
+import os
+import stat
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Каталог данных бота: кэш расшифровок, аудио незавершённых задач, трассировки.
+# Там лежат тексты совещаний, поэтому каталог доступен только пользователю бота
+BOT_DATA_DIR = Path(os.getenv("BOT_DATA_DIR", Path.home() / ".local" / "share" / "meeting_bot"))
+
+
+
+# === Закрытый каталог ===
+def private_dir(path: Path) -> Path:
+    """
+    Создаёт каталог с правами 0700 и проверяет уже существующий: это должен быть
+    каталог (не символическая ссылка) текущего пользователя, закрытый для остальных.
+    Иначе PermissionError — чужой или заранее подготовленный каталог не используем.
+    """
+    path = Path(path)
+    # Недостающие уровни тоже создаются закрытыми (mkdir(parents=True) создал бы их с правами по umask)
+    for missing in reversed([p for p in (path, *path.parents) if not p.exists()]):
+        missing.mkdir(mode=0o700, exist_ok=True)
+    info = path.lstat()
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{path} не каталог (возможно, символическая ссылка)")
+    if not hasattr(os, "getuid"):
+        # Windows: права POSIX не применяются
+        return path
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"Каталог {path} принадлежит другому пользователю")
+    if info.st_mode & 0o077:
+        raise PermissionError(f"Каталог {path} доступен другим пользователям, выполните: chmod 700 {path}")
+    return path
+
+
+# === Файлы с правами 0600 ===
+def private_opener(path, flags: int) -> int:
+    """opener для open(): новый файл создаётся с правами 0600 независимо от umask."""
+    return os.open(path, flags, 0o600)
+
+
+def private_file(path: Path) -> Path:
+    """Создаёт пустой файл 0600, если его нет, и закрывает права у существующего (например, базы SQLite)."""
+    os.close(private_opener(path, os.O_CREAT | os.O_WRONLY))
+    os.chmod(path, 0o600)
+    return path
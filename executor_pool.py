@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from dotenv import load_dotenv
+
+import tracing
+from metrics import stage_duration, stage_errors, Histogram
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Тип пула: thread — потоки (ffmpeg всё равно работает отдельным процессом),
+# process — процессы (если узким местом станет Python-код, например PDF)
+BLOCKING_POOL_KIND = os.getenv("BLOCKING_POOL_KIND", "thread").lower()
+BLOCKING_POOL_WORKERS = int(os.getenv("BLOCKING_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Сколько задач может одновременно выполняться и ждать в очереди пула
+BLOCKING_POOL_MAX_QUEUE = int(os.getenv("BLOCKING_POOL_MAX_QUEUE", "32"))
+
+_executor: Executor | None = None
+_pending = 0                                 # задач в работе и в очереди
+_stats: dict[str, dict[str, float]] = {}     # метрики по этапам
+
+# Ожидание свободного исполнителя пула по этапам
+pool_wait = Histogram("bot_blocking_pool_wait_seconds", "Ожидание свободного исполнителя пула", ("stage",))
+
+
+
+# === Пул переполнен ===
+class PoolOverloadedError(Exception):
+    pass
+
+
+
+# === Создание пула ===
+def init_executor_pool() -> Executor:
+    global _executor
+    if _executor is None:
+        if BLOCKING_POOL_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=BLOCKING_POOL_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_WORKERS, thread_name_prefix="blocking")
+        logging.info(f"[🧵] Пул для блокирующих задач: {BLOCKING_POOL_KIND}, {BLOCKING_POOL_WORKERS} исполнителей")
+    return _executor
+
+
+
+# === Остановка пула (дожидаемся выполняющихся задач) ===
+async def close_executor_pool():
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+
+
+# Выполняется в потоке или процессе пула: замеряем чистое время работы
+def _timed_call(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+
+# === Запуск блокирующей функции вне цикла событий ===
+async def run_blocking(stage: str, func, *args):
+    """
+    Выполняет синхронную функцию (ffmpeg, нарезка, PDF) в пуле,
+    не блокируя цикл событий бота.
+    Если в пуле уже BLOCKING_POOL_MAX_QUEUE задач — сразу отказывает,
+    чтобы не копить бесконечную очередь.
+    """
+    global _pending
+    if _pending >= BLOCKING_POOL_MAX_QUEUE:
+        raise PoolOverloadedError("Сервер перегружен обработкой аудио, попробуйте через несколько минут.")
+
+    _pending += 1
+    submitted = time.perf_counter()
+    stage_stats = _stats.setdefault(stage, {"count": 0, "errors": 0, "run_sec": 0.0, "max_run_sec": 0.0, "wait_sec": 0.0})
+    with tracing.span(stage) as span:
+        try:
+            future = init_executor_pool().submit(_timed_call, func, *args)
+            result, run_sec = await asyncio.wrap_future(future)
+        except Exception:
+            stage_stats["errors"] += 1
+            stage_errors.inc(stage=stage)
+            raise
+        finally:
+            _pending -= 1
+
+        # Время ожидания свободного исполнителя = общее время минус время работы
+        wait_sec = max(time.perf_counter() - submitted - run_sec, 0.0)
+        span.set(run_sec=round(run_sec, 3), pool_wait_sec=round(wait_sec, 3))
+    stage_stats["count"] += 1
+    stage_stats["run_sec"] += run_sec
+    stage_stats["max_run_sec"] = max(stage_stats["max_run_sec"], run_sec)
+    stage_stats["wait_sec"] += wait_sec
+    stage_duration.observe(run_sec, stage=stage)
+    pool_wait.observe(wait_sec, stage=stage)
+    logging.debug(f"[🧵] {stage}: работа {run_sec:.2f} сек., ожидание в очереди {wait_sec:.2f} сек.")
+
+    return result
+
+
+
+# === Метрики пула ===
+def get_executor_stats() -> dict:
+    """
+    Возвращает глубину очереди и метрики по этапам:
+    число запусков, ошибок, суммарное и максимальное время работы, суммарное ожидание.
+    """
+    return {
+        "kind": BLOCKING_POOL_KIND,
+        "workers": BLOCKING_POOL_WORKERS,
+        "pending": _pending,
+        "max_queue": BLOCKING_POOL_MAX_QUEUE,
+        "stages": {stage: dict(values) for stage, values in _stats.items()},
+    }
@@ -1,10 +1,14 @@
 import os
-import uuid
+import json
 import aiohttp
-from aiohttp import BasicAuth
 from pathlib import Path
 from dotenv import load_dotenv
 
+from http_client import get_session
+from token_manager import TokenManager, SBER_OAUTH_URL
+import tracing
+from metrics import timed, track, bytes_processed
+
 # Загружаем переменные окружения из .env
 load_dotenv()
 
@@ -15,46 +19,35 @@ MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat-Max")
 
 
 # URL для получения токена и отправки сообщений
-GIGACHAT_TOKEN_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-GIGACHAT_API_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+GIGACHAT_TOKEN_URL = SBER_OAUTH_URL
+GIGACHAT_API_BASE = os.getenv("GIGACHAT_API_BASE", "https://gigachat.devices.sberbank.ru/api/v1").rstrip("/")
+GIGACHAT_API_URL = f"{GIGACHAT_API_BASE}/chat/completions"
+GIGACHAT_FILES_URL = f"{GIGACHAT_API_BASE}/files"
+
+
+
+# === Сервер не нашёл вложенный файл (удалён или истёк) ===
+class GigaChatFileNotFound(Exception):
+    pass
 
 
 
 # === Получение токена доступа GigaChat ===
-async def get_access_token():
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",  # Формат отправляемых данных
-        "Accept": "application/json",                         # Ожидаемый формат ответа
-        "RqUID": str(uuid.uuid4())                            # Уникальный идентификатор запроса
-    }
-    data = {
-        "scope": "GIGACHAT_API_PERS"  # Область действия токена
-    }
+# Токен кэшируется менеджером до истечения срока и обновляется в фоне
+gigachat_tokens = TokenManager("GIGACHAT_API_PERS", CLIENT_ID, SECRET, GIGACHAT_TOKEN_URL)
 
-    # Создаём сессию и отправляем POST-запрос
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            GIGACHAT_TOKEN_URL,
-            headers=headers,
-            data=data,
-            auth=BasicAuth(CLIENT_ID, SECRET),  # Basic Auth с ID и секретом
-            ssl=False                           # отключение SSL-проверки
-        ) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                return json_data.get("access_token")
-            else:
-                text = await resp.text()
-                raise Exception(f"Ошибка получения токена: {resp.status} — {text}")
+async def get_access_token():
+    return await gigachat_tokens.get_token()
 
  
 
 # === Загрузка файла в GigaChat ===
+@timed("gigachat_upload")
 async def upload_file_to_gigachat(file_path: Path, access_token: str) -> str:
     """
     Загружает файл в GigaChat и возвращает file_id.
     """
-    url = "https://gigachat.devices.sberbank.ru/api/v1/files"
+    url = GIGACHAT_FILES_URL
 
     headers = {
         "Authorization": f"Bearer {access_token}"
@@ -62,6 +55,8 @@ async def upload_file_to_gigachat(file_path: Path, access_token: str) -> str:
 
     with open(file_path, "rb") as f:
         file_bytes = f.read()       # Читаем содержимое файла в байтах
+    bytes_processed.inc(len(file_bytes), stage="gigachat_upload")
+    tracing.set_attributes(bytes=len(file_bytes))
 
     data = aiohttp.FormData()
     # Добавляем только .txt файл с нужным MIME-типом
@@ -69,26 +64,59 @@ async def upload_file_to_gigachat(file_path: Path, access_token: str) -> str:
     # Цель использования файла — универсальная
     data.add_field("purpose", "general")
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, data=data, ssl=False) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                return json_data.get("id")
-            else:
-                text = await resp.text()
-                raise Exception(f"Ошибка загрузки файла в GigaChat: {resp.status} — {text}")
+    session = get_session()
+    async with session.post(url, headers=headers, data=data, ssl=False) as resp:
+        tracing.set_attributes(http_status=resp.status)
+        if resp.status == 200:
+            json_data = await resp.json()
+            return json_data.get("id")
+        else:
+            if resp.status == 401:
+                # Токен отозван или истёк раньше срока — запросим новый
+                gigachat_tokens.invalidate()
+            text = await resp.text()
+            raise Exception(f"Ошибка загрузки файла в GigaChat: {resp.status} — {text}")
 
 
 
 
-# === Отправка промпта в GigaChat и получение ответа ===
-async def send_prompt(prompt: str, access_token: str, attachment_ids: list[str] = None) -> dict:
+# === Удаление загруженного файла из хранилища GigaChat ===
+async def delete_file_from_gigachat(file_id: str, access_token: str) -> bool:
+    """
+    Удаляет файл по его id. Возвращает False, если файла на сервере уже нет.
+    """
     headers = {
-        "Authorization": f"Bearer {access_token}",       # Авторизация через токен
-        "Content-Type": "application/json",              # Отправка JSON
+        "Authorization": f"Bearer {access_token}",
         "Accept": "application/json"
     }
 
+    session = get_session()
+    async with session.post(f"{GIGACHAT_FILES_URL}/{file_id}/delete", headers=headers, ssl=False) as resp:
+        if resp.status == 200:
+            return True
+        if resp.status == 404:
+            return False
+        if resp.status == 401:
+            gigachat_tokens.invalidate()
+        text = await resp.text()
+        raise Exception(f"Ошибка удаления файла из GigaChat: {resp.status} — {text}")
+
+
+
+# === Разбор ошибки chat/completions ===
+def _raise_for_chat_error(status: int, text: str, attachment_ids: list[str] | None):
+    if status == 401:
+        # Токен отозван или истёк раньше срока — запросим новый
+        gigachat_tokens.invalidate()
+    # Вложение, загруженное раньше, сервер уже не знает — его нужно загрузить заново
+    if attachment_ids and (status == 404 or (status == 400 and "file" in text.lower())):
+        raise GigaChatFileNotFound(f"Файл {', '.join(attachment_ids)} не найден в GigaChat: {status} — {text}")
+    raise Exception(f"Ошибка при запросе: {status} — {text}")
+
+
+
+# === Тело запроса к chat/completions ===
+def build_chat_payload(prompt: str, attachment_ids: list[str] = None, stream: bool = False) -> dict:
     # Формируем объект сообщения
     message_obj = {
         "role": "user",
@@ -99,33 +127,96 @@ async def send_prompt(prompt: str, access_token: str, attachment_ids: list[str]
     if attachment_ids:
         message_obj["attachments"] = attachment_ids
 
-
-    data = {
+    return {
         "model": MODEL,                                  # Используемая модель
         "messages": [message_obj],
         "temperature": 1,                                # Творчество модели
         "top_p": 0.9,
         "n": 1,
-        "stream": False                                  # Без потоковой передачи
+        "stream": stream                                 # Потоковая передача (SSE) или единый ответ
+    }
+
+
+
+# === Отправка промпта в GigaChat и получение ответа ===
+@timed("gigachat_completion")
+async def send_prompt(prompt: str, access_token: str, attachment_ids: list[str] = None) -> dict:
+    headers = {
+        "Authorization": f"Bearer {access_token}",       # Авторизация через токен
+        "Content-Type": "application/json",              # Отправка JSON
+        "Accept": "application/json"
     }
 
+    data = build_chat_payload(prompt, attachment_ids, stream=False)
 
     # Отправляем POST-запрос
-    async with aiohttp.ClientSession() as session:
+    session = get_session()
+    async with session.post(
+        GIGACHAT_API_URL,
+        headers=headers,
+        json=data,
+        ssl=False                                    # отключение SSL-проверки
+    ) as resp:
+        tracing.set_attributes(http_status=resp.status, prompt_chars=len(prompt), attachments=len(attachment_ids or []))
+        if resp.status == 200:
+            json_data = await resp.json()
+            tracing.set_attributes(**json_data.get("usage", {}))
+
+            # Возвращаем как текст ответа, так и usage с токенами
+            return {
+                "content": json_data["choices"][0]["message"]["content"],
+                "usage": json_data.get("usage", {})  # {'prompt_tokens': X, 'completion_tokens': Y, ...}
+            }
+        else:
+            text = await resp.text()
+            _raise_for_chat_error(resp.status, text, attachment_ids)
+
+
+
+# === Потоковая отправка промпта: ответ приходит частями (SSE) ===
+async def send_prompt_stream(prompt: str, access_token: str, attachment_ids: list[str] = None):
+    """
+    Асинхронный генератор. Отдаёт события по мере генерации ответа:
+    {"content": "фрагмент текста"} — для каждого нового фрагмента,
+    {"usage": {...}} — расход токенов (приходит в последнем событии потока).
+    """
+    headers = {
+        "Authorization": f"Bearer {access_token}",       # Авторизация через токен
+        "Content-Type": "application/json",              # Отправка JSON
+        "Accept": "text/event-stream"
+    }
+
+    data = build_chat_payload(prompt, attachment_ids, stream=True)
+
+    session = get_session()
+    # Замер — от запроса до последнего события потока. Спан не делаем текущим:
+    # генератор отдаёт управление вызывающему, и его спаны не должны попасть внутрь этого
+    with track("gigachat_completion", activate=False, stream=True, prompt_chars=len(prompt)) as span:
         async with session.post(
             GIGACHAT_API_URL,
             headers=headers,
             json=data,
             ssl=False                                    # отключение SSL-проверки
         ) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-
-                # Возвращаем как текст ответа, так и usage с токенами
-                return {
-                    "content": json_data["choices"][0]["message"]["content"],
-                    "usage": json_data.get("usage", {})  # {'prompt_tokens': X, 'completion_tokens': Y, ...}
-                }
-            else:
+            span.set(http_status=resp.status)
+            if resp.status != 200:
                 text = await resp.text()
-                raise Exception(f"Ошибка при запросе: {resp.status} — {text}")
\ No newline at end of file
+                _raise_for_chat_error(resp.status, text, attachment_ids)
+
+            # Каждое событие — строка вида "data: {...}", поток завершается "data: [DONE]"
+            async for raw_line in resp.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+
+                chunk = json.loads(payload)
+                for choice in chunk.get("choices", []):
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        yield {"content": content}
+                if chunk.get("usage"):
+                    span.set(**chunk["usage"])
+                    yield {"usage": chunk["usage"]}
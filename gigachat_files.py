@@ -0,0 +1,132 @@
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from audio_utils import create_transcript_txt, make_transcript_dir
+from gigachat_api import get_access_token, upload_file_to_gigachat, delete_file_from_gigachat
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Сколько живёт загруженный файл расшифровки, прежде чем его загрузят заново
+GIGACHAT_FILE_TTL = int(os.getenv("GIGACHAT_FILE_TTL", "3600"))
+# Сколько файлов держим в GigaChat одновременно; самые давно использованные удаляются
+GIGACHAT_FILE_CACHE_SIZE = int(os.getenv("GIGACHAT_FILE_CACHE_SIZE", "100"))
+
+# Хэш расшифровки -> (file_id, время загрузки); порядок — от давно использованных к недавним
+_files: OrderedDict[str, tuple[str, float]] = OrderedDict()
+# Загрузки, которые идут прямо сейчас: одновременные запросы ждут одну общую
+_uploads: dict[str, asyncio.Task] = {}
+# Фоновые удаления файлов (держим ссылки, чтобы задачи не собрал сборщик мусора)
+_deletions: set[asyncio.Task] = set()
+
+_stats = {"hits": 0, "misses": 0, "uploads": 0, "invalidations": 0, "deletions": 0, "delete_errors": 0}
+
+
+
+def _content_hash(transcript: str) -> str:
+    return hashlib.sha256(transcript.encode("utf-8")).hexdigest()
+
+
+
+# === file_id расшифровки в GigaChat: из кэша или новая загрузка ===
+async def get_transcript_file_id(transcript: str, date_str: str, access_token: str) -> str:
+    """
+    Несколько промптов к одной расшифровке используют один загруженный файл.
+    Ключ — хэш текста, поэтому повторная загрузка не нужна, пока файл не истёк
+    (GIGACHAT_FILE_TTL) и не вытеснен из кэша.
+    """
+    content_hash = _content_hash(transcript)
+    _expire()
+
+    entry = _files.get(content_hash)
+    if entry is not None:
+        _files.move_to_end(content_hash)
+        _stats["hits"] += 1
+        return entry[0]
+
+    _stats["misses"] += 1
+    task = _uploads.get(content_hash)
+    if task is None:
+        task = asyncio.create_task(_upload(content_hash, transcript, date_str, access_token))
+        _uploads[content_hash] = task
+        task.add_done_callback(lambda _: _uploads.pop(content_hash, None))
+    # shield: отмена одного ожидающего не должна прерывать общую загрузку
+    return await asyncio.shield(task)
+
+
+async def _upload(content_hash: str, transcript: str, date_str: str, access_token: str) -> str:
+    out_dir = make_transcript_dir()
+    try:
+        txt_path = create_transcript_txt(transcript, date_str, out_dir)
+        file_id = await upload_file_to_gigachat(txt_path, access_token)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    _stats["uploads"] += 1
+
+    _files[content_hash] = (file_id, time.monotonic())
+    while len(_files) > GIGACHAT_FILE_CACHE_SIZE:
+        _, (old_id, _) = _files.popitem(last=False)
+        _schedule_delete(old_id)
+    return file_id
+
+
+
+# === Сервер отверг file_id — забываем его, следующий запрос загрузит файл заново ===
+def invalidate_file(file_id: str):
+    for content_hash, (cached_id, _) in list(_files.items()):
+        if cached_id == file_id:
+            del _files[content_hash]
+            _stats["invalidations"] += 1
+            logging.info(f"[📎] Файл {file_id} больше не доступен в GigaChat, будет загружен заново")
+
+
+
+# Удаляем истёкшие записи вместе с файлами на сервере
+def _expire():
+    threshold = time.monotonic() - GIGACHAT_FILE_TTL
+    for content_hash, (file_id, uploaded_at) in list(_files.items()):
+        if uploaded_at < threshold:
+            del _files[content_hash]
+            _schedule_delete(file_id)
+
+
+
+# === Удаление файла из хранилища GigaChat ===
+def _schedule_delete(file_id: str):
+    task = asyncio.create_task(_delete(file_id))
+    _deletions.add(task)
+    task.add_done_callback(_deletions.discard)
+
+
+async def _delete(file_id: str):
+    try:
+        token = await get_access_token()
+        await delete_file_from_gigachat(file_id, token)
+        _stats["deletions"] += 1
+    except Exception as e:
+        _stats["delete_errors"] += 1
+        logging.warning(f"[📎] Не удалось удалить файл {file_id} из GigaChat: {e}")
+
+
+
+# === Завершение работы: удаляем все загруженные файлы ===
+async def close_file_cache():
+    for file_id, _ in _files.values():
+        _schedule_delete(file_id)
+    _files.clear()
+    if _deletions:
+        await asyncio.gather(*_deletions, return_exceptions=True)
+
+
+
+# === Счётчики кэша файлов ===
+def get_file_cache_stats() -> dict[str, int]:
+    stats = dict(_stats)
+    stats["cached"] = len(_files)
+    return stats
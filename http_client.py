@@ -0,0 +1,97 @@
+import os
+import logging
+import aiohttp
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Параметры пула соединений
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))                    # всего соединений
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))   # соединений на один хост
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))     # сколько держать простаивающее соединение, сек.
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))              # кэш DNS, сек.
+
+# Таймауты запросов, сек.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+
+# Единственная сессия процесса
+_session: aiohttp.ClientSession | None = None
+
+
+
+# === Создание общей HTTP-сессии ===
+def init_http_client() -> aiohttp.ClientSession:
+    """
+    Создаёт общую для процесса HTTP-сессию с пулом keep-alive соединений.
+    Соединения переиспользуются между запросами к одному хосту,
+    поэтому TCP- и TLS-рукопожатие выполняется только при открытии нового соединения.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+
+# === Получение общей HTTP-сессии ===
+def get_session() -> aiohttp.ClientSession:
+    # Создаём сессию при первом обращении, если бот не сделал этого при запуске
+    if _session is None or _session.closed:
+        return init_http_client()
+    return _session
+
+
+
+# === Закрытие общей HTTP-сессии ===
+async def close_http_client():
+    global _session
+    if _session is not None and not _session.closed:
+        stats = get_pool_stats()
+        if stats:
+            logging.info(f"[🌐] Пулы соединений при остановке: {stats}")
+        await _session.close()
+    _session = None
+
+
+
+# === Статистика пулов соединений по хостам ===
+def get_pool_stats() -> dict[str, dict[str, int]]:
+    """
+    Возвращает по каждому хосту число открытых, простаивающих соединений
+    и запросов, ожидающих свободного соединения:
+    {"host:port": {"open": N, "idle": N, "in_use": N, "waiting": N}}
+    """
+    if _session is None or _session.closed:
+        return {}
+
+    connector = _session.connector
+    # Внутренние структуры aiohttp — читаем осторожно, их может не быть в другой версии
+    idle_conns = getattr(connector, "_conns", {})
+    acquired = getattr(connector, "_acquired_per_host", {})
+    waiters = getattr(connector, "_waiters", {})
+
+    stats: dict[str, dict[str, int]] = {}
+    for key in set(idle_conns) | set(acquired) | set(waiters):
+        host = f"{key.host}:{key.port}"
+        entry = stats.setdefault(host, {"open": 0, "idle": 0, "in_use": 0, "waiting": 0})
+        idle = len(idle_conns.get(key, ()))
+        in_use = len(acquired.get(key, ()))
+        entry["idle"] += idle
+        entry["in_use"] += in_use
+        entry["open"] += idle + in_use
+        entry["waiting"] += len(waiters.get(key, ()))
+
+    return stats
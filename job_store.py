@@ -0,0 +1,214 @@
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+from pathlib import Path
+from dotenv import load_dotenv
+
+from data_dir import BOT_DATA_DIR, private_dir, private_file
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Каталог для аудио незавершённых задач и файл базы с контрольными точками
+JOBS_DIR = Path(os.getenv("JOBS_DIR", BOT_DATA_DIR / "transcription_jobs"))
+JOBS_DB = Path(os.getenv("JOBS_DB", JOBS_DIR / "jobs.sqlite3"))
+# Незавершённые задачи старше этого срока удаляются вместе с аудио
+JOB_MAX_AGE_DAYS = float(os.getenv("JOB_MAX_AGE_DAYS", "3"))
+
+# Статусы задачи
+STATUS_RUNNING = "running"    # идёт распознавание
+STATUS_PARTIAL = "partial"    # часть фрагментов не распознана, можно продолжить
+
+# Базу могут делить несколько процессов бота. Каждый отмечается в ней раз в
+# HEARTBEAT_INTERVAL сек.; задача процесса, не отмечавшегося дольше HEARTBEAT_TIMEOUT,
+# считается прерванной
+INSTANCE_ID = uuid.uuid4().hex[:12]
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 120
+# Условие «владелец задачи не работает» (параметр — граница свежести отметки)
+_NOT_ALIVE_OWNER = "(owner IS NULL OR owner NOT IN (SELECT instance_id FROM instances WHERE heartbeat_at >= ?))"
+
+_conn: sqlite3.Connection | None = None
+
+
+
+# === Подключение к базе задач ===
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        private_dir(JOBS_DB.parent)
+        # Файлы -wal и -shm SQLite создаёт с теми же правами, что и базу
+        _conn = sqlite3.connect(private_file(JOBS_DB), check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id         TEXT PRIMARY KEY,
+                user_id        INTEGER NOT NULL,
+                chat_id        INTEGER NOT NULL,
+                username       TEXT,
+                audio_hash     TEXT NOT NULL,
+                file_unique_id TEXT,
+                audio_path     TEXT NOT NULL,
+                total_parts    INTEGER,
+                status         TEXT NOT NULL,
+                created_at     REAL NOT NULL,
+                updated_at     REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_user_hash ON jobs (user_id, audio_hash);
+            CREATE TABLE IF NOT EXISTS chunks (
+                job_id TEXT NOT NULL,
+                idx    INTEGER NOT NULL,
+                text   TEXT NOT NULL,
+                PRIMARY KEY (job_id, idx)
+            );
+            CREATE TABLE IF NOT EXISTS instances (
+                instance_id  TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            );
+        """)
+        # Базы, созданные до появления владельца задачи: такие задачи считаются ничьими
+        columns = {row[1] for row in _conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            with _conn:
+                _conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+    return _conn
+
+
+
+# === Создание задачи ===
+def create_job(user_id: int, chat_id: int, username: str | None, audio_hash: str,
+               file_unique_id: str | None, source_path: str | Path) -> dict:
+    """
+    Создаёт задачу и переносит аудио в JOBS_DIR, чтобы его можно было
+    распознать повторно после ошибки или перезапуска бота.
+    """
+    job_id = uuid.uuid4().hex
+    private_dir(JOBS_DIR)
+    audio_path = JOBS_DIR / f"{job_id}{Path(source_path).suffix}"
+    shutil.move(str(source_path), audio_path)
+    os.chmod(audio_path, 0o600)
+
+    now = time.time()
+    with _db() as conn:
+        conn.execute(
+            "INSERT INTO jobs (job_id, user_id, chat_id, username, audio_hash, file_unique_id, "
+            "audio_path, status, owner, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, chat_id, username, audio_hash, file_unique_id,
+             str(audio_path), STATUS_RUNNING, INSTANCE_ID, now, now)
+        )
+    return get_job(job_id)
+
+
+
+# === Поиск задачи ===
+def get_job(job_id: str) -> dict | None:
+    row = _db().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+# Незавершённая задача пользователя с тем же аудио
+def find_unfinished_job(user_id: int, audio_hash: str) -> dict | None:
+    row = _db().execute(
+        "SELECT * FROM jobs WHERE user_id = ? AND audio_hash = ? ORDER BY created_at DESC LIMIT 1",
+        (user_id, audio_hash)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+# Задачи, которые распознавал остановившийся процесс (перезапуск или сбой бота)
+def list_orphaned_jobs() -> list[dict]:
+    rows = _db().execute(
+        f"SELECT * FROM jobs WHERE status = ? AND {_NOT_ALIVE_OWNER} ORDER BY created_at",
+        (STATUS_RUNNING, time.time() - HEARTBEAT_TIMEOUT)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+# Переводит прерванную задачу в «можно продолжить». True получает только один процесс —
+# он и напоминает пользователю
+def claim_orphaned_job(job_id: str) -> bool:
+    with _db() as conn:
+        cursor = conn.execute(
+            f"UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE job_id = ? AND status = ? AND {_NOT_ALIVE_OWNER}",
+            (STATUS_PARTIAL, time.time(), job_id, STATUS_RUNNING, time.time() - HEARTBEAT_TIMEOUT)
+        )
+    return cursor.rowcount == 1
+
+
+
+# === Процессы бота, работающие с базой ===
+def heartbeat():
+    with _db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO instances (instance_id, heartbeat_at) VALUES (?, ?)",
+            (INSTANCE_ID, time.time())
+        )
+        conn.execute("DELETE FROM instances WHERE heartbeat_at < ?", (time.time() - 86400,))
+
+
+# При штатной остановке: прерванные задачи этого процесса сразу становятся ничьими
+def unregister_instance():
+    with _db() as conn:
+        conn.execute("DELETE FROM instances WHERE instance_id = ?", (INSTANCE_ID,))
+
+
+
+# === Контрольные точки ===
+def set_total_parts(job_id: str, total_parts: int):
+    with _db() as conn:
+        conn.execute(
+            "UPDATE jobs SET total_parts = ?, updated_at = ? WHERE job_id = ?",
+            (total_parts, time.time(), job_id)
+        )
+
+
+def save_chunk(job_id: str, idx: int, text: str):
+    with _db() as conn:
+        conn.execute("INSERT OR REPLACE INTO chunks (job_id, idx, text) VALUES (?, ?, ?)", (job_id, idx, text))
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+
+def get_chunks(job_id: str) -> dict[int, str]:
+    rows = _db().execute("SELECT idx, text FROM chunks WHERE job_id = ?", (job_id,)).fetchall()
+    return {row["idx"]: row["text"] for row in rows}
+
+
+def set_status(job_id: str, status: str):
+    # Распознающий процесс становится владельцем задачи
+    owner = INSTANCE_ID if status == STATUS_RUNNING else None
+    with _db() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, owner = ?, updated_at = ? WHERE job_id = ?",
+            (status, owner, time.time(), job_id)
+        )
+
+
+
+# === Завершение задачи: удаляем контрольные точки и аудио ===
+def finish_job(job_id: str):
+    job = get_job(job_id)
+    with _db() as conn:
+        conn.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+    if job:
+        try:
+            os.remove(job["audio_path"])
+        except Exception:
+            pass
+
+
+
+# === Удаление давно брошенных задач ===
+def cleanup_stale_jobs() -> int:
+    threshold = time.time() - JOB_MAX_AGE_DAYS * 86400
+    # Задачи работающих процессов не трогаем, даже если они давно не обновлялись
+    rows = _db().execute(
+        f"SELECT job_id FROM jobs WHERE updated_at < ? AND {_NOT_ALIVE_OWNER}",
+        (threshold, time.time() - HEARTBEAT_TIMEOUT)
+    ).fetchall()
+    for row in rows:
+        finish_job(row["job_id"])
+    return len(rows)
@@ -0,0 +1,266 @@
+import os
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+from functools import wraps
+from aiohttp import web
+from dotenv import load_dotenv
+
+import tracing
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Адрес HTTP-эндпоинта /metrics в формате Prometheus (порт 0 — не запускать)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Границы корзин гистограмм длительности, сек.: от быстрых запросов до многочасовых записей
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Все созданные метрики в порядке регистрации
+_registry: list["Metric"] = []
+_runner: web.AppRunner | None = None
+
+
+
+# Значение метки в формате Prometheus: экранируем \, " и перевод строки
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+
+# === Базовый класс метрики ===
+class Metric:
+    """
+    Метрика с необязательными метками. Значения хранятся отдельно
+    для каждого набора значений меток: labelnames=("stage",) →
+    inc(stage="download"), inc(stage="split") — два ряда.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """Строки (суффикс имени, значения меток, доп. метка, значение) для экспорта."""
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return lines
+
+
+
+# === Счётчик: только растёт ===
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        # Имя счётчика в Prometheus принято заканчивать на _total
+        super().__init__(f"{name}_total", documentation, labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Счётчик не может уменьшаться")
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for values, value in sorted(self._values.items()):
+            yield "", values, "", value
+
+
+
+# === Текущее значение: может расти и уменьшаться ===
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    # Значение считывается в момент экспорта (глубина очереди, текущий лимит и т. п.).
+    # У метрики с метками функция возвращает {(значения меток): значение}
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception as e:
+                logging.debug(f"[📊] Не удалось получить значение {self.name}: {e}")
+                return
+            if self.labelnames:
+                for values, labelled in sorted(value.items()):
+                    yield "", values, "", labelled
+            else:
+                yield "", (), "", value
+            return
+        for values, value in sorted(self._values.items()):
+            yield "", values, "", value
+
+
+
+# === Гистограмма: распределение значений по корзинам ===
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # Счётчики по корзинам (последняя — +Inf), сумма и количество
+            series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    # Замер длительности блока по монотонным часам
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for values, series in sorted(self._values.items()):
+            # В формате Prometheus корзины накопительные: le="5" включает всё, что ≤ 5
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                yield "_bucket", values, f'le="{_format_value(bound)}"', cumulative
+            yield "_sum", values, "", series["sum"]
+            yield "_count", values, "", series["count"]
+
+
+
+# === Общие метрики этапов конвейера ===
+stage_duration = Histogram("bot_stage_duration_seconds", "Длительность этапа обработки", ("stage",))
+stage_errors = Counter("bot_stage_errors", "Этапы, завершившиеся ошибкой", ("stage",))
+stage_in_progress = Gauge("bot_stage_in_progress", "Этапы, выполняющиеся прямо сейчас", ("stage",))
+bytes_processed = Counter("bot_bytes_processed", "Объём обработанных данных, байт", ("stage",))
+audio_seconds = Counter("bot_audio_seconds_transcribed", "Длительность распознанного аудио, сек.")
+gigachat_tokens = Counter("bot_gigachat_tokens", "Токены GigaChat", ("kind",))
+
+
+
+# === Замер этапа: длительность, ошибки, число выполняющихся ===
+@contextmanager
+def track(stage: str, activate: bool = True, **attrs):
+    """
+    Замеряет этап и заодно открывает одноимённый спан трассировки
+    (см. tracing.span; вне трассировки спан не пишется). Отдаёт спан,
+    чтобы этап мог дописать атрибуты.
+    """
+    started = time.perf_counter()
+    stage_in_progress.inc(stage=stage)
+    try:
+        with tracing.span(stage, activate=activate, **attrs) as span:
+            yield span
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_in_progress.dec(stage=stage)
+        stage_duration.observe(time.perf_counter() - started, stage=stage)
+
+
+# То же для асинхронной функции целиком
+def timed(stage: str):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+
+# === Экспорт в текстовом формате Prometheus ===
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_metrics().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+
+# === HTTP-эндпоинт /metrics ===
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    global _runner
+    if port == 0 or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        # Порт занят (например, второй копией бота на той же машине) — работаем без метрик
+        await runner.cleanup()
+        logging.warning(f"[📊] Не удалось открыть {host}:{port} для метрик ({e}), эндпоинт /metrics отключён. "
+                        f"Задайте каждой копии свой METRICS_PORT")
+        return
+    _runner = runner
+    logging.info(f"[📊] Метрики: http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        runner, _runner = _runner, None
+        await runner.cleanup()
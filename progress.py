@@ -0,0 +1,117 @@
+import os
+import time
+import asyncio
+import logging
+from aiogram.types import Message
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Не чаще одной правки статусного сообщения за столько секунд
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "2"))
+
+
+
+# === Статусное сообщение с прореживанием правок ===
+class ProgressReporter:
+    """
+    Показывает ход долгой операции в одном сообщении Telegram.
+
+    update() можно вызывать сколько угодно часто и из параллельных задач:
+    сообщение правится не чаще interval секунд и всегда последним текстом,
+    промежуточные состояния между правками просто пропускаются.
+    Правка с тем же текстом не отправляется. finish() дожидается
+    окончания интервала и обязательно показывает итоговое состояние.
+    Первое обновление отправляет новое сообщение, если его не передали.
+    """
+
+    def __init__(self, message: Message, interval: float = PROGRESS_EDIT_INTERVAL,
+                 status_msg: Message | None = None):
+        self.message = message                   # куда отправлять новое сообщение
+        self.status_msg = status_msg             # сообщение, которое правим
+        self.interval = interval
+
+        self._pending: str | None = None         # последний присланный текст
+        self._shown: str | None = None           # текст, который сейчас в сообщении
+        self._next_at = 0.0                      # раньше этого момента не правим
+        self._finished = False
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self.stats = {"updates": 0, "edits": 0, "retry_after": 0}
+
+    # === Новое состояние (без ожидания) ===
+    def update(self, text: str):
+        if self._finished:
+            return
+        self.stats["updates"] += 1
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    # Фоновая отправка: ждём окончания интервала и показываем последний текст
+    async def _run(self):
+        while not self._finished and self._pending != self._shown:
+            delay = self._next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._finished:
+                return
+            try:
+                await self._flush()
+            except Exception as e:
+                logging.warning(f"[⏳] Не удалось обновить статус: {e}")
+                return
+
+    # === Итоговое состояние: отправляется всегда ===
+    async def finish(self, text: str | None = None, parse_mode: str | None = None):
+        """
+        Показывает text (или последний присланный текст) и больше не принимает обновлений.
+        Ошибки не пробрасываются: статус — только подсказка, и сбой его правки не должен
+        мешать отправке результата. Если статусное сообщение нельзя править (например,
+        пользователь его удалил), итог отправляется новым сообщением.
+        """
+        self._finished = True
+        if text is not None:
+            self._pending = text
+        while True:
+            delay = self._next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                if await self._flush(parse_mode):
+                    return
+            except TelegramBadRequest as e:
+                if self.status_msg is None:
+                    logging.warning(f"[⏳] Не удалось показать итоговый статус: {e}")
+                    return
+                logging.warning(f"[⏳] Не удалось изменить статус ({e}), отправляю новым сообщением")
+                self.status_msg = None
+            except Exception as e:
+                logging.warning(f"[⏳] Не удалось показать итоговый статус: {e}")
+                return
+
+    # Отправка или правка сообщения. False — Telegram попросил подождать, нужно повторить
+    async def _flush(self, parse_mode: str | None = None) -> bool:
+        async with self._lock:
+            text = self._pending
+            if not text or text == self._shown:
+                return True
+            try:
+                if self.status_msg is None:
+                    self.status_msg = await self.message.answer(text, parse_mode=parse_mode)
+                else:
+                    await self.status_msg.edit_text(text, parse_mode=parse_mode)
+            except TelegramRetryAfter as e:
+                # Сработал flood control — откладываем следующую правку на указанное время
+                self.stats["retry_after"] += 1
+                self._next_at = time.monotonic() + e.retry_after
+                return False
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+            self.stats["edits"] += 1
+            self._shown = text
+            self._next_at = time.monotonic() + self.interval
+            return True
@@ -1,11 +1,19 @@
 import os
-import uuid
+import time
 import base64
+import random
+import asyncio
+import logging
 import aiohttp
-from aiohttp import BasicAuth
 from pathlib import Path
 from dotenv import load_dotenv
 
+from http_client import get_session
+from token_manager import TokenManager, SBER_OAUTH_URL
+from adaptive_limiter import AdaptiveLimiter
+import tracing
+from metrics import track, bytes_processed, Counter
+
 # Загружаем переменные окружения из .env
 load_dotenv()
 
@@ -14,37 +22,46 @@ SALUTE_CLIENT_ID = os.getenv("SALUTE_CLIENT_ID")
 SALUTE_SECRET = os.getenv("SALUTE_SECRET")
 
 # URL для токена и распознавания
-SALUTE_TOKEN_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-SALUTE_RECOGNIZE_URL = "https://smartspeech.sber.ru/rest/v1/speech:recognize"
+SALUTE_TOKEN_URL = SBER_OAUTH_URL
+SALUTE_API_BASE = os.getenv("SALUTE_API_BASE", "https://smartspeech.sber.ru/rest/v1").rstrip("/")
+SALUTE_RECOGNIZE_URL = f"{SALUTE_API_BASE}/speech:recognize"
+
+# === Адаптивный лимит одновременных запросов распознавания ===
+SALUTE_MIN_CONCURRENCY = int(os.getenv("SALUTE_MIN_CONCURRENCY", "1"))
+SALUTE_MAX_CONCURRENCY = int(os.getenv("SALUTE_MAX_CONCURRENCY", "16"))
+SALUTE_INITIAL_CONCURRENCY = int(os.getenv("SALUTE_INITIAL_CONCURRENCY", "4"))
+# Во сколько раз задержка может превысить обычную, прежде чем лимит начнёт снижаться
+SALUTE_LATENCY_TOLERANCE = float(os.getenv("SALUTE_LATENCY_TOLERANCE", "2"))
+# Повторы фрагмента после перегрузки, 5xx и сетевых ошибок
+SALUTE_MAX_RETRIES = int(os.getenv("SALUTE_MAX_RETRIES", "4"))
+SALUTE_RETRY_BASE_DELAY = 1.0         # базовая пауза перед повтором, сек. (растёт вдвое)
+SALUTE_RETRY_MAX_DELAY = 30.0
+
+# Ответы, означающие «слишком много запросов»
+THROTTLE_STATUSES = (429, 503)
+
+salute_limiter = AdaptiveLimiter(
+    SALUTE_INITIAL_CONCURRENCY, SALUTE_MIN_CONCURRENCY, SALUTE_MAX_CONCURRENCY, SALUTE_LATENCY_TOLERANCE
+)
+# Ответы на запросы распознавания: ok, throttled (429, 503, 5xx), network, error
+salute_requests = Counter("bot_salute_requests", "Запросы распознавания к SaluteSpeech", ("outcome",))
+
+
+
+# === Ошибка HTTP от SaluteSpeech ===
+class SaluteHTTPError(Exception):
+    def __init__(self, status: int, text: str):
+        super().__init__(f"Ошибка распознавания: {status} — {text}")
+        self.status = status
 
 
 
 # === Получение токена доступа к Salute Speech API ===
-async def get_salute_token():
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",  # Формат тела запроса
-        "Accept": "application/json",                         # Формат ответа
-        "RqUID": str(uuid.uuid4())                            # Уникальный ID запроса
-    }
-    data = {
-        "scope": "SALUTE_SPEECH_PERS"  # Область применения токена
-    }
+# Токен кэшируется менеджером до истечения срока и обновляется в фоне
+salute_tokens = TokenManager("SALUTE_SPEECH_PERS", SALUTE_CLIENT_ID, SALUTE_SECRET, SALUTE_TOKEN_URL)
 
-    # Отправка POST-запроса на получение токена
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            SALUTE_TOKEN_URL,
-            headers=headers,
-            data=data,
-            auth=BasicAuth(SALUTE_CLIENT_ID, SALUTE_SECRET),
-            ssl=False                          # отключаем проверку сертификата
-        ) as resp:
-            if resp.status == 200:
-                json_data = await resp.json()
-                return json_data.get("access_token")
-            else:
-                text = await resp.text()
-                raise Exception(f"Ошибка получения токена: {resp.status} — {text}")
+async def get_salute_token():
+    return await salute_tokens.get_token()
 
 
 
@@ -63,31 +80,87 @@ async def transcribe_audio(file_path: Path) -> str:
     else:
         raise ValueError(f"Неподдерживаемый тип файла для Salute: {suffix}")
 
-    print(f"Распознаю файл: {file_path.name}, тип: {content_type}")
-
-
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": content_type
     }
 
-    # Создаём асинхронную сессию для HTTP-запросов
-    async with aiohttp.ClientSession() as session:
-        # Открываем аудиофайл в бинарном режиме
-        with open(file_path, "rb") as audio_file:
-            async with session.post(
-                SALUTE_RECOGNIZE_URL,  # URL сервиса распознавания
-                headers=headers,       # Заголовки
-                data=audio_file,       # Сырые байты аудиофайла
-                ssl=False              # Отключаем проверку SSL
-            ) as resp:
-                if resp.status == 200:
-                    result = await resp.json() 
-                    raw_result = result.get("result", "")
-                    if isinstance(raw_result, list):
-                        return " ".join(raw_result)  # Склеиваем список в строку
-                    return raw_result or ""
-                else:
-                    text = await resp.text()
-                    raise Exception(f"Ошибка распознавания: {resp.status} — {text}")
+    size = file_path.stat().st_size
+    bytes_processed.inc(size, stage="salute_chunk")
+    tracing.set_attributes(bytes=size, content_type=content_type)
 
+    # Берём общую сессию с пулом keep-alive соединений
+    session = get_session()
+    # Открываем аудиофайл в бинарном режиме
+    with open(file_path, "rb") as audio_file:
+        async with session.post(
+            SALUTE_RECOGNIZE_URL,  # URL сервиса распознавания
+            headers=headers,       # Заголовки
+            data=audio_file,       # Сырые байты аудиофайла
+            ssl=False              # Отключаем проверку SSL
+        ) as resp:
+            tracing.set_attributes(http_status=resp.status)
+            if resp.status == 200:
+                result = await resp.json() 
+                raw_result = result.get("result", "")
+                if isinstance(raw_result, list):
+                    return " ".join(raw_result)  # Склеиваем список в строку
+                return raw_result or ""
+            else:
+                if resp.status == 401:
+                    # Токен отозван или истёк раньше срока — запросим новый
+                    salute_tokens.invalidate()
+                text = await resp.text()
+                raise SaluteHTTPError(resp.status, text)
+
+
+
+# === Распознавание фрагмента с адаптивным лимитом и повторами ===
+async def transcribe_chunk(file_path: Path, part: int | None = None) -> tuple[str, float]:
+    """
+    Выполняет transcribe_audio в пределах адаптивного лимита одновременных запросов.
+    Возвращает текст и длительность успешного запроса, сек. — без ожидания
+    места в лимите и пауз между повторами.
+    При перегрузке (429, 503), 5xx, сетевых ошибках и истёкшем токене повторяет
+    запрос с экспоненциальной паузой со случайной составляющей.
+    Прочие ошибки (например, 400 — неподходящее аудио) пробрасываются сразу.
+    part — номер части записи (для трассировки).
+    """
+    with track("salute_chunk", part=part, file=file_path.name) as chunk_span:
+        for attempt in range(SALUTE_MAX_RETRIES + 1):
+            chunk_span.set(retries=attempt)
+            await salute_limiter.acquire()
+            started = time.monotonic()
+            try:
+                # Каждая попытка — отдельный спан: видно, какая из них была медленной
+                with tracing.span("salute_request", attempt=attempt + 1):
+                    text = await transcribe_audio(file_path)
+                latency = time.monotonic() - started
+                salute_limiter.on_success(latency)
+                salute_requests.inc(outcome="ok")
+                return text, latency
+            except SaluteHTTPError as e:
+                if e.status in THROTTLE_STATUSES or e.status >= 500:
+                    salute_limiter.on_throttle()
+                    salute_requests.inc(outcome="throttled")
+                else:
+                    salute_requests.inc(outcome="error")
+                    if e.status != 401:
+                        raise
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                salute_limiter.on_error()
+                salute_requests.inc(outcome="network")
+                error = e
+            finally:
+                salute_limiter.release()
+
+            if attempt == SALUTE_MAX_RETRIES:
+                raise error
+            # Полный джиттер: одновременно упавшие фрагменты не повторяются разом
+            delay = random.uniform(0, min(SALUTE_RETRY_MAX_DELAY, SALUTE_RETRY_BASE_DELAY * 2 ** attempt))
+            logging.warning(
+                f"[🎙] {file_path.name}: {error}. Повтор {attempt + 1} из {SALUTE_MAX_RETRIES} через {delay:.1f} сек. "
+                f"(лимит запросов {salute_limiter.limit:.1f})"
+            )
+            await asyncio.sleep(delay)
@@ -0,0 +1,263 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from dotenv import load_dotenv
+
+from metrics import stage_duration
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Сколько тяжёлых задач (скачивание, конвертация, распознавание, PDF) выполняется одновременно
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Сколько задач одного пользователя может быть в очереди и в работе одновременно
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "1"))
+# Сколько задач может ждать в общей очереди
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "20"))
+# Сколько секунд при остановке бота ждать принятые задачи, прежде чем прервать их
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "300"))
+
+# Состояния задачи
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_CANCELLED = "cancelled"
+
+
+
+# === Отказ в приёме задачи ===
+class AdmissionError(Exception):
+    pass
+
+
+
+# === Задача в очереди ===
+class ScheduledJob:
+    def __init__(self, user_id: int, run, on_drop=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.run = run                        # фабрика корутины, выполняющей работу
+        self.on_drop = on_drop                # фабрика корутины: сообщить, что задача так и не начнётся
+        self.state = STATE_QUEUED
+        self.enqueued_at = time.monotonic()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.position = 0                     # место в очереди при постановке (0 — сразу в работу)
+
+    @property
+    def wait_sec(self) -> float:
+        return (self.started_at or time.monotonic()) - self.enqueued_at
+
+    @property
+    def service_sec(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+
+# === Планировщик тяжёлых задач ===
+class JobScheduler:
+    """
+    Отделяет приём загрузки от её обработки: обработчик ставит задачу в очередь
+    и сразу отвечает пользователю, а фиксированный пул воркеров выполняет задачи
+    по порядку. Ограничивает число активных задач на пользователя и длину очереди,
+    отдельно считает время ожидания в очереди и время обработки.
+    Очередь и воркеры у каждого процесса свои; общий лимит на пользователя
+    и статусы задач хранятся в state.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_per_user: int = JOB_MAX_PER_USER,
+                 queue_limit: int = JOB_QUEUE_LIMIT, state=None):
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.queue_limit = queue_limit
+        # Общее состояние задач (session_store.SessionStore): лимит на пользователя и отмена
+        # действуют для всех копий бота. Без него учитываются только задачи этого процесса
+        self.state = state
+
+        self._queue: deque[ScheduledJob] = deque()
+        self._jobs: dict[str, ScheduledJob] = {}          # активные задачи по id
+        self._wakeup = asyncio.Event()
+        self._worker_tasks: list[asyncio.Task] = []
+        self._running = 0
+        self._idle = asyncio.Event()                      # нет ни ожидающих, ни выполняющихся задач
+        self._idle.set()
+        self._draining = False
+        self._stats = {
+            "submitted": 0, "rejected": 0, "cancelled": 0, "dropped": 0, "completed": 0, "failed": 0,
+            "wait_sec": 0.0, "max_wait_sec": 0.0, "service_sec": 0.0, "max_service_sec": 0.0,
+        }
+
+    # === Постановка в очередь ===
+    def submit(self, user_id: int, run, on_drop=None) -> ScheduledJob:
+        """
+        Ставит задачу в очередь. run — функция без аргументов, возвращающая корутину;
+        on_drop — такая же функция, вызывается, если бот остановится раньше, чем задача начнётся.
+        Бросает AdmissionError, если у пользователя уже много задач, очередь полна
+        или бот останавливается.
+        """
+        if self._draining:
+            self._stats["rejected"] += 1
+            raise AdmissionError("Бот перезапускается. Отправьте запись ещё раз через минуту.")
+        # Задачи, которым не хватает свободного воркера
+        waiting = max(0, self._running + len(self._queue) - self.workers)
+        if waiting >= self.queue_limit:
+            self._stats["rejected"] += 1
+            raise AdmissionError("Очередь на обработку переполнена, попробуйте через несколько минут.")
+
+        job = ScheduledJob(user_id, run, on_drop)
+        if self.state is not None:
+            # Проверка лимита и регистрация задачи — одна атомарная операция хранилища
+            admitted = self.state.add_job(job.id, user_id, self.max_per_user)
+        else:
+            admitted = sum(1 for active in self._jobs.values() if active.user_id == user_id) < self.max_per_user
+        if not admitted:
+            self._stats["rejected"] += 1
+            raise AdmissionError("У вас уже есть запись в обработке. Дождитесь результата или отмените её.")
+
+        # Если все воркеры заняты — сообщаем место в очереди
+        if self._running + len(self._queue) >= self.workers:
+            job.position = waiting + 1
+        self._queue.append(job)
+        self._jobs[job.id] = job
+        self._stats["submitted"] += 1
+        self._idle.clear()
+        self._wakeup.set()
+        return job
+
+    # === Отмена задачи, ещё ожидающей в очереди ===
+    def cancel(self, job_id: str, user_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None:
+            # Задача может ждать в очереди другой копии бота: отмечаем отмену
+            # в общем состоянии, та копия пропустит задачу при запуске
+            if self.state is not None and self.state.cancel_job(job_id, user_id):
+                self._stats["cancelled"] += 1
+                return True
+            return False
+        if job.user_id != user_id or job.state != STATE_QUEUED:
+            return False
+        self._queue.remove(job)
+        self._forget(job)
+        job.state = STATE_CANCELLED
+        self._stats["cancelled"] += 1
+        return True
+
+    # Задача больше не активна: освобождаем место в лимите пользователя
+    def _forget(self, job: ScheduledJob):
+        self._jobs.pop(job.id, None)
+        if self.state is not None:
+            try:
+                self.state.finish_job(job.id, job.user_id)
+            except Exception as e:
+                # Запись в хранилище истечёт сама (JOB_STATE_TTL_HOURS); воркер не должен падать
+                logging.warning(f"[📋] Не удалось снять задачу {job.id} в общем состоянии: {e}")
+        if not self._jobs:
+            self._idle.set()
+
+    # === Запуск и остановка воркеров ===
+    def start(self):
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # === Плавная остановка: новые задачи не принимаются, принятые дорабатывают ===
+    async def drain(self, timeout: float = JOB_DRAIN_TIMEOUT) -> bool:
+        """
+        Ждёт, пока выполнятся все задачи в очереди и в работе, но не дольше timeout.
+        Возвращает False, если задачи не успели завершиться: после stop() прерванные
+        расшифровки продолжатся при следующем запуске (job_store).
+        """
+        self._draining = True
+        if self._jobs:
+            logging.info(f"[📋] Остановка: ждём {len(self._jobs)} задач (не дольше {timeout:.0f} сек.)")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f"[📋] Не дождались {len(self._jobs)} задач за {timeout:.0f} сек.")
+            return False
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        # Не начатые задачи пропадают вместе с процессом: записи в job_store у них ещё нет,
+        # и продолжить их после перезапуска нельзя — предупреждаем пользователей
+        dropped = [job for job in self._queue if job.state == STATE_QUEUED]
+        self._queue.clear()
+        # Прерванные и не начатые задачи не должны занимать лимит пользователя у других копий
+        for job in list(self._jobs.values()):
+            self._forget(job)
+        for job in dropped:
+            job.state = STATE_CANCELLED
+        self._stats["dropped"] += len(dropped)
+        notified = [job for job in dropped if job.on_drop is not None]
+        if notified:
+            logging.warning(f"[📋] Остановка: {len(dropped)} задач так и не начались, сообщаем пользователям")
+            results = await asyncio.gather(*(job.on_drop() for job in notified), return_exceptions=True)
+            for job, result in zip(notified, results):
+                if isinstance(result, Exception):
+                    logging.warning(f"[📋] Не удалось предупредить пользователя {job.user_id}: {result}")
+
+    # Отмечает задачу как выполняемую в общем состоянии; False — её успели отменить
+    def _claim(self, job: ScheduledJob) -> bool:
+        if self.state is None:
+            return True
+        try:
+            return self.state.start_job(job.id, job.user_id)
+        except Exception as e:
+            logging.warning(f"[📋] Не удалось отметить задачу {job.id} в общем состоянии: {e}")
+            return True
+
+    async def _worker(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            job = self._queue.popleft()
+            if not self._claim(job):
+                # Отменена через другую копию бота
+                job.state = STATE_CANCELLED
+                self._forget(job)
+                logging.info(f"[📋] Задача {job.id} отменена, пропускаем")
+                continue
+            job.state = STATE_RUNNING
+            job.started_at = time.monotonic()
+            self._running += 1
+            try:
+                await job.run()
+                self._stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logging.exception(f"[📋] Задача {job.id} завершилась с ошибкой: {e}")
+            finally:
+                self._running -= 1
+                job.finished_at = time.monotonic()
+                job.state = STATE_DONE
+                self._forget(job)
+                self._record_times(job)
+
+    def _record_times(self, job: ScheduledJob):
+        wait, service = job.wait_sec, job.service_sec
+        self._stats["wait_sec"] += wait
+        self._stats["max_wait_sec"] = max(self._stats["max_wait_sec"], wait)
+        self._stats["service_sec"] += service
+        self._stats["max_service_sec"] = max(self._stats["max_service_sec"], service)
+        stage_duration.observe(wait, stage="queue_wait")
+        stage_duration.observe(service, stage="job")
+        logging.info(f"[📋] Задача {job.id}: ожидание в очереди {wait:.2f} сек., обработка {service:.2f} сек.")
+
+    # === Метрики очереди ===
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        stats.update(workers=self.workers, running=self._running, queued=len(self._queue), draining=self._draining)
+        return stats
@@ -0,0 +1,143 @@
+import os
+import re
+import signal
+import asyncio
+import logging
+from aiohttp import web
+from aiogram import Bot, Dispatcher, BaseMiddleware
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Как бот получает обновления: polling — один процесс опрашивает Telegram,
+# webhook — Telegram присылает обновления на HTTP-сервер (можно запустить несколько копий за балансировщиком)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+
+# === Настройки вебхука ===
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")   # внешний https-адрес балансировщика
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько одновременных соединений Telegram открывает к вебхуку (1–100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+HEALTH_PATH = "/healthz"
+
+# Допустимый секрет по правилам Bot API: 1–256 символов A-Z, a-z, 0-9, _ и -
+SECRET_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+
+
+# === Учёт обрабатываемых обновлений ===
+class UpdateTracker(BaseMiddleware):
+    """
+    Внешний промежуточный слой диспетчера: считает обновления, обработка которых
+    ещё идёт (например, анализ в GigaChat после нажатия кнопки), чтобы при
+    остановке дождаться их, а не обрывать ответ пользователю на полуслове.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.active += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            if self.active == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f"[🛑] Не дождались {self.active} обработчиков за {timeout:.0f} сек.")
+            return False
+
+
+
+# === Режим long polling ===
+async def run_polling(dp: Dispatcher, bot: Bot):
+    # Удаляем вебхук и очищаем очередь необработанных обновлений
+    await bot.delete_webhook(drop_pending_updates=True)
+    # SIGINT/SIGTERM останавливают опрос; сессию бота закрываем сами —
+    # после остановки опроса задачи ещё дорабатывают и отправляют результаты
+    await dp.start_polling(bot, close_bot_session=False)
+
+
+# === Режим вебхука ===
+def _check_webhook_config():
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("Для BOT_MODE=webhook укажите WEBHOOK_BASE_URL — внешний адрес бота.")
+    if not SECRET_PATTERN.fullmatch(WEBHOOK_SECRET):
+        raise ValueError("Для BOT_MODE=webhook укажите WEBHOOK_SECRET: 1–256 символов A-Z, a-z, 0-9, _ и -.")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, get_stats, drain):
+    """
+    Принимает обновления на WEBAPP_HOST:WEBAPP_PORT до SIGTERM/SIGINT.
+    get_stats() — состояние очереди для /healthz; drain() — ожидание начатой работы
+    при остановке. Пока она идёт, /healthz отвечает 503, чтобы балансировщик
+    перестал направлять сюда трафик, а сервер продолжает принимать обновления
+    (например, нажатия кнопок к уже готовым расшифровкам).
+    """
+    _check_webhook_config()
+    draining = False
+
+    async def handle_health(request: web.Request) -> web.Response:
+        status = "draining" if draining else "ok"
+        return web.json_response({"status": status, "mode": "webhook", "jobs": get_stats()},
+                                 status=503 if draining else 200)
+
+    app = web.Application()
+    # Обновление обрабатывается в фоне, а Telegram сразу получает ответ:
+    # иначе долгий анализ упирается в таймаут Telegram и обновление приходит повторно.
+    # Запросы с неверным секретом отклоняются с 401
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET, handle_in_background=True
+    ).register(app, path=WEBHOOK_PATH)
+    app.router.add_get(HEALTH_PATH, handle_health)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    logging.info(f"[🌐] Вебхук слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}, проверка — {HEALTH_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C прерывает main() целиком
+            pass
+
+    try:
+        # Все копии бота регистрируют один и тот же адрес, поэтому повторная установка безопасна.
+        # Вебхук при остановке не удаляем: обновления принимают остальные копии
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        await stop.wait()
+        draining = True
+        logging.info("[🛑] Получен сигнал остановки, дорабатываем начатые задачи")
+        await drain()
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+        await runner.cleanup()
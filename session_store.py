@@ -0,0 +1,586 @@
+import os
+import sys
+import time
+import zlib
+import sqlite3
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+from functools import wraps
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from data_dir import BOT_DATA_DIR, private_dir, private_file
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Где хранить общее состояние пользователей и задач:
+# memory (по умолчанию) — в памяти одного процесса, sqlite — в файле (несколько процессов на одной машине,
+# переживает перезапуск), redis — на сервере Redis (копии бота на разных машинах)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_DB = Path(os.getenv("SESSION_DB", BOT_DATA_DIR / "sessions.sqlite3"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Префикс ключей, чтобы несколько ботов могли делить один Redis
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "tgbot:")
+# Предельное время подключения и ответа Redis, сек.: запросы синхронные, и зависший
+# Redis не должен надолго останавливать цикл событий бота
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))
+# Сколько часов после распознавания расшифровку можно анализировать
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+# Ограничения памяти: число пользователей и общий объём расшифровок в RAM
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "1000"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "100"))
+# Через сколько часов без обновлений задача перестаёт занимать место в лимите пользователя
+# (если копия бота, выполнявшая её, остановилась аварийно)
+JOB_STATE_TTL_HOURS = float(os.getenv("JOB_STATE_TTL_HOURS", "6"))
+
+# Состояния задачи в общем хранилище (те же, что у scheduler.ScheduledJob)
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_CANCELLED = "cancelled"
+
+
+
+# === Хранилище состояния недоступно (например, нет связи с Redis) ===
+class SessionStoreUnavailable(Exception):
+    pass
+
+
+
+# === Общее состояние пользователей и задач ===
+class SessionStore(ABC):
+    """
+    Последняя расшифровка пользователя, дата записи (для имени файла),
+    трассировка распознавания (анализ продолжает её же), отметка «ждём выбора
+    промпта» и статусы задач очереди.
+    get возвращает {"transcript": ..., "date_str": ..., "trace_id": ..., "saved_at": ...} или None.
+
+    Операции, которые одновременно могут выполнять разные копии бота, атомарны:
+    расшифровка более ранней записи не затирает более новую, кнопка выбора промпта
+    срабатывает один раз, лимит задач на пользователя действует для всех копий.
+    Все методы абстрактные: хранилище, в котором какого-то не хватает, не создаётся.
+    """
+
+    # --- Последняя расшифровка ---
+    @abstractmethod
+    def get(self, user_id: int) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, user_id: int, transcript: str, date_str: str, trace_id: str | None = None,
+            recorded_at: float | None = None) -> bool:
+        """
+        Сохраняет расшифровку и отмечает, что пользователь выбирает промпт.
+        recorded_at — время получения записи: если уже сохранена расшифровка
+        более поздней записи, ничего не меняет и возвращает False.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, user_id: int):
+        raise NotImplementedError
+
+    # --- Выбор промпта ---
+    @abstractmethod
+    def take_prompt_choice(self, user_id: int) -> bool:
+        """Снимает отметку «ждём выбора промпта». True получает только первый вызов."""
+        raise NotImplementedError
+
+    # --- Задачи очереди ---
+    @abstractmethod
+    def add_job(self, job_id: str, user_id: int, max_per_user: int) -> bool:
+        """Регистрирует задачу в очереди, если у пользователя меньше max_per_user активных задач."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def start_job(self, job_id: str, user_id: int) -> bool:
+        """Переводит задачу в работу. False — задачу отменили (возможно, через другую копию бота)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def cancel_job(self, job_id: str, user_id: int) -> bool:
+        """Отменяет задачу пользователя, ещё ожидающую в очереди."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish_job(self, job_id: str, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_job_status(self, job_id: str) -> str | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_stats(self) -> dict:
+        raise NotImplementedError
+
+
+
+# === В памяти: LRU с TTL и лимитом объёма ===
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl_sec: float = SESSION_TTL_HOURS * 3600, max_users: int = SESSION_MAX_USERS,
+                 max_bytes: float = SESSION_MAX_MB * 1024 * 1024, job_ttl_sec: float = JOB_STATE_TTL_HOURS * 3600):
+        self.ttl_sec = ttl_sec
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.job_ttl_sec = job_ttl_sec
+
+        # user_id -> сессия; порядок — от давно использованных к недавним
+        self._sessions: OrderedDict[int, dict] = OrderedDict()
+        self._bytes = 0
+        # job_id -> {"user_id", "status", "updated_at"}
+        self._jobs: dict[str, dict] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _live(self, user_id: int) -> dict | None:
+        entry = self._sessions.get(user_id)
+        if entry is not None and time.time() - entry["saved_at"] > self.ttl_sec:
+            self._remove(user_id)
+            self._stats["expired"] += 1
+            return None
+        return entry
+
+    def get(self, user_id: int) -> dict | None:
+        entry = self._live(user_id)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        self._sessions.move_to_end(user_id)
+        self._stats["hits"] += 1
+        return {key: entry[key] for key in ("transcript", "date_str", "trace_id", "saved_at")}
+
+    def set(self, user_id: int, transcript: str, date_str: str, trace_id: str | None = None,
+            recorded_at: float | None = None, saved_at: float | None = None) -> bool:
+        saved_at = saved_at or time.time()
+        recorded_at = recorded_at or saved_at
+        current = self._live(user_id)
+        if current is not None and current["recorded_at"] > recorded_at:
+            return False
+
+        self._remove(user_id)
+        size = sys.getsizeof(transcript)
+        self._sessions[user_id] = {
+            "transcript": transcript, "date_str": date_str, "trace_id": trace_id, "saved_at": saved_at,
+            "recorded_at": recorded_at, "prompt_pending": True, "size": size,
+        }
+        self._bytes += size
+        self._evict()
+        return True
+
+    def delete(self, user_id: int):
+        self._remove(user_id)
+
+    def take_prompt_choice(self, user_id: int) -> bool:
+        entry = self._live(user_id)
+        if entry is None or not entry["prompt_pending"]:
+            return False
+        entry["prompt_pending"] = False
+        return True
+
+    def _remove(self, user_id: int):
+        entry = self._sessions.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    # Вытесняем самые давно использованные, пока не уложимся в лимиты
+    def _evict(self):
+        while self._sessions and (len(self._sessions) > self.max_users or self._bytes > self.max_bytes):
+            _, entry = self._sessions.popitem(last=False)
+            self._bytes -= entry["size"]
+            self._stats["evictions"] += 1
+
+    def add_job(self, job_id: str, user_id: int, max_per_user: int) -> bool:
+        now = time.time()
+        for stale_id in [i for i, job in self._jobs.items() if now - job["updated_at"] > self.job_ttl_sec]:
+            del self._jobs[stale_id]
+        active = sum(1 for job in self._jobs.values()
+                     if job["user_id"] == user_id and job["status"] in (JOB_QUEUED, JOB_RUNNING))
+        if active >= max_per_user:
+            return False
+        self._jobs[job_id] = {"user_id": user_id, "status": JOB_QUEUED, "updated_at": now}
+        return True
+
+    def start_job(self, job_id: str, user_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != JOB_QUEUED:
+            return False
+        job.update(status=JOB_RUNNING, updated_at=time.time())
+        return True
+
+    def cancel_job(self, job_id: str, user_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job["user_id"] != user_id or job["status"] != JOB_QUEUED:
+            return False
+        job.update(status=JOB_CANCELLED, updated_at=time.time())
+        return True
+
+    def finish_job(self, job_id: str, user_id: int):
+        self._jobs.pop(job_id, None)
+
+    def get_job_status(self, job_id: str) -> str | None:
+        job = self._jobs.get(job_id)
+        return job["status"] if job else None
+
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        stats.update(users=len(self._sessions), bytes=self._bytes, jobs=len(self._jobs))
+        return stats
+
+
+
+# === SQLite: сжатые расшифровки на диске, недавние — в памяти ===
+class SqliteSessionStore(SessionStore):
+    """
+    Расшифровки хранятся в SQLite сжатыми (zlib) и переживают перезапуск бота.
+    Файл могут одновременно использовать несколько процессов на одной машине:
+    условные изменения выполняются одним SQL-запросом. В памяти держится LRU-кэш
+    расшифровок; он используется, только если на диске та же версия сессии
+    (совпадает saved_at), поэтому запись другого процесса не теряется.
+    """
+
+    def __init__(self, db_path: Path = SESSION_DB, ttl_sec: float = SESSION_TTL_HOURS * 3600,
+                 job_ttl_sec: float = JOB_STATE_TTL_HOURS * 3600):
+        self.ttl_sec = ttl_sec
+        self.job_ttl_sec = job_ttl_sec
+        self._memory = MemorySessionStore(ttl_sec=ttl_sec)
+        self._stats = {"disk_reads": 0}
+
+        # В базе полные тексты совещаний: закрытый каталог и файл 0600 (-wal и -shm получают те же права)
+        private_dir(db_path.parent)
+        # timeout — сколько ждать, пока другой процесс держит блокировку записи
+        self._conn = sqlite3.connect(private_file(db_path), timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id    INTEGER PRIMARY KEY,
+                transcript BLOB NOT NULL,
+                date_str   TEXT,
+                saved_at   REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS queue_jobs (
+                job_id     TEXT PRIMARY KEY,
+                user_id    INTEGER NOT NULL,
+                status     TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS queue_jobs_user ON queue_jobs (user_id, status);
+        """)
+        # Базы, созданные до появления трассировок и общего состояния
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        for column, ddl in (("trace_id", "TEXT"), ("recorded_at", "REAL"), ("prompt_pending", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in columns:
+                with self._conn as conn:
+                    conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} {ddl}")
+        removed = self.cleanup()
+        if removed:
+            logging.info(f"[🗂] Удалено устаревших сессий: {removed}")
+
+    def get(self, user_id: int) -> dict | None:
+        row = self._conn.execute(
+            "SELECT date_str, saved_at, trace_id FROM sessions WHERE user_id = ? AND saved_at >= ?",
+            (user_id, time.time() - self.ttl_sec)
+        ).fetchone()
+        if row is None:
+            self._memory.delete(user_id)
+            return None
+        date_str, saved_at, trace_id = row
+
+        cached = self._memory.get(user_id)
+        if cached is not None and cached["saved_at"] == saved_at:
+            return cached
+
+        # В памяти нет или там устаревшая версия (сессию перезаписал другой процесс)
+        blob = self._conn.execute("SELECT transcript FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if blob is None:
+            return None
+        self._stats["disk_reads"] += 1
+        transcript = zlib.decompress(blob[0]).decode("utf-8")
+        self._memory.delete(user_id)
+        self._memory.set(user_id, transcript, date_str, trace_id, saved_at=saved_at)
+        return {"transcript": transcript, "date_str": date_str, "trace_id": trace_id, "saved_at": saved_at}
+
+    def set(self, user_id: int, transcript: str, date_str: str, trace_id: str | None = None,
+            recorded_at: float | None = None) -> bool:
+        now = time.time()
+        recorded_at = recorded_at or now
+        with self._conn as conn:
+            # Вставка или замена одним запросом: сессия более поздней записи не затирается
+            cursor = conn.execute(
+                """
+                INSERT INTO sessions (user_id, transcript, date_str, saved_at, trace_id, recorded_at, prompt_pending)
+                VALUES (?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    transcript = excluded.transcript, date_str = excluded.date_str, saved_at = excluded.saved_at,
+                    trace_id = excluded.trace_id, recorded_at = excluded.recorded_at, prompt_pending = 1
+                WHERE sessions.recorded_at IS NULL OR sessions.recorded_at <= excluded.recorded_at
+                    OR sessions.saved_at < ?
+                """,
+                (user_id, zlib.compress(transcript.encode("utf-8")), date_str, now, trace_id, recorded_at,
+                 now - self.ttl_sec)
+            )
+        if cursor.rowcount == 0:
+            return False
+        self._memory.delete(user_id)
+        self._memory.set(user_id, transcript, date_str, trace_id, recorded_at, saved_at=now)
+        return True
+
+    def delete(self, user_id: int):
+        with self._conn as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        self._memory.delete(user_id)
+
+    def take_prompt_choice(self, user_id: int) -> bool:
+        with self._conn as conn:
+            cursor = conn.execute(
+                "UPDATE sessions SET prompt_pending = 0 WHERE user_id = ? AND prompt_pending = 1 AND saved_at >= ?",
+                (user_id, time.time() - self.ttl_sec)
+            )
+        return cursor.rowcount == 1
+
+    def add_job(self, job_id: str, user_id: int, max_per_user: int) -> bool:
+        now = time.time()
+        with self._conn as conn:
+            # Проверка лимита и вставка — один запрос, поэтому два процесса не займут одно место
+            cursor = conn.execute(
+                """
+                INSERT INTO queue_jobs (job_id, user_id, status, updated_at)
+                SELECT ?, ?, ?, ?
+                WHERE (SELECT COUNT(*) FROM queue_jobs
+                       WHERE user_id = ? AND status IN (?, ?) AND updated_at >= ?) < ?
+                """,
+                (job_id, user_id, JOB_QUEUED, now, user_id, JOB_QUEUED, JOB_RUNNING, now - self.job_ttl_sec,
+                 max_per_user)
+            )
+        return cursor.rowcount == 1
+
+    def start_job(self, job_id: str, user_id: int) -> bool:
+        with self._conn as conn:
+            cursor = conn.execute(
+                "UPDATE queue_jobs SET status = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                (JOB_RUNNING, time.time(), job_id, JOB_QUEUED)
+            )
+        return cursor.rowcount == 1
+
+    def cancel_job(self, job_id: str, user_id: int) -> bool:
+        with self._conn as conn:
+            cursor = conn.execute(
+                "UPDATE queue_jobs SET status = ?, updated_at = ? WHERE job_id = ? AND user_id = ? AND status = ?",
+                (JOB_CANCELLED, time.time(), job_id, user_id, JOB_QUEUED)
+            )
+        return cursor.rowcount == 1
+
+    def finish_job(self, job_id: str, user_id: int):
+        with self._conn as conn:
+            conn.execute("DELETE FROM queue_jobs WHERE job_id = ?", (job_id,))
+
+    def get_job_status(self, job_id: str) -> str | None:
+        row = self._conn.execute("SELECT status FROM queue_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    # Удаление сессий старше TTL и задач, брошенных остановившимися процессами
+    def cleanup(self) -> int:
+        now = time.time()
+        with self._conn as conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE saved_at < ?", (now - self.ttl_sec,))
+            conn.execute("DELETE FROM queue_jobs WHERE updated_at < ?", (now - self.job_ttl_sec,))
+        return cursor.rowcount
+
+    def get_stats(self) -> dict:
+        stats = self._memory.get_stats()
+        stats.update(self._stats)
+        stats["stored"] = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        stats["jobs"] = self._conn.execute("SELECT COUNT(*) FROM queue_jobs").fetchone()[0]
+        return stats
+
+
+
+# === Redis: общее состояние копий бота на разных машинах ===
+
+# Условные изменения выполняются Lua-скриптами — Redis выполняет скрипт целиком, не прерываясь
+
+# KEYS[1] — сессия; ARGV: расшифровка, дата, трассировка, время записи, время сохранения, TTL
+_SET_SESSION = """
+local current = redis.call('HGET', KEYS[1], 'recorded_at')
+if current and tonumber(current) > tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'transcript', ARGV[1], 'date_str', ARGV[2], 'trace_id', ARGV[3],
+           'recorded_at', ARGV[4], 'saved_at', ARGV[5], 'prompt_pending', '1')
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return 1
+"""
+
+# KEYS[1] — активные задачи пользователя (sorted set: id → время обновления), KEYS[2] — задача;
+# ARGV: id задачи, пользователь, сейчас, граница устаревания, лимит, TTL
+_ADD_JOB = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[4])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[5]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('HSET', KEYS[2], 'user_id', ARGV[2], 'status', 'queued')
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return 1
+"""
+
+# KEYS[1] — задача, KEYS[2] — активные задачи пользователя; ARGV: id задачи, сейчас, TTL
+_START_JOB = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'queued' then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', 'running')
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+return 1
+"""
+
+# KEYS[1] — задача, KEYS[2] — активные задачи пользователя; ARGV: id задачи, пользователь
+_CANCEL_JOB = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'queued' or redis.call('HGET', KEYS[1], 'user_id') ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', 'cancelled')
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+# Ошибки Redis (таймаут, разрыв соединения) превращаются в SessionStoreUnavailable
+def _redis_call(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except self._errors as e:
+            raise SessionStoreUnavailable(f"Redis недоступен: {e}") from e
+    return wrapper
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Состояние в Redis: каждая сессия — хэш со сжатой расшифровкой и TTL,
+    задачи — хэши статусов и sorted set активных задач пользователя.
+    Запросы синхронные, как и у SQLite, поэтому каждый ограничен REDIS_TIMEOUT:
+    при медленном или недоступном Redis обработчик получает SessionStoreUnavailable
+    не позже чем через REDIS_TIMEOUT, а не останавливает бота.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX, ttl_sec: float = SESSION_TTL_HOURS * 3600,
+                 job_ttl_sec: float = JOB_STATE_TTL_HOURS * 3600):
+        # redis нужен только этому режиму, поэтому импортируется здесь
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("Для SESSION_BACKEND=redis установите пакет redis: pip install redis") from e
+        self._redis = client = redis.Redis.from_url(
+            url, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT, health_check_interval=30
+        )
+        self._errors = redis.RedisError
+        self.prefix = prefix
+        self.ttl_sec = int(ttl_sec)
+        self.job_ttl_sec = int(job_ttl_sec)
+        self._set_session = client.register_script(_SET_SESSION)
+        self._add_job = client.register_script(_ADD_JOB)
+        self._start_job = client.register_script(_START_JOB)
+        self._cancel_job = client.register_script(_CANCEL_JOB)
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _session_key(self, user_id: int) -> str:
+        return f"{self.prefix}session:{user_id}"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
+
+    def _user_jobs_key(self, user_id: int) -> str:
+        return f"{self.prefix}user_jobs:{user_id}"
+
+    @_redis_call
+    def get(self, user_id: int) -> dict | None:
+        transcript, date_str, trace_id, saved_at = self._redis.hmget(
+            self._session_key(user_id), "transcript", "date_str", "trace_id", "saved_at"
+        )
+        if transcript is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return {
+            "transcript": zlib.decompress(transcript).decode("utf-8"),
+            "date_str": date_str.decode("utf-8"),
+            "trace_id": trace_id.decode("utf-8") or None,
+            "saved_at": float(saved_at),
+        }
+
+    @_redis_call
+    def set(self, user_id: int, transcript: str, date_str: str, trace_id: str | None = None,
+            recorded_at: float | None = None) -> bool:
+        now = time.time()
+        stored = self._set_session(
+            keys=[self._session_key(user_id)],
+            args=[zlib.compress(transcript.encode("utf-8")), date_str, trace_id or "", recorded_at or now, now,
+                  self.ttl_sec]
+        )
+        return bool(stored)
+
+    @_redis_call
+    def delete(self, user_id: int):
+        self._redis.delete(self._session_key(user_id))
+
+    @_redis_call
+    def take_prompt_choice(self, user_id: int) -> bool:
+        # HDEL атомарен: поле удаляет (и получает 1) только первый вызов
+        return self._redis.hdel(self._session_key(user_id), "prompt_pending") == 1
+
+    @_redis_call
+    def add_job(self, job_id: str, user_id: int, max_per_user: int) -> bool:
+        now = time.time()
+        added = self._add_job(
+            keys=[self._user_jobs_key(user_id), self._job_key(job_id)],
+            args=[job_id, user_id, now, now - self.job_ttl_sec, max_per_user, self.job_ttl_sec]
+        )
+        return bool(added)
+
+    @_redis_call
+    def start_job(self, job_id: str, user_id: int) -> bool:
+        started = self._start_job(
+            keys=[self._job_key(job_id), self._user_jobs_key(user_id)],
+            args=[job_id, time.time(), self.job_ttl_sec]
+        )
+        return bool(started)
+
+    @_redis_call
+    def cancel_job(self, job_id: str, user_id: int) -> bool:
+        cancelled = self._cancel_job(
+            keys=[self._job_key(job_id), self._user_jobs_key(user_id)],
+            args=[job_id, user_id]
+        )
+        return bool(cancelled)
+
+    @_redis_call
+    def finish_job(self, job_id: str, user_id: int):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._job_key(job_id))
+        pipe.zrem(self._user_jobs_key(user_id), job_id)
+        pipe.execute()
+
+    @_redis_call
+    def get_job_status(self, job_id: str) -> str | None:
+        status = self._redis.hget(self._job_key(job_id), "status")
+        return status.decode("utf-8") if status is not None else None
+
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        # Расшифровки хранятся на сервере Redis, в памяти бота их нет
+        stats["users"] = 0
+        return stats
+
+
+
+# === Хранилище по настройке SESSION_BACKEND ===
+def create_session_store() -> SessionStore:
+    if SESSION_BACKEND == "memory":
+        return MemorySessionStore()
+    if SESSION_BACKEND == "redis":
+        return RedisSessionStore()
+    return SqliteSessionStore()
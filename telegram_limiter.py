@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import logging
+from aiogram import Bot
+from aiogram.methods import TelegramMethod, GetUpdates, GetFile, GetMe, DeleteWebhook, SetWebhook
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from dotenv import load_dotenv
+
+from metrics import track, Histogram
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Лимиты Telegram: около 1 сообщения в секунду в один чат и около 30 в секунду всего
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))          # запросов в секунду в один чат
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))          # допустимая пачка подряд
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))      # запросов в секунду всего
+TG_GLOBAL_BURST = int(os.getenv("TG_GLOBAL_BURST", "25"))
+# Сколько раз повторять запрос после TelegramRetryAfter
+TG_SEND_MAX_RETRIES = int(os.getenv("TG_SEND_MAX_RETRIES", "3"))
+
+# Служебные запросы, которые не относятся к отправке сообщений и не ограничиваются
+UNLIMITED_METHODS = (GetUpdates, GetFile, GetMe, DeleteWebhook, SetWebhook)
+# Состояние чатов, не использованных дольше этого, удаляется
+CHAT_IDLE_SEC = 300
+
+# От вызова до фактической отправки: ожидание своей очереди чата и корзин токенов
+queue_delay = Histogram("bot_telegram_queue_delay_seconds", "Ожидание отправки запроса в Telegram",
+                        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+
+
+
+# === Корзина токенов ===
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0            # после retry_after — не отправлять до этого момента
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+
+# Очередь одного чата: замок сохраняет порядок запросов (asyncio.Lock пропускает ожидающих по очереди)
+class ChatState:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.bucket = TokenBucket(TG_CHAT_RATE, TG_CHAT_BURST)
+        self.last_used = time.monotonic()
+
+
+
+# === Исходящие запросы к Telegram с учётом лимитов ===
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """
+    Промежуточный слой сессии бота: все отправки и правки сообщений (в том числе
+    документов) проходят через общую корзину токенов и корзину своего чата.
+    Запросы в один чат выполняются строго по очереди, в порядке вызова.
+    На TelegramRetryAfter чат ставится на паузу на указанное время, и запрос повторяется.
+    Считает задержку в очереди: от вызова до фактической отправки.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_BURST)
+        self._chats: dict[int | str, ChatState] = {}
+        self._stats = {"requests": 0, "retry_after": 0, "queue_delay_sec": 0.0, "max_queue_delay_sec": 0.0}
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        if isinstance(method, UNLIMITED_METHODS):
+            return await make_request(bot, method)
+
+        queued_at = time.monotonic()
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await self._send(make_request, bot, method, None, queued_at)
+
+        chat = self._chat(chat_id)
+        async with chat.lock:
+            try:
+                return await self._send(make_request, bot, method, chat, queued_at)
+            finally:
+                chat.last_used = time.monotonic()
+
+    async def _send(self, make_request, bot: Bot, method: TelegramMethod, chat: ChatState | None,
+                    queued_at: float):
+        for attempt in range(TG_SEND_MAX_RETRIES + 1):
+            if chat is not None:
+                await chat.bucket.acquire()
+            await self.global_bucket.acquire()
+            if attempt == 0:
+                self._record_delay(time.monotonic() - queued_at)
+            try:
+                with track("send", method=type(method).__name__, attempt=attempt + 1):
+                    return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._stats["retry_after"] += 1
+                if attempt == TG_SEND_MAX_RETRIES:
+                    raise
+                logging.warning(f"[📮] Telegram просит подождать {e.retry_after} сек. ({type(method).__name__})")
+                # Без чата (например, ответ на callback) ждём глобально
+                (chat.bucket if chat is not None else self.global_bucket).pause(e.retry_after)
+
+    def _record_delay(self, delay: float):
+        self._stats["requests"] += 1
+        self._stats["queue_delay_sec"] += delay
+        self._stats["max_queue_delay_sec"] = max(self._stats["max_queue_delay_sec"], delay)
+        queue_delay.observe(delay)
+        if delay > 1:
+            logging.debug(f"[📮] Запрос ждал отправки {delay:.2f} сек.")
+
+    def _chat(self, chat_id: int | str) -> ChatState:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            self._prune()
+            chat = self._chats[chat_id] = ChatState()
+        return chat
+
+    # Удаляем давно не использованные чаты, чтобы словарь не рос бесконечно
+    def _prune(self):
+        if len(self._chats) < 1000:
+            return
+        threshold = time.monotonic() - CHAT_IDLE_SEC
+        for chat_id, chat in list(self._chats.items()):
+            if chat.last_used < threshold and not chat.lock.locked():
+                del self._chats[chat_id]
+
+    # === Метрики очереди отправки ===
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["avg_queue_delay_sec"] = stats["queue_delay_sec"] / stats["requests"] if stats["requests"] else 0.0
+        stats["waiting"] = sum(1 for chat in self._chats.values() if chat.lock.locked())
+        return stats
@@ -0,0 +1,163 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from aiohttp import BasicAuth
+from dotenv import load_dotenv
+
+from http_client import get_session
+from metrics import track
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Общий OAuth-эндпоинт Сбера для SaluteSpeech и GigaChat
+SBER_OAUTH_URL = os.getenv("SBER_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+
+# За сколько секунд до истечения токен обновляется в фоне
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "120"))
+# Время жизни токена, если сервер не вернул expires_at (токены Сбера живут 30 минут)
+DEFAULT_TOKEN_TTL = 30 * 60
+# Пауза перед повтором неудачного фонового обновления
+REFRESH_RETRY_DELAY = 10
+
+# Все созданные менеджеры — чтобы корректно остановить их при завершении бота
+_managers: list["TokenManager"] = []
+
+
+
+# === Менеджер OAuth-токенов с кэшированием до истечения срока ===
+class TokenManager:
+    """
+    Хранит токен доступа для одной области (scope) и выдаёт его всем вызывающим.
+
+    Токен кэшируется до момента незадолго до expires_at и обновляется в фоне.
+    Если токена нет, одновременные вызовы ждут один общий запрос обновления,
+    а не отправляют каждый свой.
+    """
+
+    def __init__(self, scope: str, client_id: str, secret: str, token_url: str = SBER_OAUTH_URL):
+        self.scope = scope
+        self.client_id = client_id
+        self.secret = secret
+        self.token_url = token_url
+
+        self._token: str | None = None
+        self._expires_at = 0.0                              # unix-время истечения, сек.
+        self._refresh_task: asyncio.Task | None = None     # текущий запрос обновления
+        self._background_task: asyncio.Task | None = None  # плановое фоновое обновление
+
+        _managers.append(self)
+
+    # Токен ещё далеко от истечения
+    def _is_fresh(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at - TOKEN_REFRESH_MARGIN
+
+    # Токен ещё действителен, хотя его пора обновить
+    def _is_usable(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at - 5
+
+    async def get_token(self) -> str:
+        if self._is_fresh():
+            return self._token
+
+        refresh = self._start_refresh()
+        if self._is_usable():
+            # Отдаём действующий токен, обновление идёт в фоне
+            return self._token
+
+        # shield — отмена одного вызывающего не должна отменять общий запрос
+        return await asyncio.shield(refresh)
+
+    # Сбросить токен (например, сервер ответил 401)
+    def invalidate(self):
+        self._token = None
+        self._expires_at = 0.0
+
+    # Запускает обновление, если оно ещё не идёт
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            # Исключение забирают ожидающие вызовы; без них — не ругаемся в лог
+            self._refresh_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._refresh_task
+
+    async def _refresh(self) -> str:
+        token, expires_at = await self._fetch_token()
+        self._token = token
+        self._expires_at = expires_at
+        logging.debug(f"[🔑] Токен {self.scope} обновлён, действует {expires_at - time.time():.0f} сек.")
+        self._schedule_background_refresh(expires_at - TOKEN_REFRESH_MARGIN - time.time())
+        return token
+
+    # Планирует обновление токена незадолго до истечения
+    def _schedule_background_refresh(self, delay: float):
+        if self._background_task is not None and not self._background_task.done():
+            self._background_task.cancel()
+        self._background_task = asyncio.create_task(self._background_refresh(max(delay, 0)))
+
+    async def _background_refresh(self, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await asyncio.shield(self._start_refresh())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"[🔑] Не удалось обновить токен {self.scope} в фоне: {e}")
+            if self._is_usable():
+                self._schedule_background_refresh(REFRESH_RETRY_DELAY)
+
+    # Запрос нового токена у OAuth-сервера
+    async def _fetch_token(self) -> tuple[str, float]:
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",  # Формат тела запроса
+            "Accept": "application/json",                         # Формат ответа
+            "RqUID": str(uuid.uuid4())                            # Уникальный ID запроса
+        }
+        data = {
+            "scope": self.scope  # Область применения токена
+        }
+
+        session = get_session()
+        with track("oauth", scope=self.scope) as span:
+            async with session.post(
+                self.token_url,
+                headers=headers,
+                data=data,
+                auth=BasicAuth(self.client_id, self.secret),
+                ssl=False                          # отключаем проверку сертификата
+            ) as resp:
+                span.set(http_status=resp.status)
+                if resp.status == 200:
+                    json_data = await resp.json()
+                else:
+                    text = await resp.text()
+                    raise Exception(f"Ошибка получения токена: {resp.status} — {text}")
+
+        # expires_at приходит в миллисекундах unix-времени
+        expires_at = json_data.get("expires_at")
+        if expires_at:
+            expires_at = float(expires_at)
+            if expires_at > 1e12:
+                expires_at /= 1000
+        else:
+            expires_at = time.time() + DEFAULT_TOKEN_TTL
+
+        return json_data.get("access_token"), expires_at
+
+    async def close(self):
+        for task in (self._background_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except BaseException:
+                    pass
+
+
+
+# === Остановка фоновых обновлений всех менеджеров ===
+async def close_token_managers():
+    for manager in _managers:
+        await manager.close()
@@ -0,0 +1,134 @@
+"""
+Просмотр трассировок из TRACE_FILE: куда ушло время конкретной задачи.
+
+    python trace_view.py                      # последние трассировки
+    python trace_view.py --user 123456789     # последние трассировки пользователя
+    python trace_view.py 3f2a9c               # «водопад» трассировки (достаточно начала ID)
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+from datetime import datetime
+from collections import defaultdict
+
+from tracing import TRACE_FILE, TRACE_BACKUPS
+
+BAR_WIDTH = 40
+
+
+
+# === Чтение спанов: сначала старые файлы ротации, затем текущий ===
+def read_spans(path: Path) -> list[dict]:
+    files = [path.with_name(f"{path.name}.{i}") for i in range(TRACE_BACKUPS, 0, -1)] + [path]
+    spans = []
+    for file in files:
+        if not file.exists():
+            continue
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Строка, оборванная при аварийной остановке
+                    continue
+    return spans
+
+
+def group_traces(spans: list[dict]) -> dict[str, list[dict]]:
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span["trace_id"]].append(span)
+    return traces
+
+
+def trace_bounds(spans: list[dict]) -> tuple[float, float]:
+    start = min(s["start"] for s in spans)
+    end = max(s["start"] + s["duration_sec"] for s in spans)
+    return start, end
+
+
+def format_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+
+# === Список трассировок ===
+def print_list(traces: dict[str, list[dict]], user_id: int | None, limit: int):
+    rows = []
+    for trace_id, spans in traces.items():
+        roots = [s for s in spans if s["parent_id"] is None]
+        if user_id is not None and not any(s["attrs"].get("user_id") == user_id for s in roots):
+            continue
+        start, end = trace_bounds(spans)
+        failed = any(s["status"] == "error" for s in spans)
+        rows.append((start, trace_id, end - start, "+".join(s["name"] for s in sorted(roots, key=lambda s: s["start"])),
+                     roots[0]["attrs"].get("user_id", "") if roots else "", failed))
+
+    rows.sort()
+    for start, trace_id, duration, names, user, failed in rows[-limit:]:
+        mark = "⚠️" if failed else "  "
+        print(f"{mark} {format_time(start)}  {trace_id}  {duration:9.2f} сек.  {names:<18} {user}")
+    if not rows:
+        print("Трассировок не найдено.")
+
+
+
+# === «Водопад» одной трассировки ===
+def print_waterfall(spans: list[dict]):
+    start, end = trace_bounds(spans)
+    total = max(end - start, 1e-9)
+
+    children = defaultdict(list)
+    ids = {s["span_id"] for s in spans}
+    for span in spans:
+        # Спан, чей родитель не записан (например, бот остановили посреди задачи), показываем как корневой
+        parent = span["parent_id"] if span["parent_id"] in ids else None
+        children[parent].append(span)
+    for items in children.values():
+        items.sort(key=lambda s: s["start"])
+
+    print(f"Трассировка {spans[0]['trace_id']}: {format_time(start)}, всего {total:.2f} сек.\n")
+    print(f"{'начало':>9}  {'длит.':>9}  {'этап':<40}  шкала")
+
+    def walk(span: dict, depth: int):
+        offset = span["start"] - start
+        bar_start = int(offset / total * BAR_WIDTH)
+        bar_len = max(1, round(span["duration_sec"] / total * BAR_WIDTH))
+        bar = " " * bar_start + "█" * min(bar_len, BAR_WIDTH - bar_start)
+
+        attrs = " ".join(f"{k}={v}" for k, v in span["attrs"].items() if v is not None)
+        label = ("  " * depth + span["name"])[:40]
+        mark = " ⚠️ " + span["error"] if span["status"] == "error" and span.get("error") else ""
+        print(f"{offset:8.2f}s  {span['duration_sec']:8.2f}s  {label:<40}  |{bar:<{BAR_WIDTH}}|  {attrs}{mark}")
+        for child in children[span["span_id"]]:
+            walk(child, depth + 1)
+
+    for root in children[None]:
+        walk(root, 0)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Просмотр трассировок бота")
+    parser.add_argument("trace_id", nargs="?", help="ID трассировки или его начало")
+    parser.add_argument("--user", type=int, help="только трассировки этого пользователя")
+    parser.add_argument("--limit", type=int, default=20, help="сколько последних трассировок показать")
+    parser.add_argument("--file", type=Path, default=TRACE_FILE, help="файл трассировок")
+    args = parser.parse_args()
+
+    traces = group_traces(read_spans(args.file))
+    if not args.trace_id:
+        print_list(traces, args.user, args.limit)
+        return
+
+    matches = [trace_id for trace_id in traces if trace_id.startswith(args.trace_id)]
+    if not matches:
+        sys.exit(f"Трассировка {args.trace_id} не найдена в {args.file}")
+    if len(matches) > 1:
+        sys.exit(f"Под {args.trace_id} подходит несколько трассировок: {', '.join(matches[:5])}")
+    print_waterfall(traces[matches[0]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import logging.handlers
+from pathlib import Path
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+from data_dir import BOT_DATA_DIR, private_dir, private_opener
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Куда писать трассировки (JSONL, по одному спану в строке) и когда начинать новый файл
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACE_FILE = Path(os.getenv("TRACE_FILE", BOT_DATA_DIR / "bot_traces.jsonl"))
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "20"))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+
+# Текущий спан задачи: вложенные спаны становятся его потомками.
+# asyncio.create_task и gather копируют контекст, поэтому части, распознаваемые
+# параллельно, видят спан, в котором их запустили
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+# Спаны пишутся в файл отдельным потоком, чтобы запись на диск не тормозила бота
+_logger = logging.getLogger("bot.traces")
+_logger.propagate = False
+_listener: logging.handlers.QueueListener | None = None
+
+
+
+# === Спан: именованный интервал времени внутри трассировки ===
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str | None = None, attrs: dict | None = None,
+                 start: float | None = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = dict(attrs or {})
+        # Начало — по настенным часам (для сопоставления спанов), длительность — по монотонным
+        self.start = start if start is not None else time.time()
+        # Спан, начатый в прошлом (start задан), учитывает уже прошедшее время
+        self._started = time.perf_counter() - max(time.time() - self.start, 0.0)
+        self.status = "ok"
+        self.error: str | None = None
+        self._ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error: BaseException):
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"[:500]
+
+    def end(self, duration: float | None = None):
+        if self._ended:
+            return
+        self._ended = True
+        if duration is None:
+            duration = time.perf_counter() - self._started
+        _export({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_sec": round(duration, 6),
+            "status": self.status,
+            "error": self.error,
+            "attrs": self.attrs,
+        })
+
+
+# Заглушка вне трассировки: спаны не пишутся, атрибуты игнорируются
+class _NoopSpan:
+    trace_id = None
+    span_id = None
+
+    def set(self, **attrs):
+        pass
+
+    def fail(self, error: BaseException):
+        pass
+
+    def end(self, duration: float | None = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_span() -> "Span | _NoopSpan":
+    return _current_span.get() or NOOP_SPAN
+
+
+def current_trace_id() -> str | None:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+# Атрибуты текущего спана (номер части, HTTP-статус, число повторов и т. п.)
+def set_attributes(**attrs):
+    current_span().set(**attrs)
+
+
+
+# === Начало трассировки ===
+def start_trace(name: str, trace_id: str | None = None, start: float | None = None, **attrs) -> Span | _NoopSpan:
+    """
+    Корневой спан новой трассировки или продолжения trace_id (например, анализ
+    уже распознанной записи). start — unix-время начала, если работа началась раньше
+    (сообщение получено, а задача ждала в очереди). Спан включают через use_span.
+    """
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    return Span(name, trace_id or new_trace_id(), attrs=attrs, start=start)
+
+
+# === Выполнение блока внутри спана: он становится текущим и закрывается на выходе ===
+@contextmanager
+def use_span(span: Span | _NoopSpan):
+    token = _current_span.set(span if isinstance(span, Span) else None)
+    try:
+        yield span
+    except BaseException as e:
+        span.fail(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+
+# === Вложенный спан ===
+@contextmanager
+def span(name: str, activate: bool = True, **attrs):
+    """
+    Дочерний спан текущего. Вне трассировки ничего не пишет.
+    activate=False — не делать спан текущим; нужно внутри асинхронных генераторов,
+    которые отдают управление вызывающему посреди спана.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+
+    child = Span(name, parent.trace_id, parent.span_id, attrs)
+    token = _current_span.set(child) if activate else None
+    try:
+        yield child
+    except BaseException as e:
+        child.fail(e)
+        raise
+    finally:
+        if token is not None:
+            _current_span.reset(token)
+        child.end()
+
+
+# Спан за уже прошедший интервал (например, ожидание в очереди)
+def record_span(name: str, start: float, end: float | None = None, **attrs):
+    parent = _current_span.get()
+    if parent is None:
+        return
+    end = end if end is not None else time.time()
+    Span(name, parent.trace_id, parent.span_id, attrs, start=start).end(duration=max(end - start, 0.0))
+
+
+
+# === Запись в файл ===
+def _export(record: dict):
+    if _listener is not None:
+        _logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+# Файлы трассировок (и новые после ротации) создаются с правами 0600
+class _PrivateRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def _open(self):
+        return open(self.baseFilename, self.mode, encoding=self.encoding, errors=self.errors, opener=private_opener)
+
+
+def start_tracing():
+    """Запускает фоновую запись спанов в TRACE_FILE с ротацией по размеру."""
+    global _listener
+    if not TRACE_ENABLED or _listener is not None:
+        return
+    private_dir(TRACE_FILE.parent)
+    file_handler = _PrivateRotatingFileHandler(
+        TRACE_FILE, maxBytes=int(TRACE_MAX_MB * 1024 * 1024), backupCount=TRACE_BACKUPS, encoding="utf-8"
+    )
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _logger.setLevel(logging.INFO)
+    _logger.addHandler(logging.handlers.QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+    logging.info(f"[🧭] Трассировки пишутся в {TRACE_FILE}")
+
+
+def stop_tracing():
+    """Дописывает накопленные спаны и закрывает файл."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+    for handler in listener.handlers:
+        handler.close()
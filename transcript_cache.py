@@ -0,0 +1,159 @@
+import os
+import time
+from pathlib import Path
+from dotenv import load_dotenv
+
+from data_dir import BOT_DATA_DIR, private_dir, private_opener
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Каталог кэша и политика вытеснения
+CACHE_DIR = Path(os.getenv("TRANSCRIPT_CACHE_DIR", BOT_DATA_DIR / "transcript_cache"))
+CACHE_MAX_MB = float(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "200"))            # общий размер расшифровок
+CACHE_MAX_AGE_DAYS = float(os.getenv("TRANSCRIPT_CACHE_MAX_AGE_DAYS", "7"))  # не использованные дольше — удаляются
+
+# Расшифровки лежат в файлах <sha256>.txt, а file_unique_id Telegram
+# ссылается на хэш содержимого через маленький файл в by_file_id/
+TEXT_DIR = CACHE_DIR / "by_hash"
+FILE_ID_DIR = CACHE_DIR / "by_file_id"
+
+# Счётчики попаданий и промахов
+_stats = {"hits_file_id": 0, "hits_hash": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+
+def _text_path(content_hash: str) -> Path:
+    return TEXT_DIR / f"{content_hash}.txt"
+
+
+def _file_id_path(file_unique_id: str) -> Path:
+    return FILE_ID_DIR / file_unique_id
+
+
+# Читает расшифровку и обновляет время доступа (для вытеснения давно не использованных)
+def _read_text(content_hash: str) -> str | None:
+    path = _text_path(content_hash)
+    try:
+        text = path.read_text(encoding="utf-8")
+    except (FileNotFoundError, OSError):
+        return None
+    if time.time() - path.stat().st_mtime > CACHE_MAX_AGE_DAYS * 86400:
+        return None
+    os.utime(path)
+    return text
+
+
+
+# === Поиск по file_unique_id Telegram (без скачивания файла) ===
+def get_by_file_id(file_unique_id: str | None) -> str | None:
+    if not file_unique_id:
+        return None
+    try:
+        content_hash = _file_id_path(file_unique_id).read_text(encoding="utf-8").strip()
+    except (FileNotFoundError, OSError):
+        return None
+
+    text = _read_text(content_hash)
+    if text is not None:
+        _stats["hits_file_id"] += 1
+    return text
+
+
+
+# === Поиск по хэшу содержимого аудио ===
+def get_by_hash(content_hash: str, file_unique_id: str | None = None) -> str | None:
+    text = _read_text(content_hash)
+    if text is None:
+        _stats["misses"] += 1
+        return None
+
+    _stats["hits_hash"] += 1
+    # Тот же файл пришёл с другим file_unique_id — запомним, чтобы в следующий раз не скачивать
+    if file_unique_id:
+        _link_file_id(file_unique_id, content_hash)
+    return text
+
+
+
+# === Сохранение расшифровки ===
+def put(content_hash: str, text: str, file_unique_id: str | None = None):
+    private_dir(CACHE_DIR)
+    private_dir(TEXT_DIR)
+    # Пишем во временный файл и переименовываем — читатель не увидит половину текста
+    path = _text_path(content_hash)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8", opener=private_opener) as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+    if file_unique_id:
+        _link_file_id(file_unique_id, content_hash)
+
+    _stats["stores"] += 1
+    evict()
+
+
+def _link_file_id(file_unique_id: str, content_hash: str):
+    private_dir(CACHE_DIR)
+    private_dir(FILE_ID_DIR)
+    with open(_file_id_path(file_unique_id), "w", encoding="utf-8", opener=private_opener) as f:
+        f.write(content_hash)
+
+
+
+# === Вытеснение по возрасту и общему размеру ===
+def evict():
+    """
+    Удаляет расшифровки, не использованные дольше CACHE_MAX_AGE_DAYS, затем — самые давно
+    использованные, пока общий размер больше CACHE_MAX_MB.
+    Ссылки file_unique_id на удалённые расшифровки удаляются следом.
+    """
+    now = time.time()
+    max_age = CACHE_MAX_AGE_DAYS * 86400
+    entries = []
+    total = 0
+
+    for path in TEXT_DIR.glob("*.txt"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > max_age:
+            _remove(path)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    # Самые давно использованные — первыми
+    entries.sort()
+    limit = CACHE_MAX_MB * 1024 * 1024
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        _remove(path)
+        total -= size
+
+    # Ссылки, указывающие на уже удалённые расшифровки
+    for link in FILE_ID_DIR.glob("*"):
+        try:
+            if not _text_path(link.read_text(encoding="utf-8").strip()).exists():
+                link.unlink()
+        except (FileNotFoundError, OSError):
+            pass
+
+
+def _remove(path: Path):
+    try:
+        path.unlink()
+        _stats["evictions"] += 1
+    except FileNotFoundError:
+        pass
+
+
+
+# === Счётчики кэша ===
+def get_cache_stats() -> dict[str, int]:
+    stats = dict(_stats)
+    stats["hits"] = stats["hits_file_id"] + stats["hits_hash"]
+    return stats